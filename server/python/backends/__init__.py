@@ -0,0 +1,55 @@
+"""
+Backends de plataforma para los servicios de tracking y overlay
+
+Selección (en orden): argumento `name`, variable de entorno ALQVIMIA_BACKEND
+("win32" | "simulated"), y por defecto "win32" en Windows o "simulated" en
+otras plataformas. Con ALQVIMIA_SIM_SCENE se carga un escenario JSON para el
+backend simulado.
+"""
+import os
+import sys
+from typing import Optional
+
+from .base import (
+    GDIBackend,
+    KeyboardHookBackend,
+    MouseHookBackend,
+    OverlaySurface,
+    OverlayWindowBackend,
+    PlatformBackend,
+    ScreenBackend,
+    UIABackend,
+    WindowBackend,
+    rgb,
+)
+
+
+def get_backend(name: Optional[str] = None) -> PlatformBackend:
+    """Crea el backend de plataforma solicitado"""
+    name = name or os.environ.get("ALQVIMIA_BACKEND") or ("win32" if sys.platform == "win32" else "simulated")
+
+    if name == "win32":
+        from .win32 import Win32Backend
+        return Win32Backend()
+
+    if name == "simulated":
+        from .simulated import SimulatedDesktop
+        scene = os.environ.get("ALQVIMIA_SIM_SCENE")
+        return SimulatedDesktop.load(scene) if scene else SimulatedDesktop.demo()
+
+    raise ValueError(f"Backend desconocido: {name}")
+
+
+__all__ = [
+    "GDIBackend",
+    "KeyboardHookBackend",
+    "MouseHookBackend",
+    "OverlaySurface",
+    "OverlayWindowBackend",
+    "PlatformBackend",
+    "ScreenBackend",
+    "UIABackend",
+    "WindowBackend",
+    "get_backend",
+    "rgb",
+]
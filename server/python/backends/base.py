@@ -0,0 +1,360 @@
+"""
+Interfaces de backend de plataforma
+Separan las llamadas a UI Automation, GDI, geometría de ventanas y hooks de
+mouse del código de los servicios, para poder ejecutarlos sin Windows.
+"""
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Propiedades que UIABackend.inspect_point puede resolver en lote
+PROPERTIES = (
+    "Name", "ControlTypeName", "ClassName", "AutomationId", "IsEnabled",
+    "IsOffscreen", "BoundingRectangle", "RuntimeId", "Value", "ParentName", "IsLeaf", "IsPassword"
+)
+
+
+def read_properties(control, properties: Iterable[str]) -> Dict:
+    """Lee las propiedades pedidas de un control una a una (sin CacheRequest).
+    BoundingRectangle se devuelve como (left, top, right, bottom)."""
+    values = {}
+    for prop in properties:
+        if prop == "BoundingRectangle":
+            rect = control.BoundingRectangle
+            values[prop] = (rect.left, rect.top, rect.right, rect.bottom)
+        elif prop == "RuntimeId":
+            try:
+                values[prop] = tuple(control.GetRuntimeId() or ()) or None
+            except Exception:
+                values[prop] = None
+        elif prop == "Value":
+            value = None
+            try:
+                if hasattr(control, 'GetValuePattern'):
+                    vp = control.GetValuePattern()
+                    if vp:
+                        value = vp.Value
+            except Exception:
+                pass
+            values[prop] = value
+        elif prop == "ParentName":
+            parent = control.GetParentControl()
+            values[prop] = parent.Name if parent else None
+        elif prop == "IsLeaf":
+            values[prop] = control.GetFirstChildControl() is None
+        else:
+            values[prop] = getattr(control, prop)
+    return values
+
+
+class WalkNode:
+    """Nodo devuelto por UIABackend.walk: control, propiedades e hijos"""
+
+    __slots__ = ("control", "values", "children", "truncated")
+
+    def __init__(self, control, values: Dict):
+        self.control = control
+        self.values = values
+        self.children: List["WalkNode"] = []
+        # True si se omitieron hijos por el presupuesto de profundidad/anchura
+        self.truncated = False
+
+
+def rgb(r: int, g: int, b: int) -> int:
+    """Color en formato COLORREF (equivalente a win32api.RGB)"""
+    return r | (g << 8) | (b << 16)
+
+
+class UIABackend:
+    """Acceso a UI Automation.
+
+    `control_from_point` devuelve un objeto con el subconjunto de la interfaz
+    de `uiautomation.Control` que usan los servicios: Name, ControlTypeName,
+    ClassName, AutomationId, IsEnabled, IsOffscreen, BoundingRectangle (con
+    left/top/right/bottom, width() y height()), GetParentControl(),
+    GetFirstChildControl(), GetNextSiblingControl(), GetValuePattern() y
+    GetRuntimeId().
+    """
+
+    available = False
+
+    def init_thread(self):
+        """Prepara el hilo actual para llamadas UIA (CoInitialize)"""
+
+    def uninit_thread(self):
+        """Libera el apartamento COM del hilo actual"""
+
+    def control_from_point(self, x: int, y: int):
+        raise NotImplementedError
+
+    def inspect_point(self, x: int, y: int, properties: Iterable[str]) -> Optional[Dict]:
+        """Propiedades (ver PROPERTIES) del control en (x, y), o None.
+
+        Los backends reales las piden en una sola consulta (CacheRequest);
+        esta implementación lee una propiedad por llamada.
+        """
+        control = self.control_from_point(x, y)
+        if not control:
+            return None
+        return read_properties(control, properties)
+
+    def focused_control(self):
+        """Control con el foco del teclado"""
+        raise NotImplementedError
+
+    def inspect_focused(self, properties: Iterable[str]) -> Optional[Dict]:
+        """Propiedades del control con el foco, o None (como inspect_point)"""
+        control = self.focused_control()
+        if not control:
+            return None
+        return read_properties(control, properties)
+
+    def subscribe_focus_changes(self, callback: Callable[[Optional[tuple]], None]):
+        """Suscribe `callback(runtime_id)` a los cambios de foco. Devuelve una
+        función para desuscribirse, o None si el backend no tiene eventos de
+        foco (las ráfagas de teclado se cierran por clic, tecla especial o
+        inactividad)."""
+        return None
+
+    def control_from_handle(self, hwnd: int):
+        """Control raíz de una ventana de nivel superior"""
+        raise NotImplementedError
+
+    def walk(self, root, properties: Iterable[str], max_depth: int = 12,
+             max_children: int = 500, max_nodes: int = 20000) -> Optional[WalkNode]:
+        """Recorre el subárbol de `root` en anchura dentro del presupuesto.
+
+        Implementación por defecto con GetFirstChildControl/GetNextSiblingControl
+        (una llamada por nodo y propiedad); los backends reales cargan el
+        subárbol con una sola CacheRequest.
+        """
+        properties = tuple(properties)
+        root_node = WalkNode(root, read_properties(root, properties))
+        queue = deque([(root_node, 0)])
+        count = 1
+        while queue:
+            node, depth = queue.popleft()
+            child = node.control.GetFirstChildControl()
+            if child is not None and (depth >= max_depth or count >= max_nodes):
+                node.truncated = True
+                continue
+            while child is not None:
+                if len(node.children) >= max_children or count >= max_nodes:
+                    node.truncated = True
+                    break
+                child_node = WalkNode(child, read_properties(child, properties))
+                node.children.append(child_node)
+                queue.append((child_node, depth + 1))
+                count += 1
+                child = child.GetNextSiblingControl()
+        return root_node
+
+    def parent_of(self, control) -> Optional[Tuple[Optional[tuple], object]]:
+        """(RuntimeId, control) del padre en la vista de control, o None"""
+        parent = control.GetParentControl()
+        if not parent:
+            return None
+        try:
+            return tuple(parent.GetRuntimeId() or ()) or None, parent
+        except Exception:
+            return None, parent
+
+    def subscribe_structure_changes(self, root, callback: Callable[[Optional[tuple], object], None]):
+        """Suscribe `callback(runtime_id, control)` a cambios de estructura del
+        subárbol de `root`. Como el sender de UIA, `control` es el hijo en
+        ChildAdded y el padre en ChildRemoved/ChildrenInvalidated. Devuelve una
+        función para desuscribirse, o None si el backend no soporta eventos (el
+        árbol se refresca por re-recorridos)."""
+        return None
+
+
+class WindowBackend:
+    """Geometría y estado de ventanas de nivel superior"""
+
+    def get_window_rect(self, hwnd: int) -> Tuple[int, int, int, int]:
+        """(left, top, right, bottom); lanza excepción si la ventana no existe"""
+        raise NotImplementedError
+
+    def get_foreground_window(self) -> int:
+        raise NotImplementedError
+
+    def window_process(self, hwnd: int) -> Optional[int]:
+        """Id del proceso dueño de la ventana (None si no existe)"""
+        return None
+
+    def window_from_point(self, x: int, y: int) -> Optional[int]:
+        """Ventana de nivel superior bajo el punto (None si no se sabe).
+        No debe depender de la aplicación: se usa para atribuir la latencia
+        de las inspecciones a su proceso."""
+        return None
+
+    def process_windows(self, pid: int) -> List[int]:
+        """Ventanas de nivel superior visibles del proceso `pid`"""
+        return []
+
+    def subscribe_window_events(self, pids: Iterable[int],
+                                callback: Callable[[str, int], None]):
+        """Suscribe `callback(kind, hwnd)` a eventos de ventana de los procesos
+        `pids` (kind: location, minimize, restore, create, show, hide,
+        destroy), a los cambios de ventana en primer plano (foreground, de
+        cualquier proceso) y a los location/minimize/destroy de la ventana que
+        esté en primer plano en cada momento (también sin `pids`). Devuelve una
+        función para desuscribirse, o None si el backend no soporta eventos (la
+        geometría se refresca por TTL)."""
+        return None
+
+
+class GDIBackend:
+    """Primitivas GDI usadas por el overlay"""
+
+    PS_SOLID = 0
+
+    def get_dc(self) -> int:
+        raise NotImplementedError
+
+    def release_dc(self, hdc: int):
+        raise NotImplementedError
+
+    def create_pen(self, style: int, width: int, color: int) -> int:
+        raise NotImplementedError
+
+    def get_null_brush(self) -> int:
+        raise NotImplementedError
+
+    def select_object(self, hdc: int, obj: int) -> int:
+        raise NotImplementedError
+
+    def delete_object(self, obj: int):
+        raise NotImplementedError
+
+    def rectangle(self, hdc: int, left: int, top: int, right: int, bottom: int):
+        raise NotImplementedError
+
+    def draw_text(self, hdc: int, x: int, y: int, text: str, color: int):
+        """Texto con fondo transparente (etiquetas de resaltado)"""
+        raise NotImplementedError
+
+    def invalidate_rect(self, rect: Optional[Tuple[int, int, int, int]] = None):
+        """Invalida un área del escritorio (None = todo el escritorio)"""
+        raise NotImplementedError
+
+    def update_desktop(self):
+        raise NotImplementedError
+
+
+class OverlaySurface:
+    """Ventana de overlay retenida: transparente, click-through y topmost.
+
+    Se crea, dibuja y destruye en el mismo hilo (el de render del overlay).
+    begin() devuelve un DC en coordenadas de pantalla para el área pedida,
+    present() publica lo dibujado con una sola actualización de la ventana y
+    hide() la oculta: limpiar no repinta el escritorio.
+    """
+
+    # Color que la ventana trata como transparente (None: canal alfa)
+    color_key: Optional[int] = None
+    # True si las capturas de pantalla (ScreenBackend.grab) no ven la ventana
+    excluded_from_capture = False
+
+    def begin(self, left: int, top: int, right: int, bottom: int) -> int:
+        raise NotImplementedError
+
+    def present(self):
+        raise NotImplementedError
+
+    def hide(self):
+        raise NotImplementedError
+
+    def pump(self):
+        """Procesa los mensajes pendientes del hilo dueño de la ventana"""
+
+    def close(self):
+        raise NotImplementedError
+
+
+class OverlayWindowBackend:
+    """Crea las ventanas retenidas del overlay (una por ElementOverlay)"""
+
+    available = False
+
+    def create_surface(self) -> OverlaySurface:
+        raise NotImplementedError
+
+
+class MouseHookBackend:
+    """Hook global de mouse.
+
+    `on_click` recibe (x, y, button, pressed) con button en
+    "left" | "right" | "middle".
+    """
+
+    available = False
+
+    def create_listener(self, on_move: Callable[[int, int], None],
+                        on_click: Callable[[int, int, str, bool], None]):
+        """Devuelve un objeto con start() y stop()"""
+        raise NotImplementedError
+
+
+class KeyboardHookBackend:
+    """Hook global de teclado.
+
+    `on_press`/`on_release` reciben (key, char): `key` es el nombre de la
+    tecla ("a", "enter", "ctrl_l", "f5"...) y `char` el carácter que produce
+    (None en las teclas especiales).
+    """
+
+    available = False
+
+    def create_listener(self, on_press: Callable[[str, Optional[str]], None],
+                        on_release: Callable[[str, Optional[str]], None]):
+        """Devuelve un objeto con start() y stop()"""
+        raise NotImplementedError
+
+
+class ScreenBackend:
+    """Captura de regiones de la pantalla.
+
+    Los backends reales mantienen el capturador abierto entre llamadas (sin
+    reabrir DCs por captura) y copian solo la región pedida.
+    """
+
+    available = False
+
+    def grab(self, left: int, top: int, width: int, height: int) -> Tuple[bytes, int, int]:
+        """Píxeles BGRA de la región: (datos, ancho, alto)"""
+        raise NotImplementedError
+
+    def close(self):
+        """Libera el capturador"""
+
+
+class PlatformBackend:
+    """Agrupa los backends de una plataforma"""
+
+    name = "base"
+    # Módulos que el backend importa de forma diferida (para startup_report)
+    heavy_modules: Tuple[str, ...] = ()
+
+    def __init__(self, uia: UIABackend, window: WindowBackend, gdi: GDIBackend, mouse: MouseHookBackend,
+                 screen: ScreenBackend = None, keyboard: KeyboardHookBackend = None,
+                 overlay: OverlayWindowBackend = None):
+        self.uia = uia
+        self.window = window
+        self.gdi = gdi
+        self.mouse = mouse
+        self.screen = screen or ScreenBackend()
+        self.keyboard = keyboard or KeyboardHookBackend()
+        self.overlay = overlay or OverlayWindowBackend()
+
+    def prewarm(self):
+        """Carga por adelantado los módulos diferidos (se llama en segundo plano)"""
+
+    def capabilities(self) -> dict:
+        return {
+            "backend": self.name,
+            "pynput": self.mouse.available,
+            "keyboard": self.keyboard.available,
+            "uiautomation": self.uia.available,
+            "screenCapture": self.screen.available,
+            "layeredOverlay": self.overlay.available
+        }
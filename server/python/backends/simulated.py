@@ -0,0 +1,923 @@
+"""
+Backend simulado - Escritorio determinista en proceso
+Árbol programable de ventanas y controles con latencia configurable por
+llamada, para ejecutar y medir TrackingService, UIInspector y ElementOverlay
+sin Windows.
+"""
+import itertools
+import json
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .base import (
+    GDIBackend,
+    KeyboardHookBackend,
+    MouseHookBackend,
+    OverlaySurface,
+    OverlayWindowBackend,
+    PlatformBackend,
+    ScreenBackend,
+    UIABackend,
+    WalkNode,
+    WindowBackend,
+)
+
+# Latencias por defecto (segundos) aproximadas a una llamada COM cross-process
+DEFAULT_LATENCY = {
+    "control_from_point": 0.0,
+    "property": 0.0,
+    "parent": 0.0,
+    "children": 0.0,
+    "value_pattern": 0.0,
+    "window_rect": 0.0,
+    "foreground": 0.0,
+    "gdi": 0.0,
+    "tree_walk": 0.0,
+    "enum_windows": 0.0,
+    "grab": 0.0,
+    "focus": 0.0,
+}
+
+# Proceso de las ventanas que no indican uno
+DEFAULT_PID = 1000
+
+# Geometría de una ventana minimizada (como la que devuelve GetWindowRect)
+MINIMIZED_RECT = (-32000, -32000, -31840, -31972)
+
+# Color del fondo del escritorio (BGRA)
+DESKTOP_COLOR = b"\x40\x30\x20\xff"
+
+# Actualizaciones que recuerda cada ventana retenida simulada
+OVERLAY_UPDATE_HISTORY = 1000
+
+# RuntimeId únicos por control, como los que asigna UIA
+_runtime_ids = itertools.count(1)
+
+
+class SimRect:
+    """Equivalente a uiautomation.Rect"""
+
+    __slots__ = ("left", "top", "right", "bottom")
+
+    def __init__(self, left: int, top: int, right: int, bottom: int):
+        self.left = left
+        self.top = top
+        self.right = right
+        self.bottom = bottom
+
+    def width(self) -> int:
+        return self.right - self.left
+
+    def height(self) -> int:
+        return self.bottom - self.top
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.left <= x < self.right and self.top <= y < self.bottom
+
+
+class SimValuePattern:
+    def __init__(self, control: "SimControl"):
+        self._control = control
+
+    @property
+    def Value(self):
+        self._control.desktop._cost("property")
+        return self._control.value
+
+
+class SimControl:
+    """Control simulado con la interfaz de uiautomation.Control que usan los servicios"""
+
+    def __init__(self, desktop: "SimulatedDesktop", control_type: str, rect: SimRect,
+                 name: str = "", class_name: str = "", automation_id: str = "",
+                 value: Optional[str] = None, enabled: bool = True, offscreen: bool = False,
+                 password: bool = False):
+        self.desktop = desktop
+        self.control_type = control_type
+        self.rect = rect
+        self.name = name
+        self.class_name = class_name
+        self.automation_id = automation_id
+        self.value = value
+        self.enabled = enabled
+        self.offscreen = offscreen
+        self.password = password
+        self.parent: Optional["SimControl"] = None
+        self.children: List["SimControl"] = []
+        self.runtime_id = (42, next(_runtime_ids))
+
+    def add(self, child: "SimControl") -> "SimControl":
+        child.parent = self
+        self.children.append(child)
+        # Como UIA: el sender de ChildAdded es el hijo nuevo
+        self.desktop._structure_changed(child)
+        return child
+
+    def remove(self, child: "SimControl"):
+        self.children.remove(child)
+        child.parent = None
+        self.desktop._structure_changed(self)
+
+    def _prop(self, value):
+        self.desktop._cost("property")
+        return value
+
+    @property
+    def Name(self):
+        return self._prop(self.name)
+
+    @property
+    def ControlTypeName(self):
+        return self._prop(self.control_type)
+
+    @property
+    def ClassName(self):
+        return self._prop(self.class_name)
+
+    @property
+    def AutomationId(self):
+        return self._prop(self.automation_id)
+
+    @property
+    def IsEnabled(self):
+        return self._prop(self.enabled)
+
+    @property
+    def IsOffscreen(self):
+        return self._prop(self.offscreen)
+
+    @property
+    def IsPassword(self):
+        return self._prop(self.password)
+
+    @property
+    def BoundingRectangle(self):
+        r = self.rect
+        return self._prop(SimRect(r.left, r.top, r.right, r.bottom))
+
+    def GetRuntimeId(self):
+        self.desktop._cost("property")
+        return list(self.runtime_id)
+
+    def GetParentControl(self):
+        self.desktop._cost("parent")
+        return self.parent
+
+    def GetFirstChildControl(self):
+        self.desktop._cost("children")
+        return self.children[0] if self.children else None
+
+    def GetNextSiblingControl(self):
+        self.desktop._cost("children")
+        if self.parent is None:
+            return None
+        siblings = self.parent.children
+        index = siblings.index(self)
+        return siblings[index + 1] if index + 1 < len(siblings) else None
+
+    def GetValuePattern(self):
+        self.desktop._cost("value_pattern")
+        if self.value is None:
+            return None
+        return SimValuePattern(self)
+
+    def hit_test(self, x: int, y: int) -> Optional["SimControl"]:
+        """Control más profundo que contiene el punto (el último hijo queda encima)"""
+        if not self.rect.contains(x, y):
+            return None
+        for child in reversed(self.children):
+            found = child.hit_test(x, y)
+            if found is not None:
+                return found
+        return self
+
+    def offset(self, dx: int, dy: int):
+        r = self.rect
+        self.rect = SimRect(r.left + dx, r.top + dy, r.right + dx, r.bottom + dy)
+        for child in self.children:
+            child.offset(dx, dy)
+
+
+class SimWindow(SimControl):
+    def __init__(self, desktop: "SimulatedDesktop", hwnd: int, rect: SimRect, name: str = "",
+                 class_name: str = "SimWindow", pid: int = DEFAULT_PID):
+        super().__init__(desktop, "WindowControl", rect, name=name, class_name=class_name)
+        self.hwnd = hwnd
+        self.pid = pid
+        self.restored_rect: Optional[SimRect] = None  # rect previo mientras está minimizada
+
+
+class _SimUIA(UIABackend):
+    available = True
+
+    def __init__(self, desktop: "SimulatedDesktop"):
+        self.desktop = desktop
+
+    def control_from_point(self, x: int, y: int):
+        self.desktop._cost("control_from_point")
+        return self._hit_test(x, y)
+
+    def _hit_test(self, x: int, y: int):
+        with self.desktop._lock:
+            for window in self.desktop.windows:
+                found = window.hit_test(x, y)
+                if found is not None:
+                    return found
+        return None
+
+    def inspect_point(self, x: int, y: int, properties):
+        """Equivalente a ElementFromPointBuildCache: un solo viaje para todas
+        las propiedades; padre e hijos siguen costando su propia llamada."""
+        self.desktop._cost("control_from_point")
+        control = self._hit_test(x, y)
+        if control is None:
+            return None
+        self.desktop._maybe_hang(control)
+        return self._cached(control, properties)
+
+    def _cached(self, control: SimControl, properties) -> Dict:
+        r = control.rect
+        raw = {
+            "Name": control.name,
+            "ControlTypeName": control.control_type,
+            "ClassName": control.class_name,
+            "AutomationId": control.automation_id,
+            "IsEnabled": control.enabled,
+            "IsOffscreen": control.offscreen,
+            "BoundingRectangle": (r.left, r.top, r.right, r.bottom),
+            "RuntimeId": control.runtime_id,
+            "Value": control.value,
+            "IsPassword": control.password,
+        }
+        values = {}
+        for prop in properties:
+            if prop == "ParentName":
+                self.desktop._cost("parent")
+                values[prop] = control.parent.name if control.parent else None
+            elif prop == "IsLeaf":
+                # Los hijos llegan en el mismo viaje (TreeScope Children de la CacheRequest)
+                values[prop] = not control.children
+            else:
+                values[prop] = raw[prop]
+        return values
+
+    def focused_control(self):
+        self.desktop._cost("focus")
+        return self.desktop.focused
+
+    def inspect_focused(self, properties):
+        """Equivalente a GetFocusedElementBuildCache: un solo viaje"""
+        self.desktop._cost("focus")
+        control = self.desktop.focused
+        if control is None:
+            return None
+        self.desktop._maybe_hang(control)
+        return self._cached(control, properties)
+
+    def subscribe_focus_changes(self, callback):
+        with self.desktop._lock:
+            self.desktop._focus_listeners.append(callback)
+
+        def unsubscribe():
+            with self.desktop._lock:
+                if callback in self.desktop._focus_listeners:
+                    self.desktop._focus_listeners.remove(callback)
+        return unsubscribe
+
+    def control_from_handle(self, hwnd: int):
+        return self.desktop.get_window(hwnd)
+
+    def walk(self, root, properties, max_depth: int = 12, max_children: int = 500,
+             max_nodes: int = 20000):
+        """Como el walk de win32: un BuildUpdatedCache (elemento + hijos) por
+        nodo expandido, así que se cobra un `tree_walk` por nodo"""
+        properties = tuple(properties)
+        expanded = 0
+        with self.desktop._lock:
+            root_node = WalkNode(root, _raw_properties(root, properties))
+            queue = [(root_node, 0)]
+            count = 1
+            for node, depth in queue:
+                if depth >= max_depth or count >= max_nodes:
+                    if node.control.children:
+                        node.truncated = True
+                    continue
+                expanded += 1
+                children = node.control.children
+                for child in children:
+                    if len(node.children) >= max_children or count >= max_nodes:
+                        node.truncated = True
+                        break
+                    child_node = WalkNode(child, _raw_properties(child, properties))
+                    node.children.append(child_node)
+                    queue.append((child_node, depth + 1))
+                    count += 1
+        # Fuera del lock: las consultas de otros hilos no esperan al recorrido
+        for _ in range(expanded):
+            self.desktop._cost("tree_walk")
+        return root_node
+
+    def subscribe_structure_changes(self, root, callback):
+        entry = (root, callback)
+        with self.desktop._lock:
+            self.desktop._structure_listeners.append(entry)
+
+        def unsubscribe():
+            with self.desktop._lock:
+                if entry in self.desktop._structure_listeners:
+                    self.desktop._structure_listeners.remove(entry)
+        return unsubscribe
+
+
+def _raw_properties(control: SimControl, properties) -> Dict:
+    """Propiedades de un control sin costo (ya están en la caché del recorrido)"""
+    r = control.rect
+    raw = {
+        "Name": control.name,
+        "ControlTypeName": control.control_type,
+        "ClassName": control.class_name,
+        "AutomationId": control.automation_id,
+        "IsEnabled": control.enabled,
+        "IsOffscreen": control.offscreen,
+        "BoundingRectangle": (r.left, r.top, r.right, r.bottom),
+        "RuntimeId": control.runtime_id,
+        "Value": control.value,
+        "ParentName": control.parent.name if control.parent else None,
+        "IsLeaf": not control.children,
+        "IsPassword": control.password,
+    }
+    return {prop: raw[prop] for prop in properties}
+
+
+class _SimWindow(WindowBackend):
+    def __init__(self, desktop: "SimulatedDesktop"):
+        self.desktop = desktop
+
+    def get_window_rect(self, hwnd: int) -> Tuple[int, int, int, int]:
+        self.desktop._cost("window_rect")
+        window = self.desktop.get_window(hwnd)
+        if window is None:
+            raise OSError(f"Ventana inválida: {hwnd}")
+        r = window.rect
+        return (r.left, r.top, r.right, r.bottom)
+
+    def get_foreground_window(self) -> int:
+        self.desktop._cost("foreground")
+        return self.desktop.foreground
+
+    def window_from_point(self, x: int, y: int) -> Optional[int]:
+        with self.desktop._lock:
+            for window in self.desktop.windows:
+                if window.rect.contains(x, y):
+                    return window.hwnd
+        return None
+
+    def window_process(self, hwnd: int) -> Optional[int]:
+        window = self.desktop.get_window(hwnd)
+        return window.pid if window is not None else None
+
+    def process_windows(self, pid: int) -> List[int]:
+        self.desktop._cost("enum_windows")
+        return [w.hwnd for w in self.desktop.windows if w.pid == pid]
+
+    def subscribe_window_events(self, pids, callback):
+        pids = frozenset(pids)
+        entry = (pids, callback)
+        with self.desktop._lock:
+            self.desktop._window_listeners.append(entry)
+
+        def unsubscribe():
+            with self.desktop._lock:
+                if entry in self.desktop._window_listeners:
+                    self.desktop._window_listeners.remove(entry)
+        return unsubscribe
+
+
+class SimGDI(GDIBackend):
+    """GDI simulado que solo cuenta objetos y operaciones"""
+
+    def __init__(self, desktop: "SimulatedDesktop"):
+        self.desktop = desktop
+        self._next_handle = 1000
+        self._handle_lock = threading.Lock()
+        self.live_objects = set()
+        self.live_dcs = set()
+
+    def _handle(self) -> int:
+        with self._handle_lock:
+            self._next_handle += 1
+            return self._next_handle
+
+    def get_dc(self) -> int:
+        self.desktop._cost("gdi")
+        hdc = self._handle()
+        self.live_dcs.add(hdc)
+        return hdc
+
+    def release_dc(self, hdc: int):
+        self.desktop._cost("gdi")
+        self.live_dcs.discard(hdc)
+
+    def create_pen(self, style: int, width: int, color: int) -> int:
+        self.desktop._cost("gdi")
+        pen = self._handle()
+        self.live_objects.add(pen)
+        return pen
+
+    def get_null_brush(self) -> int:
+        self.desktop._cost("gdi")
+        return 5
+
+    def select_object(self, hdc: int, obj: int) -> int:
+        self.desktop._cost("gdi")
+        return 1
+
+    def delete_object(self, obj: int):
+        self.desktop._cost("gdi")
+        self.live_objects.discard(obj)
+
+    def rectangle(self, hdc: int, left: int, top: int, right: int, bottom: int):
+        self.desktop._cost("gdi")
+
+    def draw_text(self, hdc: int, x: int, y: int, text: str, color: int):
+        self.desktop._cost("gdi")
+
+    def invalidate_rect(self, rect: Optional[Tuple[int, int, int, int]] = None):
+        self.desktop._cost("gdi_invalidate_all" if rect is None else "gdi")
+
+    def update_desktop(self):
+        self.desktop._cost("gdi")
+
+
+class SimOverlaySurface(OverlaySurface):
+    """Ventana retenida simulada: registra cada actualización. `updates`
+    guarda el área publicada por present() o None por cada hide() (las
+    últimas OVERLAY_UPDATE_HISTORY)."""
+
+    color_key = 0
+
+    def __init__(self, desktop: "SimulatedDesktop"):
+        self.desktop = desktop
+        # DC de memoria de la ventana: vive lo mismo que ella
+        self.hdc = desktop.gdi.get_dc()
+        self.updates: "deque[Optional[Tuple[int, int, int, int]]]" = deque(maxlen=OVERLAY_UPDATE_HISTORY)
+        self.visible = False
+        self.closed = False
+        self._area: Optional[Tuple[int, int, int, int]] = None
+
+    def begin(self, left: int, top: int, right: int, bottom: int) -> int:
+        self.desktop._cost("gdi")
+        self._area = (left, top, right, bottom)
+        return self.hdc
+
+    def present(self):
+        self.desktop._cost("overlay_update")
+        self.updates.append(self._area)
+        self.visible = True
+
+    def hide(self):
+        if self.visible:
+            self.desktop._cost("overlay_update")
+            self.updates.append(None)
+            self.visible = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.visible = False
+            self.desktop.gdi.release_dc(self.hdc)
+
+
+class SimOverlayWindow(OverlayWindowBackend):
+    available = True
+
+    def __init__(self, desktop: "SimulatedDesktop"):
+        self.desktop = desktop
+        self.surfaces: List[SimOverlaySurface] = []
+
+    def create_surface(self) -> SimOverlaySurface:
+        surface = SimOverlaySurface(self.desktop)
+        # Solo las vivas: las cerradas ya no se pueden inspeccionar con sentido
+        self.surfaces = [s for s in self.surfaces if not s.closed]
+        self.surfaces.append(surface)
+        return surface
+
+
+def _color(*parts) -> bytes:
+    """Color BGRA estable derivado del contenido del control"""
+    digest = zlib.crc32("|".join(str(p) for p in parts).encode("utf-8"))
+    return bytes((64 + (digest & 0x7f), 64 + ((digest >> 8) & 0x7f), 64 + ((digest >> 16) & 0x7f), 255))
+
+
+class SimScreen(ScreenBackend):
+    """Pinta la región pedida a partir del árbol: cada control es un
+    rectángulo de color según su tipo y nombre, con una banda de "texto"
+    (barras oscuras según su valor o nombre). Cambiar el valor de un campo
+    cambia la imagen, igual que en pantalla."""
+
+    available = True
+
+    def __init__(self, desktop: "SimulatedDesktop"):
+        self.desktop = desktop
+
+    def grab(self, left: int, top: int, width: int, height: int) -> Tuple[bytes, int, int]:
+        self.desktop._cost("grab")
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Región vacía: {width}x{height}")
+        pixels = bytearray(DESKTOP_COLOR * (width * height))
+        with self.desktop._lock:
+            windows = list(reversed(self.desktop.windows))
+        for window in windows:
+            self._paint(pixels, window, left, top, width, height)
+        return bytes(pixels), width, height
+
+    def _paint(self, pixels: bytearray, control: SimControl, left: int, top: int, width: int, height: int):
+        r = control.rect
+        x0, x1 = max(r.left, left), min(r.right, left + width)
+        y0, y1 = max(r.top, top), min(r.bottom, top + height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        row = _color(control.control_type, control.name) * (x1 - x0)
+        text = control.value if control.value is not None else control.name
+        band = None
+        if text:
+            # Barras oscuras en columnas según los bits del texto
+            bits = zlib.crc32(str(text).encode("utf-8"))
+            band = bytearray(row)
+            for i in range(x1 - x0):
+                if (bits >> ((x0 - r.left + i) // 3 % 32)) & 1:
+                    band[i * 4:i * 4 + 4] = b"\x10\x10\x10\xff"
+            band = bytes(band)
+        band_top, band_bottom = r.top + r.height() // 3, r.bottom - r.height() // 3
+        for y in range(y0, y1):
+            start = ((y - top) * width + (x0 - left)) * 4
+            pixels[start:start + len(row)] = band if band is not None and band_top <= y < band_bottom else row
+        for child in control.children:
+            self._paint(pixels, child, left, top, width, height)
+
+
+class _SimListener:
+    def __init__(self, mouse: "SimMouse", on_move, on_click):
+        self.mouse = mouse
+        self.on_move = on_move
+        self.on_click = on_click
+
+    def start(self):
+        self.mouse._listeners.append(self)
+
+    def stop(self):
+        if self in self.mouse._listeners:
+            self.mouse._listeners.remove(self)
+
+
+class SimMouse(MouseHookBackend):
+    """Hook de mouse simulado: move()/click() invocan los callbacks en el hilo
+    que los llama, como lo haría el hilo del hook de pynput. El clic enfoca
+    el control bajo el cursor (después del hook, como en Windows)."""
+
+    available = True
+
+    def __init__(self, desktop: "SimulatedDesktop" = None):
+        self._listeners: List[_SimListener] = []
+        self.position = (0, 0)
+        self.desktop = desktop
+
+    def create_listener(self, on_move: Callable[[int, int], None],
+                        on_click: Callable[[int, int, str, bool], None]):
+        return _SimListener(self, on_move, on_click)
+
+    def move(self, x: int, y: int):
+        self.position = (x, y)
+        for listener in list(self._listeners):
+            listener.on_move(x, y)
+
+    def click(self, x: int, y: int, button: str = "left"):
+        self.move(x, y)
+        for pressed in (True, False):
+            for listener in list(self._listeners):
+                listener.on_click(x, y, button, pressed)
+        if self.desktop is not None:
+            self.desktop.focus_at(x, y)
+
+
+class _SimKeyListener:
+    def __init__(self, keyboard: "SimKeyboard", on_press, on_release):
+        self.keyboard = keyboard
+        self.on_press = on_press
+        self.on_release = on_release
+
+    def start(self):
+        self.keyboard._listeners.append(self)
+
+    def stop(self):
+        if self in self.keyboard._listeners:
+            self.keyboard._listeners.remove(self)
+
+
+class SimKeyboard(KeyboardHookBackend):
+    """Hook de teclado simulado: press()/release() invocan los callbacks en
+    el hilo que los llama. type_text() y hotkey() son atajos de escenario."""
+
+    available = True
+
+    def __init__(self):
+        self._listeners: List[_SimKeyListener] = []
+
+    def create_listener(self, on_press: Callable[[str, Optional[str]], None],
+                        on_release: Callable[[str, Optional[str]], None]):
+        return _SimKeyListener(self, on_press, on_release)
+
+    def press(self, key: str, char: Optional[str] = None):
+        for listener in list(self._listeners):
+            listener.on_press(key, char)
+
+    def release(self, key: str, char: Optional[str] = None):
+        for listener in list(self._listeners):
+            listener.on_release(key, char)
+
+    def tap(self, key: str, char: Optional[str] = None):
+        self.press(key, char)
+        self.release(key, char)
+
+    def type_text(self, text: str, interval: float = 0.0):
+        """Teclea `text` carácter a carácter (mayúsculas con shift)"""
+        for char in text:
+            shifted = char.isupper()
+            if shifted:
+                self.press("shift")
+            self.tap("space" if char == " " else char.lower(), char)
+            if shifted:
+                self.release("shift")
+            if interval:
+                time.sleep(interval)
+
+    def hotkey(self, *keys: str):
+        """Pulsa las teclas en orden y las suelta al revés (p.ej. "ctrl_l", "c")"""
+        for key in keys:
+            self.press(key)
+        for key in reversed(keys):
+            self.release(key)
+
+
+class SimulatedDesktop(PlatformBackend):
+    """Escritorio simulado. `windows` está en orden Z (la primera queda encima)"""
+
+    name = "simulated"
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None):
+        self.latency = dict(DEFAULT_LATENCY)
+        if latency:
+            self.latency.update(latency)
+        self.calls = Counter()
+        self.windows: List[SimWindow] = []
+        self.foreground = 0
+        self._next_hwnd = 0x10000
+        self._lock = threading.RLock()
+        self._structure_listeners: List[Tuple[SimControl, Callable]] = []
+        self._window_listeners: List[Tuple[frozenset, Callable]] = []
+        self._focus_listeners: List[Callable] = []
+        self.focused: Optional[SimControl] = None
+        # Aplicaciones colgadas: pid -> (segundos, una de cada n consultas)
+        self.hangs: Dict[int, Tuple[float, int]] = {}
+        self._hang_calls = Counter()
+        self._unhang = threading.Event()
+        super().__init__(_SimUIA(self), _SimWindow(self), SimGDI(self), SimMouse(self), SimScreen(self),
+                         SimKeyboard(), SimOverlayWindow(self))
+
+    def _cost(self, kind: str):
+        self.calls[kind] += 1
+        delay = self.latency.get(kind, 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def _maybe_hang(self, control: SimControl):
+        """Bloquea la consulta UIA si el proceso del control está "colgado" """
+        if not self.hangs:
+            return
+        node = control
+        while node is not None and not isinstance(node, SimWindow):
+            node = node.parent
+        hang = self.hangs.get(node.pid) if node is not None else None
+        if hang is None:
+            return
+        seconds, every = hang
+        with self._lock:
+            self._hang_calls[node.pid] += 1
+            calls = self._hang_calls[node.pid]
+            released = self._unhang
+        if calls % every == 0:
+            self.calls["hang"] += 1
+            released.wait(seconds)
+
+    def _structure_changed(self, control: SimControl):
+        """Notifica un cambio de estructura (sender: el hijo agregado o el padre
+        del quitado) a los suscriptores de sus ancestros"""
+        if not self._structure_listeners:
+            return
+        with self._lock:
+            listeners = list(self._structure_listeners)
+        for root, callback in listeners:
+            node = control
+            while node is not None and node is not root:
+                node = node.parent
+            if node is root:
+                callback(control.runtime_id, control)
+
+    def _window_event(self, kind: str, window: SimWindow):
+        """Notifica un evento de ventana (como los WinEvents de SetWinEventHook)"""
+        if not self._window_listeners:
+            return
+        with self._lock:
+            listeners = list(self._window_listeners)
+        for pids, callback in listeners:
+            if kind == "foreground" or window.pid in pids or window.hwnd == self.foreground:
+                callback(kind, window.hwnd)
+
+    # -- Construcción del escenario --
+
+    def add_window(self, left: int, top: int, width: int, height: int, name: str = "",
+                   class_name: str = "SimWindow", pid: int = DEFAULT_PID) -> SimWindow:
+        with self._lock:
+            self._next_hwnd += 2
+            window = SimWindow(self, self._next_hwnd, SimRect(left, top, left + width, top + height),
+                               name=name, class_name=class_name, pid=pid)
+            self.windows.insert(0, window)
+            self.foreground = window.hwnd
+        self._window_event("create", window)
+        self._window_event("show", window)
+        self._window_event("foreground", window)
+        return window
+
+    def control(self, parent: SimControl, control_type: str, left: int, top: int, width: int,
+                height: int, **props) -> SimControl:
+        """Agrega un control hijo (coordenadas de pantalla)"""
+        with self._lock:
+            return parent.add(SimControl(self, control_type,
+                                         SimRect(left, top, left + width, top + height), **props))
+
+    def get_window(self, hwnd: int) -> Optional[SimWindow]:
+        for window in self.windows:
+            if window.hwnd == hwnd:
+                return window
+        return None
+
+    # -- Eventos de escritorio --
+
+    def move_window(self, hwnd: int, dx: int, dy: int):
+        with self._lock:
+            window = self.get_window(hwnd)
+            if window is not None:
+                window.offset(dx, dy)
+        if window is not None:
+            self._window_event("location", window)
+
+    def resize_window(self, hwnd: int, width: int, height: int):
+        with self._lock:
+            window = self.get_window(hwnd)
+            if window is not None:
+                r = window.rect
+                window.rect = SimRect(r.left, r.top, r.left + width, r.top + height)
+        if window is not None:
+            self._window_event("location", window)
+
+    def minimize_window(self, hwnd: int):
+        with self._lock:
+            window = self.get_window(hwnd)
+            if window is None or window.restored_rect is not None:
+                return
+            window.restored_rect = window.rect
+            window.rect = SimRect(*MINIMIZED_RECT)
+        self._window_event("minimize", window)
+
+    def restore_window(self, hwnd: int):
+        with self._lock:
+            window = self.get_window(hwnd)
+            if window is None or window.restored_rect is None:
+                return
+            window.rect, window.restored_rect = window.restored_rect, None
+        self._window_event("restore", window)
+
+    def set_foreground(self, hwnd: int):
+        with self._lock:
+            window = self.get_window(hwnd)
+            if window is not None:
+                self.windows.remove(window)
+                self.windows.insert(0, window)
+                self.foreground = hwnd
+        if window is not None:
+            self._window_event("foreground", window)
+
+    def set_focus(self, control: Optional[SimControl]):
+        """Mueve el foco del teclado (notifica como FocusChangedEvent)"""
+        with self._lock:
+            if control is self.focused:
+                return
+            self.focused = control
+            listeners = list(self._focus_listeners)
+        runtime_id = control.runtime_id if control is not None else None
+        for callback in listeners:
+            callback(runtime_id)
+
+    def focus_at(self, x: int, y: int):
+        """Enfoca el control en (x, y), como un clic (sin costo de UIA)"""
+        self.set_focus(self.uia._hit_test(x, y))
+
+    def hang(self, pid: int = DEFAULT_PID, seconds: float = 5.0, every: int = 1):
+        """Simula una aplicación colgada: las inspecciones de sus controles
+        tardan `seconds` (una de cada `every`)"""
+        with self._lock:
+            self.hangs[pid] = (seconds, max(1, int(every)))
+
+    def unhang(self, pid: int = None):
+        """La aplicación vuelve a responder; las consultas bloqueadas siguen"""
+        with self._lock:
+            if pid is None:
+                self.hangs.clear()
+            else:
+                self.hangs.pop(pid, None)
+            released, self._unhang = self._unhang, threading.Event()
+        released.set()
+
+    def close_window(self, hwnd: int):
+        with self._lock:
+            window = self.get_window(hwnd)
+            if window is not None:
+                self.windows.remove(window)
+                self.foreground = self.windows[0].hwnd if self.windows else 0
+        if window is not None:
+            self._window_event("destroy", window)
+            node = self.focused
+            while node is not None and node is not window:
+                node = node.parent
+            if node is window:
+                self.set_focus(None)
+            foreground = self.get_window(self.foreground)
+            if foreground is not None:
+                self._window_event("foreground", foreground)
+
+    # -- Escenarios --
+
+    @classmethod
+    def from_spec(cls, spec: Dict, latency: Optional[Dict[str, float]] = None) -> "SimulatedDesktop":
+        """Construye el escritorio desde un dict:
+        {"latency": {...}, "windows": [{"name", "pid", "rect": [x, y, w, h], "children": [
+            {"controlType", "rect": [x, y, w, h], "name", "automationId", "className",
+             "value", "password", "children": [...]}]}]}
+        Las ventanas se listan de abajo hacia arriba; los rect de los controles
+        son relativos a la ventana.
+        """
+        desktop = cls({**spec.get("latency", {}), **(latency or {})})
+
+        def build(parent: SimControl, node: Dict, ox: int, oy: int):
+            x, y, w, h = node["rect"]
+            control = desktop.control(
+                parent, node.get("controlType", "PaneControl"), ox + x, oy + y, w, h,
+                name=node.get("name", ""), class_name=node.get("className", ""),
+                automation_id=node.get("automationId", ""), value=node.get("value"),
+                enabled=node.get("enabled", True), password=node.get("password", False)
+            )
+            for child in node.get("children", []):
+                build(control, child, ox, oy)
+
+        for win in spec.get("windows", []):
+            x, y, w, h = win["rect"]
+            window = desktop.add_window(x, y, w, h, name=win.get("name", ""),
+                                        class_name=win.get("className", "SimWindow"),
+                                        pid=win.get("pid", DEFAULT_PID))
+            for child in win.get("children", []):
+                build(window, child, x, y)
+        return desktop
+
+    @classmethod
+    def load(cls, path: str, latency: Optional[Dict[str, float]] = None) -> "SimulatedDesktop":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_spec(json.load(f), latency)
+
+    @classmethod
+    def demo(cls, rows: int = 10, cols: int = 8, latency: Optional[Dict[str, float]] = None) -> "SimulatedDesktop":
+        """Formulario de ejemplo: una cuadrícula de etiquetas, campos y botones"""
+        desktop = cls(latency)
+        cell_w, cell_h = 120, 40
+        window = desktop.add_window(100, 100, cols * cell_w + 40, rows * cell_h + 80, name="Formulario Demo")
+        pane = desktop.control(window, "PaneControl", 110, 140, cols * cell_w + 20, rows * cell_h + 30,
+                               name="Contenido", class_name="Pane")
+        kinds = ("TextControl", "EditControl", "ButtonControl", "CheckBoxControl")
+        for r in range(rows):
+            for c in range(cols):
+                kind = kinds[(r + c) % len(kinds)]
+                desktop.control(
+                    pane, kind, 120 + c * cell_w, 150 + r * cell_h, cell_w - 10, cell_h - 10,
+                    name=f"{kind[:-7]} {r}-{c}", class_name=kind[:-7],
+                    automation_id=f"ctl_{r}_{c}", value="" if kind == "EditControl" else None
+                )
+        return desktop
+
+    def stats(self) -> Dict:
+        return {
+            "calls": dict(self.calls),
+            "liveGdiObjects": len(self.gdi.live_objects),
+            "liveDCs": len(self.gdi.live_dcs)
+        }
@@ -0,0 +1,770 @@
+"""
+Backend Win32 - UI Automation, GDI y hooks reales de Windows
+
+Los módulos pesados (pythoncom, win32gui, uiautomation, pynput) se importan
+en el primer uso para que el servicio pueda emitir `ready` cuanto antes;
+`prewarm()` los carga en segundo plano.
+"""
+import ctypes
+import ctypes.wintypes
+import importlib
+import importlib.util
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import startup
+from .base import (
+    GDIBackend,
+    KeyboardHookBackend,
+    MouseHookBackend,
+    OverlaySurface,
+    OverlayWindowBackend,
+    PlatformBackend,
+    ScreenBackend,
+    UIABackend,
+    WalkNode,
+    WindowBackend,
+)
+
+# Módulos pesados que se cargan de forma diferida
+HEAVY_MODULES = ("pythoncom", "win32gui", "uiautomation", "pynput.mouse", "pynput.keyboard", "mss")
+
+# Constantes de wingdi.h (evita importar win32con al arrancar)
+PS_SOLID = 0
+NULL_BRUSH = 5
+TRANSPARENT = 1
+BLACKNESS = 0x00000042
+
+# Constantes de winuser.h para la ventana retenida del overlay
+WS_POPUP = 0x80000000
+WS_EX_TOPMOST = 0x00000008
+WS_EX_TRANSPARENT = 0x00000020
+WS_EX_TOOLWINDOW = 0x00000080
+WS_EX_LAYERED = 0x00080000
+WS_EX_NOACTIVATE = 0x08000000
+ULW_COLORKEY = 0x00000001
+SW_HIDE = 0
+SW_SHOWNOACTIVATE = 4
+PM_REMOVE = 0x0001
+OVERLAY_CLASS = "AlqvimiaOverlay"
+
+# Ids de propiedad de UIAutomationClient.h para las CacheRequest
+UIA_PROPERTY_IDS = {
+    "RuntimeId": 30000,
+    "BoundingRectangle": 30001,
+    "ControlTypeName": 30003,
+    "Name": 30005,
+    "IsEnabled": 30010,
+    "AutomationId": 30011,
+    "ClassName": 30012,
+    "IsPassword": 30019,
+    "IsOffscreen": 30022,
+    "Value": 30045,
+}
+TREE_SCOPE_ELEMENT = 1
+TREE_SCOPE_CHILDREN = 2
+TREE_SCOPE_SUBTREE = 7
+
+# Constantes de winuser.h para SetWinEventHook
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+EVENT_SYSTEM_FOREGROUND = 0x0003
+EVENT_SYSTEM_MINIMIZESTART = 0x0016
+EVENT_SYSTEM_MINIMIZEEND = 0x0017
+EVENT_OBJECT_CREATE = 0x8000
+EVENT_OBJECT_DESTROY = 0x8001
+EVENT_OBJECT_SHOW = 0x8002
+EVENT_OBJECT_HIDE = 0x8003
+EVENT_OBJECT_LOCATIONCHANGE = 0x800B
+WDA_EXCLUDEFROMCAPTURE = 0x11
+OBJID_WINDOW = 0
+GA_ROOT = 2
+CHILDID_SELF = 0
+WM_QUIT = 0x0012
+
+WIN_EVENT_KINDS = {
+    EVENT_SYSTEM_FOREGROUND: "foreground",
+    EVENT_SYSTEM_MINIMIZESTART: "minimize",
+    EVENT_SYSTEM_MINIMIZEEND: "restore",
+    EVENT_OBJECT_CREATE: "create",
+    EVENT_OBJECT_DESTROY: "destroy",
+    EVENT_OBJECT_SHOW: "show",
+    EVENT_OBJECT_HIDE: "hide",
+    EVENT_OBJECT_LOCATIONCHANGE: "location",
+}
+
+# Rangos de eventos por proceso objetivo (el de primer plano es global)
+_PROCESS_EVENT_RANGES = (
+    (EVENT_SYSTEM_MINIMIZESTART, EVENT_SYSTEM_MINIMIZEEND),
+    (EVENT_OBJECT_CREATE, EVENT_OBJECT_HIDE),
+    (EVENT_OBJECT_LOCATIONCHANGE, EVENT_OBJECT_LOCATIONCHANGE),
+)
+# Ventana en primer plano (de otro proceso): lo que invalida su rectángulo
+_FOREGROUND_EVENT_RANGES = (
+    (EVENT_SYSTEM_MINIMIZESTART, EVENT_SYSTEM_MINIMIZEEND),
+    (EVENT_OBJECT_DESTROY, EVENT_OBJECT_DESTROY),
+    (EVENT_OBJECT_LOCATIONCHANGE, EVENT_OBJECT_LOCATIONCHANGE),
+)
+
+
+_modules = {}
+_import_lock = threading.Lock()
+
+
+def _module(name: str):
+    """Importa un módulo pesado en el primer uso y registra cuánto tardó"""
+    module = _modules.get(name)
+    if module is None:
+        with _import_lock:
+            module = _modules.get(name)
+            if module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(name)
+                startup.record_import(name, time.perf_counter() - started)
+                _modules[name] = module
+    return module
+
+
+@lru_cache(maxsize=None)
+def _wineventproc():
+    """Tipo de callback WINEVENTPROC (WINFUNCTYPE solo existe en Windows)"""
+    return ctypes.WINFUNCTYPE(
+        None, ctypes.wintypes.HANDLE, ctypes.wintypes.DWORD, ctypes.wintypes.HWND,
+        ctypes.wintypes.LONG, ctypes.wintypes.LONG, ctypes.wintypes.DWORD, ctypes.wintypes.DWORD
+    )
+
+
+@lru_cache(maxsize=None)
+def _overlay_class() -> str:
+    """Registra (una vez por proceso) la clase de la ventana del overlay"""
+    wintypes = ctypes.wintypes
+    user32 = ctypes.windll.user32
+    wndproc = ctypes.WINFUNCTYPE(ctypes.c_ssize_t, wintypes.HWND, wintypes.UINT, wintypes.WPARAM,
+                                 wintypes.LPARAM)
+    user32.DefWindowProcW.argtypes = (wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
+    user32.DefWindowProcW.restype = ctypes.c_ssize_t
+
+    class WNDCLASSEXW(ctypes.Structure):
+        _fields_ = [("cbSize", wintypes.UINT), ("style", wintypes.UINT), ("lpfnWndProc", wndproc),
+                    ("cbClsExtra", ctypes.c_int), ("cbWndExtra", ctypes.c_int),
+                    ("hInstance", wintypes.HINSTANCE), ("hIcon", wintypes.HICON),
+                    ("hCursor", wintypes.HANDLE), ("hbrBackground", wintypes.HBRUSH),
+                    ("lpszMenuName", wintypes.LPCWSTR), ("lpszClassName", wintypes.LPCWSTR),
+                    ("hIconSm", wintypes.HICON)]
+
+    # La clase usa el callback mientras viva el proceso: se guarda en _overlay_class.proc
+    proc = wndproc(lambda hwnd, msg, wparam, lparam: user32.DefWindowProcW(hwnd, msg, wparam, lparam))
+    wc = WNDCLASSEXW(cbSize=ctypes.sizeof(WNDCLASSEXW), lpfnWndProc=proc,
+                     hInstance=ctypes.windll.kernel32.GetModuleHandleW(None), lpszClassName=OVERLAY_CLASS)
+    if not user32.RegisterClassExW(ctypes.byref(wc)):
+        raise OSError(f"RegisterClassExW falló ({ctypes.windll.kernel32.GetLastError()})")
+    _overlay_class.proc = proc
+    return OVERLAY_CLASS
+
+
+@lru_cache(maxsize=None)
+def _installed(name: str) -> bool:
+    """Comprueba si un módulo está instalado sin importarlo"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class Win32UIA(UIABackend):
+    @property
+    def available(self):
+        return _installed("uiautomation") and _installed("pythoncom")
+
+    def init_thread(self):
+        _module("pythoncom").CoInitialize()
+
+    def uninit_thread(self):
+        _module("pythoncom").CoUninitialize()
+
+    def __init__(self):
+        # Las CacheRequest son objetos COM del apartamento de cada hilo
+        self._local = threading.local()
+
+    def control_from_point(self, x: int, y: int):
+        return _module("uiautomation").ControlFromPoint(x, y)
+
+    def inspect_point(self, x: int, y: int, properties: Iterable[str]) -> Optional[Dict]:
+        """Resuelve todas las propiedades con un ElementFromPointBuildCache.
+        Si la CacheRequest falla se usa la lectura propiedad por propiedad."""
+        properties = tuple(properties)
+        try:
+            return self._inspect_cached(x, y, properties)
+        except Exception:
+            return super().inspect_point(x, y, properties)
+
+    def _cache_request(self, uia, property_ids: Tuple[int, ...], scope: int = TREE_SCOPE_ELEMENT):
+        requests = getattr(self._local, "requests", None)
+        if requests is None:
+            requests = self._local.requests = {}
+        request = requests.get((property_ids, scope))
+        if request is None:
+            request = uia.CreateCacheRequest()
+            for property_id in property_ids:
+                request.AddProperty(property_id)
+            request.TreeScope = scope
+            if scope != TREE_SCOPE_ELEMENT:
+                request.TreeFilter = uia.ControlViewCondition
+            requests[(property_ids, scope)] = request
+        return request
+
+    @staticmethod
+    def _property_ids(properties: Iterable[str]) -> Tuple[int, ...]:
+        return tuple(sorted(UIA_PROPERTY_IDS[p] for p in set(properties) if p in UIA_PROPERTY_IDS))
+
+    def _walker(self, uia):
+        """ControlViewWalker del hilo: cada acceso a uia.ControlViewWalker crea uno nuevo"""
+        walker = getattr(self._local, "walker", None)
+        if walker is None:
+            walker = self._local.walker = uia.ControlViewWalker
+        return walker
+
+    def _inspect_cached(self, x: int, y: int, properties: Tuple[str, ...]) -> Optional[Dict]:
+        auto = _module("uiautomation")
+        uia = auto._AutomationClient.instance().IUIAutomation
+        element = uia.ElementFromPointBuildCache(
+            ctypes.wintypes.POINT(x, y),
+            self._cache_request(uia, self._property_ids(properties))
+        )
+        if not element:
+            return None
+        return self._cached_values(auto, uia, element, properties)
+
+    def _cached_values(self, auto, uia, element, properties: Tuple[str, ...],
+                       children_cached: bool = False) -> Dict:
+        """Lee las propiedades de la caché de un IUIAutomationElement
+        (`children_cached`: la CacheRequest incluía TREE_SCOPE_CHILDREN)"""
+        values = {}
+        for prop in properties:
+            if prop == "ControlTypeName":
+                values[prop] = auto.ControlTypeNames.get(element.CachedControlType, "Control")
+            elif prop == "BoundingRectangle":
+                rect = element.CachedBoundingRectangle
+                values[prop] = (rect.left, rect.top, rect.right, rect.bottom)
+            elif prop == "RuntimeId":
+                runtime_id = element.GetCachedPropertyValue(UIA_PROPERTY_IDS[prop])
+                values[prop] = tuple(runtime_id) if runtime_id else None
+            elif prop == "Value":
+                # Sin ValuePattern UIA devuelve un valor "no soportado" que no es str
+                value = element.GetCachedPropertyValue(UIA_PROPERTY_IDS[prop])
+                values[prop] = value if isinstance(value, str) else None
+            elif prop == "ParentName":
+                # Una CacheRequest no puede subir al padre: viaje extra (solo nivel full)
+                name_request = self._cache_request(uia, (UIA_PROPERTY_IDS["Name"],))
+                parent = self._walker(uia).GetParentElementBuildCache(element, name_request)
+                values[prop] = parent.CachedName if parent else None
+            elif prop == "IsLeaf":
+                values[prop] = self._is_leaf(uia, element, children_cached)
+            else:
+                values[prop] = element.GetCachedPropertyValue(UIA_PROPERTY_IDS[prop])
+        return values
+
+    def _is_leaf(self, uia, element, children_cached: bool = False) -> bool:
+        """Sin hijos en la vista de control. En la raíz de walk() los hijos ya
+        vienen cacheados; si no, un GetFirstChildElement (un viaje, sin
+        propiedades). Pedir los hijos en la CacheRequest traería todas las
+        propiedades de cada hijo solo para contarlos."""
+        if children_cached:
+            children = element.GetCachedChildren()
+            return not children or children.Length == 0
+        return not self._walker(uia).GetFirstChildElement(element)
+
+    def focused_control(self):
+        return _module("uiautomation").GetFocusedControl()
+
+    def inspect_focused(self, properties: Iterable[str]) -> Optional[Dict]:
+        """GetFocusedElementBuildCache: todas las propiedades en un viaje"""
+        properties = tuple(properties)
+        try:
+            auto = _module("uiautomation")
+            uia = auto._AutomationClient.instance().IUIAutomation
+            element = uia.GetFocusedElementBuildCache(
+                self._cache_request(uia, self._property_ids(properties))
+            )
+            if not element:
+                return None
+            return self._cached_values(auto, uia, element, properties)
+        except Exception:
+            return super().inspect_focused(properties)
+
+    def subscribe_focus_changes(self, callback):
+        """FocusChangedEvent de UIA (de todo el escritorio)"""
+        try:
+            comtypes = _module("comtypes")
+            client = _module("uiautomation")._AutomationClient.instance()
+            core = client.UIAutomationCore
+            uia = client.IUIAutomation
+
+            class _Handler(comtypes.COMObject):
+                _com_interfaces_ = [core.IUIAutomationFocusChangedEventHandler]
+
+                def HandleFocusChangedEvent(self, sender):
+                    try:
+                        callback(tuple(sender.GetRuntimeId()))
+                    except Exception:
+                        callback(None)
+
+            handler = _Handler()
+            uia.AddFocusChangedEventHandler(None, handler)
+        except Exception:
+            return None
+
+        def unsubscribe():
+            try:
+                uia.RemoveFocusChangedEventHandler(handler)
+            except Exception:
+                pass
+        return unsubscribe
+
+    def control_from_handle(self, hwnd: int):
+        return _module("uiautomation").ControlFromHandle(hwnd)
+
+    def walk(self, root, properties: Iterable[str], max_depth: int = 12,
+             max_children: int = 500, max_nodes: int = 20000) -> Optional[WalkNode]:
+        """Recorrido en anchura con una CacheRequest (elemento + hijos) por nodo:
+        un viaje cross-process por nodo en lugar de uno por propiedad."""
+        properties = tuple(properties)
+        try:
+            auto = _module("uiautomation")
+            uia = auto._AutomationClient.instance().IUIAutomation
+            request = self._cache_request(
+                uia, self._property_ids(properties), TREE_SCOPE_ELEMENT | TREE_SCOPE_CHILDREN
+            )
+            cached_root = getattr(root, "Element", root).BuildUpdatedCache(request)
+        except Exception:
+            return super().walk(root, properties, max_depth, max_children, max_nodes)
+
+        root_node = WalkNode(cached_root, self._cached_values(auto, uia, cached_root, properties, True))
+        queue = [(root_node, 0, cached_root)]
+        count = 1
+        for node, depth, cached in queue:
+            if depth >= max_depth or count >= max_nodes:
+                continue
+            if cached is None:
+                # Los hijos llegaron con las propiedades del padre; sus propios hijos no
+                cached = node.control.BuildUpdatedCache(request)
+            children = cached.GetCachedChildren()
+            length = children.Length if children else 0
+            for index in range(length):
+                if len(node.children) >= max_children or count >= max_nodes:
+                    node.truncated = True
+                    break
+                child = children.GetElement(index)
+                child_node = WalkNode(child, self._cached_values(auto, uia, child, properties))
+                node.children.append(child_node)
+                queue.append((child_node, depth + 1, None))
+                count += 1
+        return root_node
+
+    def parent_of(self, control):
+        """Padre por el walker del hilo con solo el RuntimeId cacheado (un viaje)"""
+        try:
+            uia = _module("uiautomation")._AutomationClient.instance().IUIAutomation
+            request = self._cache_request(uia, (UIA_PROPERTY_IDS["RuntimeId"],))
+            parent = self._walker(uia).GetParentElementBuildCache(getattr(control, "Element", control), request)
+            if not parent:
+                return None
+            runtime_id = parent.GetCachedPropertyValue(UIA_PROPERTY_IDS["RuntimeId"])
+            return (tuple(runtime_id) if runtime_id else None), parent
+        except Exception:
+            return super().parent_of(control)
+
+    def subscribe_structure_changes(self, root, callback):
+        """StructureChangedEvent de UIA sobre el subárbol de `root`"""
+        try:
+            comtypes = _module("comtypes")
+            client = _module("uiautomation")._AutomationClient.instance()
+            core = client.UIAutomationCore
+            uia = client.IUIAutomation
+
+            class _Handler(comtypes.COMObject):
+                _com_interfaces_ = [core.IUIAutomationStructureChangedEventHandler]
+
+                def HandleStructureChangedEvent(self, sender, change_type, runtime_id):
+                    try:
+                        callback(tuple(sender.GetRuntimeId()), sender)
+                    except Exception:
+                        callback(None, None)
+
+            handler = _Handler()
+            element = getattr(root, "Element", root)
+            uia.AddStructureChangedEventHandler(element, TREE_SCOPE_SUBTREE, None, handler)
+        except Exception:
+            return None
+
+        def unsubscribe():
+            try:
+                uia.RemoveStructureChangedEventHandler(element, handler)
+            except Exception:
+                pass
+        return unsubscribe
+
+
+class Win32Window(WindowBackend):
+    def get_window_rect(self, hwnd: int) -> Tuple[int, int, int, int]:
+        return _module("win32gui").GetWindowRect(hwnd)
+
+    def get_foreground_window(self) -> int:
+        return _module("win32gui").GetForegroundWindow()
+
+    def window_from_point(self, x: int, y: int) -> Optional[int]:
+        # WindowFromPoint no envía mensajes a otros procesos: no se cuelga con ellos
+        user32 = ctypes.windll.user32
+        hwnd = user32.WindowFromPoint(ctypes.wintypes.POINT(x, y))
+        return (user32.GetAncestor(hwnd, GA_ROOT) or hwnd) if hwnd else None
+
+    def window_process(self, hwnd: int) -> Optional[int]:
+        pid = ctypes.wintypes.DWORD()
+        if not ctypes.windll.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid)):
+            return None
+        return pid.value
+
+    def process_windows(self, pid: int) -> List[int]:
+        win32gui = _module("win32gui")
+        handles = []
+
+        def collect(hwnd, _):
+            if win32gui.IsWindowVisible(hwnd) and self.window_process(hwnd) == pid:
+                handles.append(hwnd)
+            return True
+
+        win32gui.EnumWindows(collect, None)
+        return handles
+
+    def subscribe_window_events(self, pids: Iterable[int], callback: Callable[[str, int], None]):
+        """WinEvents fuera de contexto en un hilo con cola de mensajes propia.
+
+        Los eventos de ventana se filtran por proceso en el propio hook
+        (idProcess), así el callback no recibe los LOCATIONCHANGE del cursor
+        ni de otras aplicaciones. El proceso de la ventana en primer plano
+        tiene sus propios hooks, que se rehacen en cada cambio de primer plano
+        (el callback corre en este mismo hilo) y solo dejan pasar esa ventana.
+        """
+        user32 = ctypes.windll.user32
+        # Mismo tipo que el `hook` del callback, para reconocer los del primer plano
+        user32.SetWinEventHook.restype = ctypes.wintypes.HANDLE
+        pids = [int(pid) for pid in pids if pid]
+        ready = threading.Event()
+        state = {"thread_id": None, "ok": False, "foreground": 0, "fg_hooks": []}
+
+        def hook_foreground(hwnd: int):
+            for hook in state["fg_hooks"]:
+                user32.UnhookWinEvent(hook)
+            state["fg_hooks"] = []
+            state["foreground"] = hwnd
+            pid = ctypes.wintypes.DWORD()
+            user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+            if pid.value and pid.value not in pids:
+                state["fg_hooks"] = [
+                    hook for hook in (
+                        user32.SetWinEventHook(low, high, None, on_event, pid.value, 0,
+                                               WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS)
+                        for low, high in _FOREGROUND_EVENT_RANGES
+                    ) if hook
+                ]
+
+        @_wineventproc()
+        def on_event(hook, event, hwnd, id_object, id_child, thread, timestamp):
+            if not hwnd or id_object != OBJID_WINDOW or id_child != CHILDID_SELF:
+                return
+            if hook in state["fg_hooks"] and hwnd != state["foreground"]:
+                return
+            kind = WIN_EVENT_KINDS.get(event)
+            if kind == "foreground":
+                hook_foreground(hwnd)
+            if kind is not None:
+                try:
+                    callback(kind, hwnd)
+                except Exception:
+                    pass
+
+        def run():
+            state["thread_id"] = ctypes.windll.kernel32.GetCurrentThreadId()
+            hooks = [user32.SetWinEventHook(EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND, None,
+                                            on_event, 0, 0, WINEVENT_OUTOFCONTEXT)]
+            for pid in pids:
+                for low, high in _PROCESS_EVENT_RANGES:
+                    hooks.append(user32.SetWinEventHook(low, high, None, on_event, pid, 0,
+                                                        WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS))
+            state["ok"] = all(hooks)
+            if state["ok"]:
+                hook_foreground(user32.GetForegroundWindow())
+            ready.set()
+            msg = ctypes.wintypes.MSG()
+            while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+                user32.TranslateMessage(ctypes.byref(msg))
+                user32.DispatchMessageW(ctypes.byref(msg))
+            for hook in hooks + state["fg_hooks"]:
+                if hook:
+                    user32.UnhookWinEvent(hook)
+
+        thread = threading.Thread(target=run, daemon=True, name="win-events")
+        thread.start()
+        ready.wait(2.0)
+        if not state["ok"]:
+            if state["thread_id"]:
+                user32.PostThreadMessageW(state["thread_id"], WM_QUIT, 0, 0)
+            return None
+
+        def unsubscribe():
+            user32.PostThreadMessageW(state["thread_id"], WM_QUIT, 0, 0)
+            if thread is not threading.current_thread():
+                thread.join(timeout=1.0)
+        return unsubscribe
+
+
+class Win32GDI(GDIBackend):
+    PS_SOLID = PS_SOLID
+
+    def __init__(self):
+        self.user32 = ctypes.windll.user32
+        self.gdi32 = ctypes.windll.gdi32
+
+    def get_dc(self) -> int:
+        return self.user32.GetDC(None)
+
+    def release_dc(self, hdc: int):
+        self.user32.ReleaseDC(None, hdc)
+
+    def create_pen(self, style: int, width: int, color: int) -> int:
+        return self.gdi32.CreatePen(style, width, color)
+
+    def get_null_brush(self) -> int:
+        return self.gdi32.GetStockObject(NULL_BRUSH)
+
+    def select_object(self, hdc: int, obj: int) -> int:
+        return self.gdi32.SelectObject(hdc, obj)
+
+    def delete_object(self, obj: int):
+        self.gdi32.DeleteObject(obj)
+
+    def rectangle(self, hdc: int, left: int, top: int, right: int, bottom: int):
+        self.gdi32.Rectangle(hdc, left, top, right, bottom)
+
+    def draw_text(self, hdc: int, x: int, y: int, text: str, color: int):
+        self.gdi32.SetBkMode(hdc, TRANSPARENT)
+        self.gdi32.SetTextColor(hdc, color)
+        self.gdi32.TextOutW(hdc, x, y, ctypes.c_wchar_p(text), len(text))
+
+    def invalidate_rect(self, rect: Optional[Tuple[int, int, int, int]] = None):
+        if rect is None:
+            self.user32.InvalidateRect(None, None, True)
+        else:
+            r = (ctypes.c_long * 4)(*rect)
+            self.user32.InvalidateRect(None, ctypes.byref(r), True)
+
+    def update_desktop(self):
+        self.user32.UpdateWindow(self.user32.GetDesktopWindow())
+
+
+class Win32OverlaySurface(OverlaySurface):
+    """Ventana WS_EX_LAYERED | WS_EX_TRANSPARENT | WS_EX_TOPMOST que se
+    publica con UpdateLayeredWindow (color key negro: lo no dibujado es
+    transparente). La ventana y su bitmap solo cubren el área de los
+    resaltados; el bitmap se reutiliza mientras el área quepa en él."""
+
+    color_key = 0
+
+    def __init__(self):
+        self.user32 = ctypes.windll.user32
+        self.gdi32 = ctypes.windll.gdi32
+        wintypes = ctypes.wintypes
+        self.user32.CreateWindowExW.restype = wintypes.HWND
+        self.user32.UpdateLayeredWindow.argtypes = (
+            wintypes.HWND, wintypes.HDC, ctypes.POINTER(wintypes.POINT), ctypes.POINTER(wintypes.SIZE),
+            wintypes.HDC, ctypes.POINTER(wintypes.POINT), wintypes.COLORREF, ctypes.c_void_p, wintypes.DWORD
+        )
+        self.hwnd = self.user32.CreateWindowExW(
+            WS_EX_LAYERED | WS_EX_TRANSPARENT | WS_EX_TOPMOST | WS_EX_TOOLWINDOW | WS_EX_NOACTIVATE,
+            _overlay_class(), "Alqvimia overlay", WS_POPUP, 0, 0, 1, 1,
+            None, None, ctypes.windll.kernel32.GetModuleHandleW(None), None
+        )
+        if not self.hwnd:
+            raise OSError(f"CreateWindowExW falló ({ctypes.windll.kernel32.GetLastError()})")
+        # Los recortes de elementos no deben incluir el resaltado (Windows 10 2004+;
+        # antes falla y el overlay lo quita mientras se captura)
+        self.excluded_from_capture = bool(
+            self.user32.SetWindowDisplayAffinity(self.hwnd, WDA_EXCLUDEFROMCAPTURE))
+        screen = self.user32.GetDC(None)
+        self.hdc = self.gdi32.CreateCompatibleDC(screen)
+        self.user32.ReleaseDC(None, screen)
+        self._bitmap = None
+        self._old_bitmap = None
+        self._capacity = (0, 0)
+        self._area = (0, 0, 0, 0)
+        self.visible = False
+
+    def _ensure_bitmap(self, width: int, height: int):
+        if width <= self._capacity[0] and height <= self._capacity[1]:
+            return
+        width, height = max(width, self._capacity[0]), max(height, self._capacity[1])
+        screen = self.user32.GetDC(None)
+        bitmap = self.gdi32.CreateCompatibleBitmap(screen, width, height)
+        self.user32.ReleaseDC(None, screen)
+        if not bitmap:
+            raise OSError("CreateCompatibleBitmap falló")
+        previous = self.gdi32.SelectObject(self.hdc, bitmap)
+        if self._bitmap is None:
+            self._old_bitmap = previous
+        else:
+            self.gdi32.DeleteObject(self._bitmap)
+        self._bitmap = bitmap
+        self._capacity = (width, height)
+
+    def begin(self, left: int, top: int, right: int, bottom: int) -> int:
+        width, height = max(1, right - left), max(1, bottom - top)
+        self._ensure_bitmap(width, height)
+        self.gdi32.SetViewportOrgEx(self.hdc, 0, 0, None)
+        self.gdi32.PatBlt(self.hdc, 0, 0, width, height, BLACKNESS)
+        # Dibujar en coordenadas de pantalla
+        self.gdi32.SetViewportOrgEx(self.hdc, -left, -top, None)
+        self._area = (left, top, width, height)
+        return self.hdc
+
+    def present(self):
+        wintypes = ctypes.wintypes
+        left, top, width, height = self._area
+        self.gdi32.SetViewportOrgEx(self.hdc, 0, 0, None)
+        position, size, origin = wintypes.POINT(left, top), wintypes.SIZE(width, height), wintypes.POINT(0, 0)
+        if not self.user32.UpdateLayeredWindow(self.hwnd, None, ctypes.byref(position), ctypes.byref(size),
+                                               self.hdc, ctypes.byref(origin), self.color_key, None,
+                                               ULW_COLORKEY):
+            raise OSError(f"UpdateLayeredWindow falló ({ctypes.windll.kernel32.GetLastError()})")
+        if not self.visible:
+            self.user32.ShowWindow(self.hwnd, SW_SHOWNOACTIVATE)
+            self.visible = True
+
+    def hide(self):
+        if self.visible:
+            self.user32.ShowWindow(self.hwnd, SW_HIDE)
+            self.visible = False
+
+    def pump(self):
+        msg = ctypes.wintypes.MSG()
+        while self.user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, PM_REMOVE):
+            self.user32.TranslateMessage(ctypes.byref(msg))
+            self.user32.DispatchMessageW(ctypes.byref(msg))
+
+    def close(self):
+        if self._bitmap is not None:
+            self.gdi32.SelectObject(self.hdc, self._old_bitmap)
+            self.gdi32.DeleteObject(self._bitmap)
+            self._bitmap = None
+        if self.hdc:
+            self.gdi32.DeleteDC(self.hdc)
+            self.hdc = None
+        if self.hwnd:
+            self.user32.DestroyWindow(self.hwnd)
+            self.hwnd = None
+
+
+class Win32OverlayWindow(OverlayWindowBackend):
+    available = True
+
+    def create_surface(self) -> Win32OverlaySurface:
+        return Win32OverlaySurface()
+
+
+class PynputMouse(MouseHookBackend):
+    @property
+    def available(self):
+        return _installed("pynput")
+
+    def create_listener(self, on_move: Callable[[int, int], None],
+                        on_click: Callable[[int, int, str, bool], None]):
+        def _on_click(x, y, button, pressed):
+            on_click(x, y, getattr(button, "name", "left"), pressed)
+
+        return _module("pynput.mouse").Listener(on_move=on_move, on_click=_on_click)
+
+
+def _key_name(key) -> Tuple[str, Optional[str]]:
+    """(nombre, carácter) de una tecla de pynput"""
+    char = getattr(key, "char", None)
+    if char is not None:
+        if len(char) == 1 and ord(char) < 32:
+            # Con Ctrl pynput entrega el carácter de control (Ctrl+C -> "\x03")
+            return chr(ord(char) + 96), None
+        return char.lower(), char
+    name = getattr(key, "name", None)
+    if name is not None:
+        return name, " " if name == "space" else None
+    return f"vk{getattr(key, 'vk', 0)}", None
+
+
+class PynputKeyboard(KeyboardHookBackend):
+    @property
+    def available(self):
+        return _installed("pynput")
+
+    def create_listener(self, on_press: Callable[[str, Optional[str]], None],
+                        on_release: Callable[[str, Optional[str]], None]):
+        def _on_press(key):
+            on_press(*_key_name(key))
+
+        def _on_release(key):
+            on_release(*_key_name(key))
+
+        return _module("pynput.keyboard").Listener(on_press=_on_press, on_release=_on_release)
+
+
+class MssScreen(ScreenBackend):
+    """Captura con mss. Cada hilo conserva su instancia (los DC de mss son
+    por hilo) durante toda la vida del servicio, y solo se copia la región
+    del elemento, no el escritorio completo."""
+
+    @property
+    def available(self):
+        return _installed("mss")
+
+    def __init__(self):
+        self._local = threading.local()
+        self._grabbers = []
+        self._lock = threading.Lock()
+
+    def _grabber(self):
+        grabber = getattr(self._local, "grabber", None)
+        if grabber is None:
+            grabber = _module("mss").mss()
+            self._local.grabber = grabber
+            with self._lock:
+                self._grabbers.append(grabber)
+        return grabber
+
+    def grab(self, left: int, top: int, width: int, height: int) -> Tuple[bytes, int, int]:
+        shot = self._grabber().grab({"left": left, "top": top, "width": width, "height": height})
+        return bytes(shot.raw), shot.width, shot.height
+
+    def close(self):
+        with self._lock:
+            grabbers, self._grabbers = self._grabbers, []
+        for grabber in grabbers:
+            try:
+                grabber.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+
+class Win32Backend(PlatformBackend):
+    name = "win32"
+    heavy_modules = HEAVY_MODULES
+
+    def __init__(self):
+        super().__init__(Win32UIA(), Win32Window(), Win32GDI(), PynputMouse(), MssScreen(), PynputKeyboard(),
+                         Win32OverlayWindow())
+
+    def prewarm(self):
+        for name in HEAVY_MODULES:
+            if _installed(name.split(".")[0]):
+                try:
+                    _module(name)
+                except Exception:
+                    pass
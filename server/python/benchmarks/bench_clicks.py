@@ -0,0 +1,83 @@
+"""
+Benchmark de clics - Mide cuánto tarda el callback del hook de mouse y la
+latencia clic -> evento `click` con una inspección UIA lenta simulada.
+
+El hook solo debe encolar: su tiempo tiene que quedar en microsegundos
+aunque `control_from_point` tarde decenas de milisegundos.
+
+Uso:
+    python benchmarks/bench_clicks.py [--clicks 200] [--hit-latency 0.02] [--json]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tracking_service  # noqa: E402
+from backends.simulated import SimulatedDesktop  # noqa: E402
+
+
+class NullOutput(io.TextIOBase):
+    def write(self, s):
+        return len(s)
+
+
+def run(clicks: int, interval: float, hit_latency: float) -> dict:
+    desktop = SimulatedDesktop.demo(latency={"control_from_point": hit_latency})
+    service = tracking_service.TrackingService(desktop)
+
+    real_stdout = sys.stdout
+    sys.stdout = NullOutput()
+    hook_wall = []
+    try:
+        service.start(hover_delay=10.0)
+        for i in range(clicks):
+            col, row = i % 8, (i // 8) % 10
+            started = time.perf_counter()
+            desktop.mouse.click(130 + col * 120, 160 + row * 40)
+            hook_wall.append(time.perf_counter() - started)
+            time.sleep(interval)
+    finally:
+        service.stop()
+        sys.stdout = real_stdout
+
+    hook_wall.sort()
+    return {
+        "clicks": clicks,
+        "emitted": service.click_latency.count,
+        "hookUs": service.hook_latency.summary(scale=1e6, digits=1),
+        "hookCallUs": {
+            "p50": round(hook_wall[len(hook_wall) // 2] * 1e6, 1),
+            "max": round(hook_wall[-1] * 1e6, 1)
+        },
+        "clickToEventMs": service.click_latency.summary()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del camino de clics")
+    parser.add_argument("--clicks", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--hit-latency", type=float, default=0.02)
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    result = run(args.clicks, args.interval, args.hit_latency)
+
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    hook = result["hookUs"]
+    lat = result["clickToEventMs"]
+    print(f"Clics:            {result['clicks']}  (emitidos {result['emitted']})")
+    print(f"Hook (µs):        p50 {hook['p50']}  p99 {hook['p99']}  max {hook['max']}")
+    print(f"Clic->evento (ms): p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+
+
+if __name__ == "__main__":
+    main()
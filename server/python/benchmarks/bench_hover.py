@@ -0,0 +1,128 @@
+"""
+Benchmark de hover - Reproduce un flujo sintético de movimientos del mouse
+contra TrackingService (sobre el escritorio simulado) y reporta hit-tests,
+tiempo de CPU y latencia movimiento -> evento hover.
+
+Uso:
+    python benchmarks/bench_hover.py [--bursts 50] [--hit-latency 0.005] [--json]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tracking_service  # noqa: E402
+from backends.simulated import SimulatedDesktop  # noqa: E402
+
+
+class HoverRecorder(io.TextIOBase):
+    """Reemplaza stdout y registra el instante de cada evento hover"""
+
+    def __init__(self):
+        self.hover_times = []
+        self._lock = threading.Lock()
+
+    def write(self, s):
+        if '"event": "hover"' in s:
+            with self._lock:
+                self.hover_times.append(time.monotonic())
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def run(bursts: int, burst_moves: int, move_interval: float, rest: float,
+        hit_latency: float, hover_delay: float) -> dict:
+    desktop = SimulatedDesktop.demo(latency={"control_from_point": hit_latency})
+    service = tracking_service.TrackingService(desktop)
+
+    recorder = HoverRecorder()
+    real_stdout = sys.stdout
+    sys.stdout = recorder
+
+    burst_ends = []
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    try:
+        service.start(hover_delay=hover_delay)
+        for b in range(bursts):
+            # Cada ráfaga termina en un control distinto de la cuadrícula demo
+            col, row = b % 8, (b // 8) % 10
+            end_x, end_y = 130 + col * 120, 160 + row * 40
+            for i in range(burst_moves):
+                desktop.mouse.move(end_x - (burst_moves - 1 - i), end_y)
+                time.sleep(move_interval)
+            burst_ends.append(service.last_move_time)
+            time.sleep(rest)
+    finally:
+        service.stop()
+        sys.stdout = real_stdout
+
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+
+    # Latencia: primer hover posterior al último movimiento de cada ráfaga
+    latencies = []
+    hovers = sorted(recorder.hover_times)
+    for end in burst_ends:
+        after = [t for t in hovers if t >= end]
+        if after:
+            latencies.append((after[0] - end) * 1000)
+
+    latencies.sort()
+
+    def pct(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+    return {
+        "moves": bursts * burst_moves,
+        "hoverEvents": len(hovers),
+        "hitTests": desktop.calls["control_from_point"],
+        "cpuSeconds": round(cpu, 4),
+        "wallSeconds": round(wall, 3),
+        "latencyMs": {
+            "mean": round(statistics.mean(latencies), 3) if latencies else None,
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "max": round(latencies[-1], 3) if latencies else None
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de hover")
+    parser.add_argument("--bursts", type=int, default=50)
+    parser.add_argument("--burst-moves", type=int, default=40)
+    parser.add_argument("--move-interval", type=float, default=0.002)
+    parser.add_argument("--rest", type=float, default=0.3)
+    parser.add_argument("--hit-latency", type=float, default=0.005)
+    parser.add_argument("--hover-delay", type=float, default=0.1)
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    result = run(args.bursts, args.burst_moves, args.move_interval, args.rest,
+                 args.hit_latency, args.hover_delay)
+
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"Movimientos:      {result['moves']}")
+    print(f"Eventos hover:    {result['hoverEvents']}")
+    print(f"Hit-tests:        {result['hitTests']}")
+    print(f"CPU (s):          {result['cpuSeconds']}  (wall {result['wallSeconds']} s)")
+    lat = result["latencyMs"]
+    print(f"Latencia (ms):    media {lat['mean']}  p50 {lat['p50']}  p95 {lat['p95']}  max {lat['max']}")
+
+
+if __name__ == "__main__":
+    main()
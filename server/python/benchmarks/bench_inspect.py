@@ -0,0 +1,84 @@
+"""
+Benchmark de inspección - Compara el costo de resolver un elemento leyendo
+propiedad por propiedad (una llamada COM cada una) contra la consulta en lote
+(CacheRequest) para cada nivel de detalle.
+
+Uso:
+    python benchmarks/bench_inspect.py [--points 200] [--call-latency 0.0005] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backends.base import UIABackend  # noqa: E402
+from backends.simulated import SimulatedDesktop  # noqa: E402
+from tracking_service import UIInspector  # noqa: E402
+
+COST_KINDS = ("control_from_point", "property", "parent", "children", "value_pattern")
+
+
+class PerPropertyUIA(UIABackend):
+    """UIA que ignora la consulta en lote: una llamada por propiedad"""
+
+    available = True
+
+    def __init__(self, uia):
+        self._uia = uia
+
+    def control_from_point(self, x: int, y: int):
+        return self._uia.control_from_point(x, y)
+
+
+def run(points: int, call_latency: float) -> dict:
+    desktop = SimulatedDesktop.demo(latency={kind: call_latency for kind in COST_KINDS})
+    coords = [(130 + (i % 8) * 120, 160 + ((i // 8) % 10) * 40) for i in range(points)]
+
+    def measure(inspector, level):
+        desktop.calls.clear()
+        started = time.perf_counter()
+        for x, y in coords:
+            inspector.get_element_at_point(x, y, use_cache=False, level=level)
+        elapsed = time.perf_counter() - started
+        calls = sum(desktop.calls[kind] for kind in COST_KINDS)
+        return {
+            "callsPerElement": round(calls / points, 2),
+            "msPerElement": round(elapsed / points * 1000, 3)
+        }
+
+    batched = UIInspector(desktop)
+    legacy = UIInspector(desktop)
+    legacy.uia = PerPropertyUIA(desktop.uia)
+
+    return {
+        "points": points,
+        "callLatencyMs": call_latency * 1000,
+        "perProperty": {level: measure(legacy, level) for level in ("minimal", "standard", "full")},
+        "batched": {level: measure(batched, level) for level in ("minimal", "standard", "full")}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de resolución de elementos por nivel")
+    parser.add_argument("--points", type=int, default=200)
+    parser.add_argument("--call-latency", type=float, default=0.0005)
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    result = run(args.points, args.call_latency)
+
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"{'modo':<14}{'nivel':<10}{'llamadas/elem':>14}{'ms/elem':>10}")
+    for mode in ("perProperty", "batched"):
+        for level, row in result[mode].items():
+            print(f"{mode:<14}{level:<10}{row['callsPerElement']:>14}{row['msPerElement']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark de overlay - Reproduce una secuencia de resaltados tipo hover
+(mover el principal, lotes de highlight_many, limpiar) contra ElementOverlay
+en los dos modos de render sobre el escritorio simulado, y cuenta frames,
+actualizaciones de la ventana retenida e invalidaciones del escritorio.
+
+Uso:
+    python benchmarks/bench_overlay.py [--changes 60] [--hold 0.1] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from backends.simulated import SimulatedDesktop  # noqa: E402
+from metrics import StageMetrics  # noqa: E402
+from overlay import DESKTOP, LAYERED, ElementOverlay  # noqa: E402
+
+
+def run_mode(mode: str, changes: int, hold: float) -> dict:
+    desktop = SimulatedDesktop.demo()
+    overlay = ElementOverlay(desktop, StageMetrics(), mode=mode)
+    overlay.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        for i in range(changes):
+            col, row = i % 8, (i // 8) % 10
+            if i % 10 == 9:
+                overlay.clear()
+            elif i % 5 == 4:
+                overlay.highlight_many([{"x": 80 + c * 120, "y": 150 + row * 40, "width": 100, "height": 20,
+                                         "label": f"campo {c}"} for c in range(3)])
+            else:
+                overlay.set_highlight(80 + col * 120, 150 + row * 40, 100, 20)
+            time.sleep(hold)
+    finally:
+        overlay.stop()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    stats = overlay.stats()
+    gdi = desktop.gdi
+    return {
+        "mode": stats["mode"],
+        "changes": changes,
+        "frames": stats["frames"],
+        "updates": stats["updates"],
+        "renderPerChange": round((stats["frames"] + stats["updates"]) / changes, 3),
+        "desktopInvalidations": desktop.calls["gdi_invalidate_all"],
+        "gdiCalls": desktop.calls["gdi"],
+        "cpuMsPerSecond": round(cpu / wall * 1000, 2) if wall else None,
+        "leaked": {"dcs": len(gdi.live_dcs), "objects": len(gdi.live_objects)}
+    }
+
+
+def run(changes: int = 60, hold: float = 0.1) -> dict:
+    return {mode: run_mode(mode, changes, hold) for mode in (LAYERED, DESKTOP)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de modos de render del overlay")
+    parser.add_argument("--changes", type=int, default=60, help="Cambios del conjunto de resaltados")
+    parser.add_argument("--hold", type=float, default=0.1, help="Segundos entre cambios")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    result = run(args.changes, args.hold)
+    if args.json:
+        print(json.dumps(result))
+        return
+    for mode, r in result.items():
+        print(f"{mode:<8} frames {r['frames']:>4}  updates {r['updates']:>4}  render/cambio {r['renderPerChange']:>6}  "
+              f"invalidaciones {r['desktopInvalidations']:>3}  llamadas GDI {r['gdiCalls']:>5}  "
+              f"CPU {r['cpuMsPerSecond']} ms/s  fugas {r['leaked']}")
+
+
+if __name__ == "__main__":
+    main()
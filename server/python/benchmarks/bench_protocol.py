@@ -0,0 +1,184 @@
+"""
+Benchmark del protocolo de salida - Compara el modo line-JSON con frames
+binarios agrupados: eventos por segundo, bytes por evento y escrituras
+(syscalls) por evento.
+
+El caso de contrapresión escribe a un destino lento (cada write tarda
+`--write-delay`) mezclando hovers y clics: mide cuánto bloquea `emit` al
+productor y cuántos hovers se descartan por viejos.
+
+Uso:
+    python benchmarks/bench_protocol.py [--events 50000] [--batch-window 0.005] [--json]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocol import EventWriter, decode_frames  # noqa: E402
+
+
+class CountingRaw(io.RawIOBase):
+    """Destino tipo stdout que escribe a /dev/null y cuenta syscalls y bytes"""
+
+    def __init__(self, keep: bool = False, delay: float = 0.0):
+        self.fd = os.open(os.devnull, os.O_WRONLY)
+        self.delay = delay
+        self.syscalls = 0
+        self.bytes = 0
+        self.data = bytearray() if keep else None
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.delay:
+            # Lector lento: el pipe tarda en aceptar cada escritura
+            time.sleep(self.delay)
+        self.syscalls += 1
+        self.bytes += len(b)
+        if self.data is not None:
+            self.data += b
+        return os.write(self.fd, b)
+
+    def close(self):
+        os.close(self.fd)
+        super().close()
+
+
+def make_stdout(raw: CountingRaw):
+    return io.TextIOWrapper(io.BufferedWriter(raw), encoding="utf-8", write_through=False)
+
+
+def synthetic_hovers(count: int):
+    events = []
+    for i in range(count):
+        r, c = (i // 8) % 10, i % 8
+        events.append({
+            "event": "hover",
+            "x": 130 + c * 120 + i % 7,
+            "y": 160 + r * 40,
+            "element": {
+                "name": f"Campo {r}-{c}",
+                "type": "edit",
+                "controlType": "EditControl",
+                "className": "Edit",
+                "automationId": f"txt_{r}_{c}",
+                "value": "",
+                "isEnabled": True,
+                "isVisible": True,
+                "isInteractive": True,
+                "bounds": {"x": 120 + c * 120, "y": 150 + r * 40, "width": 110, "height": 30},
+                "parentName": "Formulario"
+            }
+        })
+    return events
+
+
+def run_mode(events, mode: str, batch_window: float, verify: bool = False) -> dict:
+    raw = CountingRaw(keep=verify)
+    stdout = make_stdout(raw)
+    # Sin coalescer: aquí se mide el codec, todos los hovers deben llegar
+    writer = EventWriter(stdout, mode=mode, batch_window=batch_window, coalesce_hovers=False)
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for event in events:
+        writer.emit(event)
+    writer.flush()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    result = {
+        "mode": mode if mode == "json" else f"{mode} ({batch_window * 1000:g} ms)",
+        "eventsPerSecond": round(len(events) / elapsed),
+        "bytesPerEvent": round(raw.bytes / len(events), 2),
+        "writesPerEvent": round(raw.syscalls / len(events), 4),
+        "cpuMicrosPerEvent": round(cpu / len(events) * 1e6, 2)
+    }
+
+    if verify:
+        if mode == "json":
+            decoded = [json.loads(line) for line in raw.data.decode("utf-8").splitlines()]
+        else:
+            decoded = decode_frames(bytes(raw.data))
+        result["roundTrip"] = decoded == events
+
+    stdout.close()
+    return result
+
+
+def run_backpressure(events, write_delay: float = 0.002, click_every: int = 50) -> dict:
+    """Productor rápido contra un lector lento: latencia de `emit` y hovers descartados"""
+    raw = CountingRaw(keep=True, delay=write_delay)
+    stdout = make_stdout(raw)
+    writer = EventWriter(stdout, mode="json")
+
+    emits = []
+    clicks = 0
+    for i, event in enumerate(events):
+        if i % click_every == 0:
+            event = {"event": "click", "x": event["x"], "y": event["y"], "element": event["element"]}
+            clicks += 1
+        started = time.perf_counter()
+        writer.emit(event, flush=event["event"] == "click")
+        emits.append(time.perf_counter() - started)
+    writer.flush()
+    stats = writer.stats()
+
+    decoded = [json.loads(line) for line in raw.data.decode("utf-8").splitlines()]
+    emits.sort()
+    result = {
+        "events": len(events),
+        "written": len(decoded),
+        "clicksLost": clicks - sum(1 for e in decoded if e["event"] == "click"),
+        "lastHoverDelivered": decoded[-1] == events[-1] if events[-1]["event"] == "hover" else None,
+        "coalesced": stats["coalesced"],
+        "emitUs": {
+            "p50": round(emits[len(emits) // 2] * 1e6, 1),
+            "p99": round(emits[min(len(emits) - 1, int(len(emits) * 0.99))] * 1e6, 1),
+            "max": round(emits[-1] * 1e6, 1)
+        },
+        "writes": raw.syscalls
+    }
+    stdout.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del protocolo de eventos")
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--batch-window", type=float, default=0.005)
+    parser.add_argument("--write-delay", type=float, default=0.002, help="Demora por write del lector lento (s)")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    events = synthetic_hovers(args.events)
+    results = [
+        run_mode(events, "json", 0, verify=True),
+        run_mode(events, "binary", 0, verify=True),
+        run_mode(events, "binary", args.batch_window, verify=True),
+    ]
+    backpressure = run_backpressure(events[:5000], args.write_delay)
+
+    if args.json:
+        print(json.dumps({"modes": results, "backpressure": backpressure}))
+        return
+
+    print(f"{'modo':<22}{'eventos/s':>12}{'bytes/evt':>12}{'writes/evt':>12}{'CPU us/evt':>12}  ida y vuelta")
+    for r in results:
+        print(f"{r['mode']:<22}{r['eventsPerSecond']:>12}{r['bytesPerEvent']:>12}"
+              f"{r['writesPerEvent']:>12}{r['cpuMicrosPerEvent']:>12}  {'ok' if r['roundTrip'] else 'ERROR'}")
+    bp = backpressure
+    print(f"\nLector lento ({args.write_delay * 1000:g} ms/write): {bp['written']}/{bp['events']} eventos escritos, "
+          f"{bp['coalesced']} hovers descartados, {bp['clicksLost']} clics perdidos, "
+          f"último hover {'ok' if bp['lastHoverDelivered'] else 'PERDIDO'}, "
+          f"emit p99 {bp['emitUs']['p99']} us (max {bp['emitUs']['max']} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Replay - Reproduce trazas de mouse y comandos contra TrackingService sobre
+el escritorio simulado y mide throughput, latencia extremo a extremo y CPU.
+
+Una traza es una lista de pasos con su instante relativo (segundos):
+
+    {"t": 0.10, "op": "move", "x": 130, "y": 160}
+    {"t": 0.25, "op": "click", "x": 130, "y": 160, "button": "left"}
+    {"t": 0.30, "op": "command", "cmd": {"action": "get_element", "x": 250, "y": 160}}
+    {"t": 0.40, "op": "type", "text": "hola"}
+    {"t": 0.45, "op": "key", "key": "enter"}
+
+Se puede cargar desde un archivo JSON lines, desde una sesión grabada
+(.alqlog, ver session_log.py: hovers -> move, clicks -> click, type -> type,
+key -> key) o generar con
+synthetic_trace(). Los comandos pasan por CommandDispatcher igual que en el
+servicio (los lentos van al pool de workers).
+
+Latencias medidas:
+    move     último movimiento a (x, y) -> evento hover/hover_update en (x, y)
+    click    click del hook -> evento click en (x, y)
+    command  envío -> respuesta con el mismo id
+
+Con --hang S/N la aplicación simulada se cuelga S segundos en una de cada N
+inspecciones (ver SimulatedDesktop.hang): mide cuánto acota el pool de
+inspección la latencia del hover. Con --prefetch el prefetch por trayectoria
+(ver prefetch.py) resuelve el elemento mientras el cursor aún se mueve. Con
+--subscribe los filtros de event_filter.py se aplican antes de serializar.
+
+Uso:
+    python benchmarks/replay.py --scenario mixed [--steps 400] [--hit-latency 0.005] [--json]
+    python benchmarks/replay.py --trace sesion.alqlog [--speed 4]
+    python benchmarks/replay.py --scenario hover --hang 2/4
+    python benchmarks/replay.py --scenario hover --hit-latency 0.03 --prefetch
+    python benchmarks/replay.py --scenario mixed --subscribe '{"interactiveOnly": true}'
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tracking_service  # noqa: E402
+from backends.simulated import SimulatedDesktop  # noqa: E402
+from dispatcher import CommandDispatcher  # noqa: E402
+from metrics import StageMetrics  # noqa: E402
+from protocol import EventWriter  # noqa: E402
+from session_log import MAGIC, SessionReader  # noqa: E402
+
+SCENARIOS = ("hover", "clicks", "commands", "mixed")
+
+# Centro de la celda (fila, columna) de SimulatedDesktop.demo()
+ROWS, COLS = 10, 8
+
+
+def _cell(r: int, c: int):
+    return 130 + c * 120, 160 + r * 40
+
+
+# -- Trazas --
+
+def synthetic_trace(scenario: str = "mixed", steps: int = 400, seed: int = 7,
+                    move_interval: float = 0.004, rest: float = 0.15) -> List[Dict]:
+    """Traza sintética reproducible (misma semilla, misma traza)"""
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Escenario desconocido: {scenario}")
+    rng = random.Random(seed)
+    trace: List[Dict] = []
+    t = 0.0
+
+    def burst_to(r, c, moves=12):
+        nonlocal t
+        x, y = _cell(r, c)
+        for i in range(moves):
+            trace.append({"t": round(t, 4), "op": "move", "x": x - (moves - 1 - i) * 3, "y": y})
+            t += move_interval
+        return x, y
+
+    def command(cmd):
+        nonlocal t
+        trace.append({"t": round(t, 4), "op": "command", "cmd": cmd})
+        t += 0.01
+
+    while len(trace) < steps:
+        r, c = rng.randrange(ROWS), rng.randrange(COLS)
+        if scenario == "hover":
+            burst_to(r, c)
+            t += rest
+        elif scenario == "clicks":
+            x, y = _cell(r, c)
+            trace.append({"t": round(t, 4), "op": "click", "x": x, "y": y,
+                          "button": "right" if rng.random() < 0.1 else "left"})
+            t += 0.05
+        elif scenario == "commands":
+            x, y = _cell(r, c)
+            choice = rng.random()
+            if choice < 0.4:
+                command({"action": "highlight", "x": x - 10, "y": y - 10, "width": 110, "height": 30})
+            elif choice < 0.8:
+                command({"action": "get_element", "x": x, "y": y, "level": "standard"})
+            else:
+                command({"action": "get_clicks", "max": 100})
+        else:
+            x, y = burst_to(r, c, moves=8)
+            t += rest / 2
+            if rng.random() < 0.5:
+                trace.append({"t": round(t, 4), "op": "click", "x": x, "y": y, "button": "left"})
+                t += 0.03
+            if rng.random() < 0.3:
+                command({"action": "get_element", "x": x, "y": y, "level": "standard"})
+            if rng.random() < 0.2:
+                command({"action": "get_clicks", "max": 100})
+            t += rest / 2
+    return trace[:steps]
+
+
+def trace_from_session(path: str) -> List[Dict]:
+    """Convierte una sesión grabada: cada hover es un movimiento y cada clic un clic"""
+    trace = []
+    start = None
+    for event in SessionReader(path).read(event_types=("hover", "hover_update", "click", "type", "key")):
+        ts = event.get("ts", 0.0)
+        start = ts if start is None else start
+        if event["event"] == "type" and not event.get("masked"):
+            trace.append({"t": round(ts - start, 4), "op": "type", "text": event.get("text", "")})
+            continue
+        if event["event"] == "key":
+            trace.append({"t": round(ts - start, 4), "op": "key", "key": event.get("key")})
+            continue
+        step = {"t": round(ts - start, 4), "x": event.get("x"), "y": event.get("y")}
+        if step["x"] is None or step["y"] is None:
+            continue
+        if event["event"] == "click":
+            step.update(op="click", button=event.get("clickType", "left"))
+        else:
+            step["op"] = "move"
+        trace.append(step)
+    trace.sort(key=lambda s: s["t"])
+    return trace
+
+
+def load_trace(path: str) -> List[Dict]:
+    with open(path, "rb") as f:
+        head = f.read(len(MAGIC))
+    if head == MAGIC:
+        return trace_from_session(path)
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.load(io.StringIO(text))
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+# -- Reproducción --
+
+class CapturedOutput(io.TextIOBase):
+    """Destino del EventWriter: guarda cada línea con su instante (sin parsear
+    en caliente para no cargar la CPU medida)"""
+
+    def __init__(self):
+        self.lines = []
+        self._lock = threading.Lock()
+
+    def write(self, s):
+        now = time.perf_counter()
+        with self._lock:
+            self.lines.append((now, s))
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def events(self):
+        with self._lock:
+            lines = list(self.lines)
+        for at, chunk in lines:
+            for line in chunk.splitlines():
+                if line.strip():
+                    yield at, json.loads(line)
+
+
+def _percentiles(samples: List[float]) -> Dict:
+    if not samples:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    samples = sorted(samples)
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3)
+
+    return {"count": len(samples), "p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99),
+            "max": round(samples[-1] * 1000, 3)}
+
+
+def replay(trace: List[Dict], latency: Optional[Dict[str, float]] = None, speed: float = 1.0,
+           hover_delay: float = 0.05, scene: str = None, settle: float = 0.5,
+           hang: Optional[tuple] = None, prefetch=None, subscribe: Optional[Dict] = None) -> Dict:
+    """Reproduce `trace` y devuelve el informe de throughput, latencia y CPU.
+    `hang` = (segundos, cada n) cuelga la aplicación simulada; `prefetch` se
+    pasa tal cual a TrackingService.start y `subscribe` a TrackingService.subscribe."""
+    desktop = SimulatedDesktop.load(scene, latency) if scene else SimulatedDesktop.demo(latency=latency)
+    if hang:
+        desktop.hang(seconds=hang[0], every=hang[1])
+    output = CapturedOutput()
+    metrics = StageMetrics()
+    writer = EventWriter(output, metrics=metrics)
+    service = tracking_service.TrackingService(desktop, writer, metrics=metrics)
+    dispatcher = CommandDispatcher(
+        tracking_service.build_commands(service),
+        lambda event: writer.emit(event, flush=True),
+        slow_actions=tracking_service.SLOW_COMMANDS
+    )
+
+    move_at: Dict[tuple, float] = {}
+    click_at: Dict[tuple, deque] = defaultdict(deque)
+    command_at: Dict[int, float] = {}
+    ops = defaultdict(int)
+
+    keyboard = any(step["op"] in ("type", "key") for step in trace)
+    if subscribe:
+        service.subscribe(subscribe)
+    service.start(hover_delay=hover_delay, keyboard=keyboard, prefetch=prefetch)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        for index, step in enumerate(trace):
+            due = wall_start + step.get("t", 0.0) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            op = step["op"]
+            ops[op] += 1
+            if op == "move":
+                move_at[(step["x"], step["y"])] = time.perf_counter()
+                desktop.mouse.move(step["x"], step["y"])
+            elif op == "click":
+                click_at[(step["x"], step["y"])].append(time.perf_counter())
+                desktop.mouse.click(step["x"], step["y"], step.get("button", "left"))
+            elif op == "command":
+                cmd = dict(step["cmd"], id=index)
+                command_at[index] = time.perf_counter()
+                dispatcher.dispatch(cmd)
+            elif op == "type":
+                desktop.keyboard.type_text(step["text"])
+            elif op == "key":
+                desktop.keyboard.tap(step["key"])
+        # Esperar a que terminen hover pendiente, clics encolados y comandos lentos
+        time.sleep(max(settle, hover_delay * 2))
+        dispatcher.drain(timeout=5.0)
+        prefetch_stats = service.prefetcher.stats() if service.prefetcher else None
+    finally:
+        # Sin hilos sueltos para el caso siguiente de la suite: stop() cierra
+        # también el pool de inspección
+        dispatcher.close()
+        service.stop()
+        writer.close()
+        desktop.unhang()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    latencies = defaultdict(list)
+    kinds = defaultdict(int)
+    emitted = 0
+    for at, event in output.events():
+        kind = event.get("event")
+        if kind in ("tracking_started", "tracking_stopped"):
+            continue
+        emitted += 1
+        kinds[kind or "other"] += 1
+        if "id" in event and event["id"] in command_at:
+            latencies["command"].append(at - command_at.pop(event["id"]))
+        elif kind in ("hover", "hover_update"):
+            sent = move_at.get((event.get("x"), event.get("y")))
+            if sent is not None:
+                latencies["move"].append(at - sent)
+        elif kind == "click":
+            pending = click_at.get((event.get("x"), event.get("y")))
+            if pending:
+                latencies["click"].append(at - pending.popleft())
+
+    return {
+        "steps": len(trace),
+        "ops": dict(ops),
+        "events": emitted,
+        "eventKinds": dict(kinds),
+        "wallSeconds": round(wall, 3),
+        "eventsPerSecond": round(emitted / wall, 1) if wall else None,
+        "cpuUsPerEvent": round(cpu / emitted * 1e6, 1) if emitted else None,
+        "cpuUsPerStep": round(cpu / len(trace) * 1e6, 1) if trace else None,
+        "latencyMs": {kind: _percentiles(samples) for kind, samples in sorted(latencies.items())},
+        "unanswered": {"clicks": sum(len(q) for q in click_at.values()), "commands": len(command_at)},
+        "uiaCalls": dict(desktop.calls),
+        "inspection": {key: value for key, value in service.inspect_pool.stats().items()
+                       if key in ("timeouts", "recycled", "hedges", "hedgeWins", "skipped")},
+        "prefetch": prefetch_stats,
+        "subscription": service.event_filter.stats() if subscribe else None,
+        "stages": metrics.summary()["stages"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce trazas contra TrackingService simulado")
+    parser.add_argument("--trace", help="Traza JSON lines o sesión .alqlog")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="mixed")
+    parser.add_argument("--steps", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor de aceleración de la traza")
+    parser.add_argument("--hit-latency", type=float, default=0.005, help="Latencia de ControlFromPoint (s)")
+    parser.add_argument("--property-latency", type=float, default=0.0, help="Latencia por propiedad (s)")
+    parser.add_argument("--hover-delay", type=float, default=0.05)
+    parser.add_argument("--scene", help="Escenario JSON del escritorio simulado")
+    parser.add_argument("--hang", help="Cuelgue de la app: SEGUNDOS/CADA_N inspecciones (p.ej. 2/4)")
+    parser.add_argument("--prefetch", action="store_true", help="Activa el prefetch por trayectoria")
+    parser.add_argument("--subscribe", help="Filtros de suscripción (JSON, ver event_filter.py)")
+    parser.add_argument("--save-trace", help="Guarda la traza usada (JSON lines)")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args.scenario, args.steps, args.seed)
+    if args.save_trace:
+        with open(args.save_trace, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(step) + "\n" for step in trace)
+
+    latency = {"control_from_point": args.hit_latency, "property": args.property_latency}
+    hang = tuple(float(v) for v in args.hang.split("/")) if args.hang else None
+    result = replay(trace, latency, args.speed, args.hover_delay, args.scene, hang=hang,
+                    prefetch=args.prefetch or None,
+                    subscribe=json.loads(args.subscribe) if args.subscribe else None)
+
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"Pasos:            {result['steps']}  {result['ops']}")
+    print(f"Eventos:          {result['events']}  {result['eventKinds']}")
+    print(f"Throughput:       {result['eventsPerSecond']} eventos/s  (wall {result['wallSeconds']} s)")
+    print(f"CPU:              {result['cpuUsPerEvent']} µs/evento  {result['cpuUsPerStep']} µs/paso")
+    for kind, lat in result["latencyMs"].items():
+        print(f"Latencia {kind:<8} (ms): p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  "
+              f"max {lat['max']}  (n={lat['count']})")
+    print(f"Sin respuesta:    {result['unanswered']}")
+    if hang:
+        hit_test = result["stages"].get("hover.hit_test", {})
+        print(f"Hit-test hover:   p99 {hit_test.get('p99')} ms  max {hit_test.get('max')} ms  {result['inspection']}")
+    if result["subscription"]:
+        print(f"Suscripción:      admitidos {result['subscription']['admitted']}  "
+              f"descartados {result['subscription']['dropped']}")
+    if result["prefetch"]:
+        prefetch = result["prefetch"]
+        print(f"Prefetch:         emitidas {prefetch['issued']}  útiles {prefetch['usefulRate']}  "
+              f"hit rate {prefetch['buffer']['hitRate']}  saltadas {prefetch['skipped']}")
+
+
+if __name__ == "__main__":
+    main()
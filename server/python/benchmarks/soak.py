@@ -0,0 +1,251 @@
+"""
+Soak - Prueba de larga duración contra el escritorio simulado con
+instrumentación de fugas
+
+Reproduce trazas sintéticas (movimientos, clics, comandos, resaltados y
+teclado) sin parar durante `--hours` de actividad simulada, comprimidas por
+`--speed` (4 horas a 120x son 2 minutos). hover_delay se escala igual para
+que el hover siga disparando. Cada `--restart-every` segmentos el tracking se
+detiene y se vuelve a iniciar (hilos, overlay y ventana retenida nuevos).
+
+Durante la prueba toma muestras de Diagnostics (heap con tracemalloc, hilos,
+recursos vivos del servicio y objetos/DCs vivos del GDI simulado) y al final
+falla (código 1) si:
+
+    - alguna serie crece de forma sostenida (diagnostics.monotonic_growth)
+      después del calentamiento
+    - tras stop() quedan DCs, objetos GDI o ventanas del overlay sin liberar,
+      o hilos del servicio vivos
+
+Uso:
+    python benchmarks/soak.py [--hours 4] [--speed 120] [--samples 40] [--json]
+    python benchmarks/soak.py --hours 8 --speed 240 --record
+
+La suite ejecuta una versión corta (caso "soak").
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import replay  # noqa: E402
+import tracking_service  # noqa: E402
+from backends.simulated import SimulatedDesktop  # noqa: E402
+from diagnostics import TREND_SEGMENTS, Diagnostics  # noqa: E402
+from dispatcher import CommandDispatcher  # noqa: E402
+from metrics import StageMetrics  # noqa: E402
+from protocol import EventWriter  # noqa: E402
+
+SEGMENT_STEPS = 200
+
+
+class NullOutput(io.TextIOBase):
+    """Destino del EventWriter que solo cuenta (guardar las líneas sería una fuga)"""
+
+    def __init__(self):
+        self.writes = 0
+        self.chars = 0
+
+    def write(self, s):
+        self.writes += 1
+        self.chars += len(s)
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def _segment(index: int) -> List[Dict]:
+    """Traza mixta más resaltados múltiples y texto tecleado"""
+    trace = replay.synthetic_trace("mixed", SEGMENT_STEPS, seed=index)
+    end = trace[-1]["t"] if trace else 0.0
+    row = index % replay.ROWS
+    trace += [
+        {"t": end + 0.05, "op": "command", "cmd": {"action": "highlight_many", "highlights": [
+            {"x": 70 + c * 120, "y": 145 + row * 40, "width": 110, "height": 30, "label": f"c{c}"}
+            for c in range(4)]}},
+        {"t": end + 0.10, "op": "type", "text": f"soak {index}"},
+        {"t": end + 0.15, "op": "key", "key": "enter"},
+        {"t": end + 0.20, "op": "command", "cmd": {"action": "get_clicks", "max": 500}},
+        {"t": end + 0.25, "op": "command", "cmd": {"action": "clear_highlight"}},
+    ]
+    return trace
+
+
+def _play(trace: List[Dict], desktop: SimulatedDesktop, dispatcher: CommandDispatcher, speed: float,
+          next_id: List[int]) -> float:
+    """Reproduce un segmento; devuelve su duración simulada (s)"""
+    start = time.perf_counter()
+    for step in trace:
+        delay = start + step["t"] / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        op = step["op"]
+        if op == "move":
+            desktop.mouse.move(step["x"], step["y"])
+        elif op == "click":
+            desktop.mouse.click(step["x"], step["y"], step.get("button", "left"))
+        elif op == "command":
+            next_id[0] += 1
+            dispatcher.dispatch(dict(step["cmd"], id=next_id[0]))
+        elif op == "type":
+            desktop.keyboard.type_text(step["text"])
+        elif op == "key":
+            desktop.keyboard.tap(step["key"])
+    return trace[-1]["t"] if trace else 0.0
+
+
+def soak(hours: float = 4.0, speed: float = 120.0, samples: int = 40, warmup: float = 0.15,
+         restart_every: int = 25, hover_delay: float = 0.05, record: bool = False,
+         on_sample=None) -> Dict:
+    """Ejecuta la prueba y devuelve el informe (`failures` vacío si pasa)"""
+    desktop = SimulatedDesktop.demo()
+    output = NullOutput()
+    metrics = StageMetrics()
+    writer = EventWriter(output, metrics=metrics)
+    service = tracking_service.TrackingService(desktop, writer, metrics=metrics)
+    dispatcher = CommandDispatcher(
+        tracking_service.build_commands(service),
+        lambda event: writer.emit(event, flush=True),
+        slow_actions=tracking_service.SLOW_COMMANDS
+    )
+    gdi = desktop.gdi
+    diagnostics = Diagnostics(lambda: dict(
+        service.resource_stats(),
+        gdi={"liveDcs": len(gdi.live_dcs), "liveObjects": len(gdi.live_objects)}
+    ))
+    record_dir = tempfile.mkdtemp(prefix="alqvimia-soak-") if record else None
+
+    def start():
+        service.start(hover_delay=max(0.001, hover_delay / speed), keyboard=True,
+                      record={"path": os.path.join(record_dir, f"soak-{segments}.alqlog")}
+                      if record_dir else None)
+
+    threads_before = {t.ident for t in threading.enumerate()}
+    # Las muestras activan tracemalloc: al salir se deja como estaba (con
+    # tracing activo los casos siguientes de la suite van ~10x más lentos)
+    was_tracing = tracemalloc.is_tracing()
+    wall_budget = hours * 3600 / speed
+    sample_every = wall_budget / max(1, samples)
+    warmup_until = time.perf_counter() + wall_budget * warmup
+    warmed = False
+    segments = 0
+    simulated = 0.0
+    next_id = [0]
+    report = None
+
+    started = time.perf_counter()
+    next_sample = started + sample_every
+    start()
+    try:
+        while time.perf_counter() - started < wall_budget:
+            simulated += _play(_segment(segments), desktop, dispatcher, speed, next_id)
+            segments += 1
+            restart = bool(restart_every) and segments % restart_every == 0
+            now = time.perf_counter()
+            if not warmed and now >= warmup_until:
+                # Cachés, pools y buffers acotados ya llenos: desde aquí no deben crecer
+                diagnostics.reset()
+                warmed = True
+            # Con reinicios se muestrea justo antes de stop(): siempre en la misma fase
+            # del ciclo (si no, el diente de sierra de cada sesión parece tendencia)
+            if now >= next_sample and (restart or not restart_every):
+                next_sample = now + sample_every
+                sample = diagnostics.sample(top=5)
+                if on_sample:
+                    on_sample(segments, simulated, sample)
+            if restart:
+                service.stop()
+                start()
+        dispatcher.drain(timeout=5.0)
+        report = diagnostics.sample(top=10)
+    finally:
+        dispatcher.close()
+        service.stop()
+        writer.close()
+        if not was_tracing:
+            diagnostics.stop_trace()
+        if record_dir:
+            shutil.rmtree(record_dir, ignore_errors=True)
+
+    # Tras stop(): nada del overlay ni del GDI simulado debe quedar vivo
+    time.sleep(0.2)
+    overlay = service.overlay.resource_stats()
+    leftover_threads = sorted(t.name for t in threading.enumerate()
+                              if t.ident not in threads_before and t.is_alive() and t.name != "prewarm")
+    failures = [f"crecimiento sostenido: {name}" for name, growing in report["trends"].items() if growing]
+    if report["samples"] < TREND_SEGMENTS * 2:
+        failures.append(f"solo {report['samples']} muestras tras el calentamiento (mínimo {TREND_SEGMENTS * 2}): "
+                        "alargar --hours o bajar --restart-every")
+    for name in ("liveDcs", "liveObjects", "liveSurfaces"):
+        if overlay[name]:
+            failures.append(f"overlay.{name} = {overlay[name]} tras stop()")
+    if gdi.live_dcs or gdi.live_objects:
+        failures.append(f"GDI simulado: {len(gdi.live_dcs)} DCs y {len(gdi.live_objects)} objetos vivos tras stop()")
+    if leftover_threads:
+        failures.append(f"hilos vivos tras stop(): {leftover_threads}")
+
+    return {
+        "hoursSimulated": round(simulated / 3600, 3),
+        "wallSeconds": round(time.perf_counter() - started, 1),
+        "segments": segments,
+        "events": writer.stats()["events"],
+        "samples": report["samples"],
+        "trends": report["trends"],
+        "heap": {key: report["heap"].get(key) for key in ("currentBytes", "peakBytes", "growthBytes")},
+        "topGrowth": report["heap"].get("topSinceBaseline", [])[:5],
+        "threads": report["threads"],
+        "overlay": overlay,
+        "history": list(diagnostics.history),
+        "errors": metrics.errors(),
+        "failures": failures
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de larga duración con detección de fugas")
+    parser.add_argument("--hours", type=float, default=4.0, help="Horas de actividad simulada")
+    parser.add_argument("--speed", type=float, default=120.0, help="Factor de aceleración")
+    parser.add_argument("--samples", type=int, default=40, help="Muestras de diagnostics durante la prueba")
+    parser.add_argument("--warmup", type=float, default=0.15, help="Fracción inicial sin contar para tendencias")
+    parser.add_argument("--restart-every", type=int, default=25, help="Segmentos entre stop/start (0: nunca)")
+    parser.add_argument("--record", action="store_true", help="Graba la sesión (en un directorio temporal)")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args()
+
+    def progress(segments, simulated, sample):
+        if not args.json:
+            heap = sample["heap"].get("currentBytes")
+            print(f"  {simulated / 3600:6.2f} h simuladas  segmentos {segments:>5}  "
+                  f"heap {heap / 1024 if heap else 0:8.1f} KiB  hilos {sample['threads']['count']}", flush=True)
+
+    result = soak(args.hours, args.speed, args.samples, args.warmup, args.restart_every,
+                  record=args.record, on_sample=progress)
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"Simulado:   {result['hoursSimulated']} h en {result['wallSeconds']} s "
+              f"({result['segments']} segmentos, {result['events']} eventos)")
+        print(f"Heap:       {result['heap']}")
+        print(f"Overlay:    {result['overlay']}")
+        print(f"Tendencias: {', '.join(n for n, g in result['trends'].items() if g) or 'ninguna'}")
+        for item in result["topGrowth"]:
+            print(f"  +{item['sizeDiff']:>8} B  {item['where']}")
+        print("OK" if not result["failures"] else "FALLO:\n  " + "\n  ".join(result["failures"]))
+    sys.exit(1 if result["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
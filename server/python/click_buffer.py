@@ -0,0 +1,226 @@
+"""
+Click Buffer - Buffer circular acotado de clics pendientes
+
+Los clics se guardan como registros compactos (__slots__ y tuplas en lugar
+de dicts anidados) en un anillo de capacidad fija, para que la memoria no
+crezca aunque el cliente deje de pedir `get_clicks` durante horas.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Orden de los campos del elemento dentro del registro compacto
+ELEMENT_FIELDS = (
+    "name", "type", "controlType", "className", "automationId", "value",
+    "isEnabled", "isVisible", "isInteractive", "bounds", "parentName", "elementId"
+)
+BOUNDS_FIELDS = ("x", "y", "width", "height")
+
+# Políticas cuando el buffer está lleno
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+def _pack_element(element: Optional[Dict]) -> Optional[Tuple]:
+    if element is None:
+        return None
+    values = []
+    for field in ELEMENT_FIELDS:
+        value = element.get(field)
+        if field == "bounds" and value is not None:
+            value = tuple(value.get(k) for k in BOUNDS_FIELDS)
+        values.append(value)
+    return tuple(values)
+
+
+def _unpack_element(packed: Optional[Tuple]) -> Optional[Dict]:
+    if packed is None:
+        return None
+    element = dict(zip(ELEMENT_FIELDS, packed))
+    if element["bounds"] is not None:
+        element["bounds"] = dict(zip(BOUNDS_FIELDS, element["bounds"]))
+    return element
+
+
+class ClickRecord:
+    """Clic en formato compacto"""
+
+    __slots__ = ("seq", "x", "y", "click_type", "wall_time", "element", "image")
+
+    def __init__(self, x: int, y: int, click_type: str, wall_time: float, element: Optional[Dict],
+                 image: Optional[Dict] = None):
+        self.seq = -1
+        self.x = x
+        self.y = y
+        self.click_type = click_type
+        self.wall_time = wall_time
+        self.element = _pack_element(element)
+        self.image = image  # referencia de ElementImager (ruta o shm), no los píxeles
+
+    def to_event(self) -> Dict:
+        """Evento `click` tal como se emite y devuelve get_clicks"""
+        event = {
+            "event": "click",
+            "seq": self.seq,
+            "x": self.x,
+            "y": self.y,
+            "clickType": self.click_type,
+            "timestamp": datetime.fromtimestamp(self.wall_time).isoformat(),
+            "element": _unpack_element(self.element)
+        }
+        if self.image is not None:
+            event["image"] = self.image
+        return event
+
+
+class ClickBuffer:
+    """Anillo de capacidad fija con números de secuencia.
+
+    - drop-oldest: descarta el clic más antiguo sin leer (contador `dropped`)
+    - drop-newest: descarta el clic entrante (contador `rejected`)
+    - block: el productor (worker de clics, nunca el hook) espera hasta
+      `block_timeout` a que haya espacio; si no lo hay, descarta el entrante
+
+    `drain(max_items)` extrae y borra (comportamiento clásico de get_clicks).
+    `read(cursor, max_items, reader)` confirma para `reader` todo lo anterior
+    a `cursor` y devuelve los siguientes sin borrarlos, para entregas al menos
+    una vez. Cada lector confirma solo lo suyo: un registro se borra cuando
+    todos los lectores lo confirmaron. Los cursores son de una sesión (`session`,
+    nueva en cada buffer); uno de otra sesión o más allá del próximo seq no
+    confirma nada.
+    """
+
+    def __init__(self, capacity: int = 1024, policy: str = DROP_OLDEST, block_timeout: float = 1.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Política desconocida: {policy}")
+        self.capacity = max(1, int(capacity))
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._ring: List[Optional[ClickRecord]] = [None] * self.capacity
+        self._head = 0  # seq del registro más antiguo sin confirmar
+        self._next = 0  # seq del próximo registro
+        self._acks: Dict[str, int] = {}  # lector -> seq confirmado
+        self.session = uuid.uuid4().hex[:12]
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.rejected = 0
+        self.overflows = 0
+        self.blocked_waits = 0
+
+    def __len__(self):
+        with self._cond:
+            return self._next - self._head
+
+    def push(self, record: ClickRecord) -> bool:
+        """Agrega un clic; devuelve False si la política lo descartó"""
+        with self._cond:
+            if self._next - self._head >= self.capacity:
+                self.overflows += 1
+                if self.policy == DROP_NEWEST:
+                    self.rejected += 1
+                    return False
+                if self.policy == BLOCK:
+                    self.blocked_waits += 1
+                    deadline = time.monotonic() + self.block_timeout
+                    while self._next - self._head >= self.capacity:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            return False
+                        self._cond.wait(remaining)
+                else:
+                    self._ring[self._head % self.capacity] = None
+                    self._head += 1
+                    self.dropped += 1
+
+            record.seq = self._next
+            self._ring[self._next % self.capacity] = record
+            self._next += 1
+            return True
+
+    def drain(self, max_items: int = None) -> List[ClickRecord]:
+        """Extrae (y borra) hasta `max_items` clics, del más antiguo al más nuevo"""
+        with self._cond:
+            count = self._next - self._head
+            if max_items is not None:
+                count = min(count, max(0, int(max_items)))
+            records = [self._take(self._head + i) for i in range(count)]
+            self._head += count
+            if count:
+                self._cond.notify_all()
+            return records
+
+    def read(self, cursor: int, max_items: int = None, reader: str = "default",
+             session: str = None) -> Tuple[List[ClickRecord], int, int]:
+        """Confirma para `reader` los clics con seq < cursor y devuelve los
+        siguientes sin borrarlos. Devuelve también cuántos se perdieron antes
+        del más antiguo disponible (por drop-oldest o por otro lector con
+        drain) y el seq desde el que se leyó.
+
+        Un cursor de otra sesión o mayor que el próximo seq no confirma nada:
+        se lee desde lo último que confirmó `reader` en esta sesión."""
+        with self._cond:
+            cursor = max(0, int(cursor))
+            if cursor > self._next or (session is not None and session != self.session):
+                cursor = self._acks.get(reader, 0)
+            self._acks[reader] = max(cursor, self._acks.get(reader, 0))
+            self._advance()
+            start = max(cursor, self._head)
+            gap = start - cursor
+            count = self._next - start
+            if max_items is not None:
+                count = min(count, max(0, int(max_items)))
+            records = [self._ring[(start + i) % self.capacity] for i in range(count)]
+            return records, gap, start
+
+    def release(self, reader: str):
+        """Olvida un lector (cliente desconectado): deja de retener sus clics"""
+        with self._cond:
+            if self._acks.pop(reader, None) is not None:
+                self._advance()
+
+    def _advance(self):
+        """Borra lo que confirmaron todos los lectores"""
+        acked = min(min(self._acks.values(), default=self._head), self._next)
+        if acked > self._head:
+            for seq in range(self._head, acked):
+                self._ring[seq % self.capacity] = None
+            self._head = acked
+            self._cond.notify_all()
+
+    def _take(self, seq: int) -> ClickRecord:
+        slot = seq % self.capacity
+        record = self._ring[slot]
+        self._ring[slot] = None
+        return record
+
+    @property
+    def oldest_seq(self) -> int:
+        """seq del clic más antiguo sin confirmar (o el próximo si está vacío)"""
+        with self._cond:
+            return self._head
+
+    @property
+    def next_seq(self) -> int:
+        """seq que recibirá el próximo clic"""
+        with self._cond:
+            return self._next
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "size": self._next - self._head,
+                "policy": self.policy,
+                "session": self.session,
+                "nextSeq": self._next,
+                "readers": len(self._acks),
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "overflows": self.overflows,
+                "blockedWaits": self.blocked_waits
+            }
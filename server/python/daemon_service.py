@@ -0,0 +1,503 @@
+"""
+Daemon Service - Proceso único y persistente que aloja overlay y tracking
+Acepta varios clientes por socket local (Unix o TCP en localhost) con el mismo
+conjunto de comandos que tracking_service. Los comandos de overlay_service se
+envían con "service": "overlay". Reiniciar una sesión de grabación cuesta una
+reconexión en lugar de un arranque en frío de Python.
+
+Los eventos de tracking (incluido el texto tecleado) solo son para el usuario
+que lo inicia:
+
+    - Por defecto escucha en un socket Unix del usuario (directorio 0700,
+      socket 0600). Donde no hay sockets Unix (Windows) usa TCP en localhost
+      y el primer comando debe ser {"action": "auth", "token": ...}; el token
+      se lee de ALQVIMIA_DAEMON_TOKEN o se genera y se deja en
+      <directorio del usuario>/daemon.token (0600).
+    - Solo reciben eventos de tracking los clientes que hicieron `start` o
+      `subscribe`; el resto solo las respuestas a sus comandos.
+    - Las rutas que envía un cliente (grabación, imágenes, volcado de
+      métricas, lectura de sesiones) deben quedar dentro del directorio de
+      datos (--data-dir, ALQVIMIA_DAEMON_DATA_DIR; por defecto
+      <directorio del usuario>/data); las relativas se toman desde ahí.
+
+Uso:
+    python daemon_service.py [--unix /ruta.sock | --port 47821] [--data-dir DIR]
+Dirección por variable de entorno: ALQVIMIA_DAEMON_ADDR="unix:/ruta" o "127.0.0.1:47821"
+"""
+import argparse
+import getpass
+import hmac
+import io
+import json
+import os
+import secrets
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# startup primero: su instante de carga es el origen de time-to-ready
+import startup
+import overlay_service
+import tracking_service
+from backends import PlatformBackend, get_backend
+from dispatcher import CommandDispatcher
+from metrics import configure_from_env
+from metrics import shutdown as shutdown_metrics
+from overlay import PRIMARY, ElementOverlay
+from protocol import PROTOCOLS, EventWriter
+from tracking_service import SLOW_COMMANDS, TrackingService
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 47821
+
+TOKEN_FILE = "daemon.token"
+SOCKET_FILE = "daemon.sock"
+
+
+def runtime_dir() -> str:
+    """Directorio privado del usuario para socket, token y datos
+    (ALQVIMIA_RUNTIME_DIR, XDG_RUNTIME_DIR/alqvimia, %LOCALAPPDATA%/Alqvimia
+    o <temporal>/alqvimia-<usuario>)"""
+    base = os.environ.get("ALQVIMIA_RUNTIME_DIR")
+    if not base:
+        if os.name == "nt":
+            base = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(), "Alqvimia")
+        elif os.environ.get("XDG_RUNTIME_DIR"):
+            base = os.path.join(os.environ["XDG_RUNTIME_DIR"], "alqvimia")
+        else:
+            base = os.path.join(tempfile.gettempdir(), f"alqvimia-{getpass.getuser()}")
+    os.makedirs(base, mode=0o700, exist_ok=True)
+    if os.name != "nt":
+        # En un temporal compartido otro usuario podría haberlo creado antes
+        info = os.stat(base)
+        if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+            raise PermissionError(f"{base} debe pertenecer al usuario y tener permisos 0700")
+    return base
+
+
+def default_address():
+    """Socket Unix del usuario; TCP en localhost donde no hay sockets Unix"""
+    if hasattr(socket, "AF_UNIX") and _ThreadingUnixServer is not None:
+        return os.path.join(runtime_dir(), SOCKET_FILE)
+    return (DEFAULT_HOST, DEFAULT_PORT)
+
+
+def confine_path(path, base: str) -> str:
+    """Ruta enviada por un cliente, resuelta dentro de `base` (ValueError si sale)"""
+    if not isinstance(path, str) or not path:
+        raise ValueError(f"Ruta inválida: {path!r}")
+    root = os.path.realpath(base)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([full, root]) != root:
+        raise ValueError(f"Ruta fuera del directorio de datos del daemon: {path}")
+    return full
+
+
+def parse_address(value: str):
+    """"host:puerto" -> (host, puerto); "unix:/ruta" -> "/ruta" """
+    if value.startswith("unix:"):
+        return value[len("unix:"):]
+    host, _, port = value.rpartition(":")
+    return (host or DEFAULT_HOST, int(port))
+
+
+class BroadcastOutput:
+    """Salida del TrackingService compartido: difunde los eventos a todos los
+    clientes conectados, cada uno en su propio protocolo.
+
+    Un cambio de protocolo (`start` con `protocol`) solo aplica al cliente que
+    lo pidió; los demás reciben el mismo `tracking_started` en su modo actual.
+    """
+
+    def __init__(self):
+        self._writers: List[EventWriter] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach(self, writer: EventWriter):
+        with self._lock:
+            if writer not in self._writers:
+                self._writers.append(writer)
+
+    def detach(self, writer: EventWriter) -> int:
+        """Quita un cliente; devuelve cuántos quedan"""
+        with self._lock:
+            if writer in self._writers:
+                self._writers.remove(writer)
+            return len(self._writers)
+
+    @contextmanager
+    def on_behalf_of(self, writer: EventWriter):
+        """Marca al cliente que ejecuta el comando actual (en este hilo)"""
+        self._local.writer = writer
+        try:
+            yield
+        finally:
+            self._local.writer = None
+
+    @property
+    def mode(self) -> str:
+        writer = getattr(self._local, "writer", None)
+        return writer.mode if writer else "json"
+
+    def emit(self, event: Dict, flush: bool = False):
+        with self._lock:
+            writers = list(self._writers)
+        for writer in writers:
+            # Solo encola: un cliente lento o desconectado no frena a los demás
+            writer.emit(event, flush)
+
+    def set_mode(self, mode: str, announce: Optional[Dict] = None):
+        requester = getattr(self._local, "writer", None)
+        with self._lock:
+            writers = list(self._writers)
+        for writer in writers:
+            target = mode if writer is requester else writer.mode
+            try:
+                writer.set_mode(target, {**announce, "protocol": target} if announce else None)
+            except (OSError, ValueError):
+                pass
+
+    def flush(self):
+        with self._lock:
+            writers = list(self._writers)
+        for writer in writers:
+            writer.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            writers = list(self._writers)
+        stats = [w.stats() for w in writers]
+        return {
+            "clients": len(writers),
+            "events": sum(s["events"] for s in stats),
+            "bytes": sum(s["bytes"] for s in stats),
+            "writes": sum(s["writes"] for s in stats),
+            "queued": sum(s["queued"] for s in stats),
+            "coalesced": sum(s["coalesced"] for s in stats),
+            "dropped": sum(s["dropped"] for s in stats)
+        }
+
+
+class OverlayLease:
+    """Vista del ElementOverlay compartido para un dueño (el tracking o un cliente).
+
+    start()/stop() toman y sueltan la referencia del dueño: el hilo de overlay
+    solo se detiene cuando la suelta el último. Si el tracking suelta la suya
+    y otros la mantienen, solo se quita su resaltado (el del hover). El resto
+    de atributos se delega al overlay.
+    """
+
+    def __init__(self, overlay: ElementOverlay, holders: set, lock: threading.Lock, owner):
+        self._overlay = overlay
+        self._holders = holders
+        self._holders_lock = lock
+        self._owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self._overlay, name)
+
+    def start(self):
+        with self._holders_lock:
+            self._holders.add(self._owner)
+            self._overlay.start()
+
+    def stop(self):
+        with self._holders_lock:
+            if self._owner not in self._holders:
+                return
+            self._holders.discard(self._owner)
+            if not self._holders:
+                self._overlay.stop()
+                return
+        if self._owner == "tracking":
+            self._overlay.remove_highlight(PRIMARY)
+
+
+class TrackingDaemon:
+    """Aloja un overlay y un TrackingService compartidos por todos los clientes"""
+
+    def __init__(self, backend: PlatformBackend, data_dir: str = None, token: str = None):
+        self.backend = backend
+        self.data_dir = data_dir or os.path.join(runtime_dir(), "data")
+        os.makedirs(self.data_dir, mode=0o700, exist_ok=True)
+        # Sin token (socket Unix) los permisos del socket bastan
+        self.token = token
+        self.overlay = ElementOverlay(backend)
+        self._overlay_holders: set = set()
+        self._overlay_lock = threading.Lock()
+        self.broadcast = BroadcastOutput()
+        self.service = TrackingService(backend, self.broadcast, self.overlay_lease("tracking"))
+        self.server: Optional[socketserver.BaseServer] = None
+        self._clients = 0
+        self._clients_lock = threading.Lock()
+
+    def overlay_lease(self, owner) -> OverlayLease:
+        return OverlayLease(self.overlay, self._overlay_holders, self._overlay_lock, owner)
+
+    def build_handlers(self, client: "ClientHandler") -> Dict:
+        """Comandos de un cliente: tracking + overlay.* + control de conexión"""
+        handlers = tracking_service.build_commands(
+            self.service,
+            lambda: {"commands": client.dispatcher.stats(), "daemon": True}
+        )
+
+        tracking_start = handlers["start"]
+        tracking_subscribe = handlers["subscribe"]
+        tracking_get_clicks = handlers["get_clicks"]
+
+        def cmd_start(cmd: dict):
+            # Quien inicia el tracking recibe sus eventos
+            self.broadcast.attach(client.writer)
+            with self.broadcast.on_behalf_of(client.writer):
+                return tracking_start(self._confine_start(cmd))
+
+        def cmd_get_clicks(cmd: dict):
+            # Cada cliente confirma solo sus clics: no borra los que otro no leyó
+            return tracking_get_clicks(dict(cmd, reader=client.reader))
+
+        def cmd_subscribe(cmd: dict):
+            self.broadcast.attach(client.writer)
+            return tracking_subscribe(cmd)
+
+        def cmd_exit(cmd: dict):
+            # En el daemon "exit" solo cierra la conexión de este cliente
+            client.closing = True
+            return {"event": "bye"}
+
+        def cmd_shutdown(cmd: dict):
+            client.closing = True
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"event": "shutting_down"}
+
+        handlers.update({"start": cmd_start, "subscribe": cmd_subscribe, "get_clicks": cmd_get_clicks,
+                         "exit": cmd_exit, "shutdown": cmd_shutdown, "auth": lambda cmd: None})
+        for action, handler in overlay_service.build_commands(client.overlay).items():
+            if action != "exit":
+                handlers["overlay." + action] = handler
+
+        # Rutas de los clientes confinadas al directorio de datos
+        confiners = {
+            "capture": self._confine_capture,
+            "read_session": lambda cmd: self._confine_keys(cmd, "path"),
+            "metrics": lambda cmd: self._confine_keys(cmd, "prometheusFile"),
+            "overlay.metrics": lambda cmd: self._confine_keys(cmd, "prometheusFile"),
+        }
+        for action, confine in confiners.items():
+            handlers[action] = _confined(handlers[action], confine)
+        return handlers
+
+    def _confine_keys(self, cmd: Dict, *keys) -> Dict:
+        cmd = dict(cmd)
+        for key in keys:
+            if cmd.get(key) is not None:
+                cmd[key] = confine_path(cmd[key], self.data_dir)
+        return cmd
+
+    def _confine_start(self, cmd: Dict) -> Dict:
+        cmd = dict(cmd)
+        record = cmd.get("record")
+        if isinstance(record, str):
+            cmd["record"] = confine_path(record, self.data_dir)
+        elif isinstance(record, dict):
+            cmd["record"] = self._confine_keys(record, "path")
+        if isinstance(cmd.get("images"), dict):
+            cmd["images"] = self._confine_keys(cmd["images"], "directory")
+        return cmd
+
+    def _confine_capture(self, cmd: Dict) -> Dict:
+        if isinstance(cmd.get("image"), dict):
+            cmd = dict(cmd, image=self._confine_keys(cmd["image"], "directory"))
+        return cmd
+
+    def authenticate(self, line: Optional[str]) -> bool:
+        """¿La primera línea del cliente es un `auth` con el token?"""
+        if self.token is None:
+            return True
+        try:
+            cmd = json.loads(line or "")
+        except ValueError:
+            return False
+        token = cmd.get("token") if isinstance(cmd, dict) and cmd.get("action") == "auth" else None
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def client_connected(self, writer: EventWriter):
+        with self._clients_lock:
+            self._clients += 1
+
+    def client_disconnected(self, writer: EventWriter, reader: str = None):
+        if reader is not None:
+            self.service.pending_clicks.release(reader)
+        with self._clients_lock:
+            self._clients -= 1
+            remaining = self._clients
+        # Sin suscriptores nadie recibe los eventos: no dejar hooks de mouse activos
+        if self.broadcast.detach(writer) == 0 and self.service.is_tracking:
+            self.service.stop()
+        if remaining == 0:
+            # Sin clientes: no dejar resaltados huérfanos
+            self.overlay.clear()
+
+    def serve(self, address):
+        token_path = None
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            # El socket nace con 0600: sin ventana entre bind y chmod
+            previous = os.umask(0o177)
+            try:
+                self.server = _ThreadingUnixServer(address, ClientHandler)
+            finally:
+                os.umask(previous)
+        else:
+            if self.token is None:
+                self.token = os.environ.get("ALQVIMIA_DAEMON_TOKEN") or secrets.token_urlsafe(32)
+                token_path = os.path.join(runtime_dir(), TOKEN_FILE)
+                fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(self.token)
+            self.server = _ThreadingTCPServer(address, ClientHandler)
+        self.server.tracking_daemon = self
+        startup.mark("ready")
+        # Cargar los módulos pesados en segundo plano (ALQVIMIA_PREWARM=0 lo desactiva)
+        if os.environ.get("ALQVIMIA_PREWARM", "1") != "0":
+            startup.prewarm_in_background(self.backend.prewarm)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if isinstance(address, str) and os.path.exists(address):
+                os.unlink(address)
+            if token_path and os.path.exists(token_path):
+                os.unlink(token_path)
+
+    def shutdown(self):
+        if self.service.is_tracking:
+            self.service.stop()
+        self.overlay.stop()
+        if self.server:
+            self.server.shutdown()
+
+
+class ClientHandler(socketserver.StreamRequestHandler):
+    """Una conexión de cliente: lector de comandos + escritor propio"""
+
+    def setup(self):
+        super().setup()
+        self.closing = False
+        self.reader = f"client-{id(self):x}"
+        self.writer = EventWriter(io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True))
+        daemon: TrackingDaemon = self.server.tracking_daemon
+        # overlay.start/overlay.stop de este cliente
+        self.overlay = daemon.overlay_lease(self)
+        self.dispatcher = CommandDispatcher(
+            daemon.build_handlers(self),
+            lambda event: self.writer.emit(event, flush=True),
+            slow_actions=SLOW_COMMANDS,
+            worker_init=daemon.backend.uia.init_thread,
+            worker_exit=daemon.backend.uia.uninit_thread
+        )
+
+    def handle(self):
+        daemon: TrackingDaemon = self.server.tracking_daemon
+        self._lines = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        if daemon.token is not None and not daemon.authenticate(self._lines.readline()):
+            self.writer.emit({"event": "auth_failed", "error": "Token inválido o ausente"})
+            self.dispatcher.close(timeout=0.0)
+            self.writer.close(timeout=1.0)
+            return
+        self.writer.emit({
+            "event": "ready",
+            **daemon.backend.capabilities(),
+            "protocols": list(PROTOCOLS),
+            "daemon": True
+        })
+        daemon.client_connected(self.writer)
+        try:
+            self.dispatcher.serve(self._commands())
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.dispatcher.close(timeout=1.0)
+            self.overlay.stop()
+            daemon.client_disconnected(self.writer, self.reader)
+            # Entregar lo pendiente antes de que socketserver cierre wfile
+            self.writer.close(timeout=1.0)
+
+    def _commands(self):
+        for line in self._lines:
+            yield _route(line)
+            if self.closing:
+                return
+
+
+def _confined(handler, confine):
+    def run(cmd: dict):
+        return handler(confine(cmd))
+    return run
+
+
+def _route(line: str) -> str:
+    """Traduce {"service": "overlay", "action": "x"} a la acción "overlay.x" """
+    if '"service"' not in line:
+        return line
+    try:
+        cmd = json.loads(line)
+    except ValueError:
+        return line
+    if cmd.get("service") == "overlay":
+        cmd["action"] = "overlay." + str(cmd.get("action"))
+        return json.dumps(cmd)
+    return line
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _ThreadingUnixServer = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daemon de tracking y overlay de Alqvimia")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--unix", default=None, help="Ruta del socket Unix")
+    parser.add_argument("--data-dir", default=os.environ.get("ALQVIMIA_DAEMON_DATA_DIR"),
+                        help="Directorio de las rutas que envían los clientes")
+    args = parser.parse_args()
+
+    if args.unix:
+        address = args.unix
+    elif args.port is not None:
+        address = (args.host, args.port)
+    elif os.environ.get("ALQVIMIA_DAEMON_ADDR"):
+        address = parse_address(os.environ["ALQVIMIA_DAEMON_ADDR"])
+    else:
+        address = default_address()
+
+    daemon = TrackingDaemon(get_backend(), args.data_dir)
+    # Grabaciones e imágenes por defecto también dentro del directorio de datos
+    os.environ.setdefault("ALQVIMIA_SESSIONS_DIR", os.path.join(daemon.data_dir, "sessions"))
+    os.environ.setdefault("ALQVIMIA_CAPTURES_DIR", os.path.join(daemon.data_dir, "captures"))
+    # Volcado periódico de métricas (ALQVIMIA_METRICS_FILE)
+    configure_from_env()
+    try:
+        daemon.serve(address)
+    except KeyboardInterrupt:
+        daemon.shutdown()
+    finally:
+        shutdown_metrics()
+
+
+if __name__ == "__main__":
+    main()
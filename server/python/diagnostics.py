@@ -0,0 +1,181 @@
+"""
+Diagnostics - Crecimiento del heap, hilos vivos y recursos adquiridos vs
+liberados, para detectar fugas en sesiones largas
+
+El comando `diagnostics` toma una muestra: snapshot de tracemalloc comparado
+con la línea base y con la muestra anterior (las líneas que más crecieron),
+hilos vivos agrupados por nombre, y los contadores de recursos que aporta el
+servicio (DCs y objetos GDI del overlay, workers de inspección, cola de
+salida...). Las muestras se guardan en un historial acotado y `trends`
+indica qué series crecen de forma sostenida (monotonic_growth).
+
+tracemalloc se activa en la primera muestra (o desde el arranque con
+PYTHONTRACEMALLOC=N); cuesta CPU y memoria, `stopTrace` lo desactiva.
+"""
+import gc
+import re
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Series del historial con su tolerancia absoluta de crecimiento
+DEFAULT_TOLERANCE = {"heapBytes": 512 * 1024, "gcObjects": 2000}
+
+# Tramos en que monotonic_growth divide cada serie
+TREND_SEGMENTS = 4
+
+
+def monotonic_growth(values: Sequence[float], tolerance: float = 0.0, segments: int = TREND_SEGMENTS) -> bool:
+    """¿La serie crece de forma sostenida?
+
+    Divide la serie en `segments` tramos y compara sus mínimos: una fuga sube
+    el piso de cada tramo respecto del anterior, mientras que los picos
+    transitorios (un lote de eventos, un GC pendiente) no lo hacen. Hace falta
+    al menos dos muestras por tramo.
+    """
+    if segments < 2 or len(values) < segments * 2:
+        return False
+    size = len(values) / segments
+    floors = [min(values[int(i * size):int((i + 1) * size)]) for i in range(segments)]
+    return (all(later > earlier for earlier, later in zip(floors, floors[1:]))
+            and floors[-1] - floors[0] > tolerance)
+
+
+def _thread_groups() -> Dict[str, int]:
+    """Hilos vivos por nombre (Thread-12 y Thread-13 cuentan como Thread-N)"""
+    return dict(Counter(re.sub(r"\d+", "N", t.name) for t in threading.enumerate()))
+
+
+def _flatten(prefix: str, value, out: Dict[str, float]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+class Diagnostics:
+    """Muestras de heap, hilos y recursos con historial acotado.
+
+    `resources()` devuelve {fuente: {contador: valor}}; los contadores `live*`
+    (adquiridos menos liberados) y los tamaños de cola entran al historial.
+    """
+
+    def __init__(self, resources: Callable[[], Dict] = None, frames: int = 1, history: int = 240,
+                 tolerance: Dict[str, float] = None):
+        self.resources = resources
+        self.frames = frames
+        self.history: deque = deque(maxlen=history)
+        self.tolerance = dict(DEFAULT_TOLERANCE, **(tolerance or {}))
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._started_at = time.time()
+        self._lock = threading.Lock()
+
+    def start_trace(self, frames: int = None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames or self.frames)
+            self._baseline = self._previous = None
+
+    def stop_trace(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._baseline = self._previous = None
+
+    def reset(self):
+        """Nueva línea base y historial vacío"""
+        with self._lock:
+            self.history.clear()
+            self._baseline = self._previous = None
+            self._started_at = time.time()
+
+    def sample(self, top: int = 10, trace: bool = True) -> Dict:
+        """Toma una muestra y la agrega al historial"""
+        gc.collect()
+        with self._lock:
+            if trace:
+                self.start_trace()
+            heap = self._heap(top) if tracemalloc.is_tracing() else {"tracing": False}
+            threads = _thread_groups()
+            resources = {}
+            if self.resources is not None:
+                try:
+                    resources = self.resources()
+                except Exception as e:
+                    resources = {"error": str(e)}
+
+            point = {"t": round(time.time() - self._started_at, 3), "threads": sum(threads.values()),
+                     "gcObjects": len(gc.get_objects())}
+            if heap.get("tracing"):
+                point["heapBytes"] = heap["currentBytes"]
+            flat: Dict[str, float] = {}
+            _flatten("", resources, flat)
+            point.update({key: value for key, value in flat.items()
+                          if key.rsplit(".", 1)[-1].startswith(("live", "queued"))})
+            self.history.append(point)
+
+            return {
+                "heap": heap,
+                "threads": {"count": point["threads"], "byName": threads},
+                "resources": resources,
+                "samples": len(self.history),
+                "trends": self.trends()
+            }
+
+    def _heap(self, top: int) -> Dict:
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        baseline = self._baseline or snapshot
+        previous = self._previous or snapshot
+        self._baseline, self._previous = baseline, snapshot
+
+        def diff(old: tracemalloc.Snapshot) -> List[Dict]:
+            stats = snapshot.compare_to(old, "lineno")
+            return [{
+                "where": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                "sizeDiff": s.size_diff,
+                "countDiff": s.count_diff,
+                "size": s.size
+            } for s in stats[:top] if s.size_diff]
+
+        return {
+            "tracing": True,
+            "currentBytes": current,
+            "peakBytes": peak,
+            "growthBytes": sum(s.size_diff for s in snapshot.compare_to(baseline, "filename")),
+            "topSinceBaseline": diff(baseline),
+            "topSinceLast": diff(previous)
+        }
+
+    def series(self, name: str) -> List[float]:
+        return [point[name] for point in self.history if name in point]
+
+    def trends(self) -> Dict[str, bool]:
+        """Series del historial que crecen de forma sostenida"""
+        names = {key for point in self.history for key in point if key != "t"}
+        return {name: monotonic_growth(self.series(name), self.tolerance.get(name, 0.0))
+                for name in sorted(names)}
+
+
+def build_diagnostics_commands(resources: Callable[[], Dict] = None) -> Dict:
+    """Comando `diagnostics` (compartido por tracking y overlay)"""
+    diagnostics = Diagnostics(resources)
+
+    def cmd_diagnostics(cmd: dict):
+        if cmd.get("reset"):
+            diagnostics.reset()
+        if cmd.get("stopTrace"):
+            diagnostics.stop_trace()
+        report = diagnostics.sample(top=cmd.get("top", 10), trace=cmd.get("trace", True)
+                                    and not cmd.get("stopTrace"))
+        response = {"event": "diagnostics", **report}
+        if cmd.get("history"):
+            response["history"] = list(diagnostics.history)
+        return response
+
+    return {"diagnostics": cmd_diagnostics}
@@ -0,0 +1,268 @@
+"""
+Command Dispatcher - Despacha los comandos de stdin sin bloqueo de cabeza de línea
+
+Cada comando puede traer un `id` opcional que se devuelve en su respuesta.
+Los comandos rápidos (highlight, status, ...) se ejecutan en el hilo lector;
+los lentos (capture, get_element) van a un pool de hilos con un timeout por
+comando (`timeout` en segundos, o el valor por defecto del dispatcher). Un
+único hilo vigila los plazos (heap por vencimiento), no uno por comando.
+close() detiene el pool al terminar la entrada.
+"""
+import heapq
+import itertools
+import json
+import math
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+Handler = Callable[[Dict], Optional[Dict]]
+
+
+def _timeout(value) -> float:
+    """`timeout` del comando en segundos (0 o null: sin límite)"""
+    if value is None or value is False:
+        return 0.0
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"timeout inválido: {value!r}")
+    if not math.isfinite(timeout) or timeout < 0:
+        raise ValueError(f"timeout inválido: {value!r}")
+    return timeout
+
+
+class _Request:
+    __slots__ = ("cmd", "done", "lock")
+
+    def __init__(self, cmd: Dict):
+        self.cmd = cmd
+        self.done = False
+        self.lock = threading.Lock()
+
+
+class CommandDispatcher:
+    """Enruta comandos a handlers y emite sus respuestas correlacionadas por id.
+
+    Un handler devuelve el evento de respuesta o None; si el comando traía id
+    y no hay respuesta se envía un `ack`. Los hilos del pool son daemon y
+    ejecutan `worker_init`/`worker_exit` una vez (p.ej. CoInitialize), de modo
+    que un comando colgado no impide que el proceso termine.
+    """
+
+    def __init__(self, handlers: Dict[str, Handler], emit: Callable[[Dict], None],
+                 slow_actions: Iterable[str] = (), workers: int = 2, default_timeout: float = 5.0,
+                 worker_init: Callable[[], None] = None, worker_exit: Callable[[], None] = None):
+        self.handlers = handlers
+        self.emit = emit
+        self.slow_actions = frozenset(slow_actions)
+        self.default_timeout = default_timeout
+        self.worker_init = worker_init
+        self.worker_exit = worker_exit
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._workers = [
+            threading.Thread(target=self._worker_loop, daemon=True, name=f"cmd-worker-{i}")
+            for i in range(workers)
+        ]
+        self._deadline_thread = threading.Thread(target=self._deadline_loop, daemon=True,
+                                                 name="cmd-deadlines")
+        self._deadlines: List[Tuple[float, int, _Request]] = []
+        self._deadline_seq = itertools.count()
+        self._deadline_cond = threading.Condition()
+        self._started = False
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._idle = threading.Condition(self._stats_lock)
+
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.late_results = 0
+        self.errors = 0
+
+    def serve(self, lines: Iterable[str]):
+        """Lee comandos línea a línea (p.ej. sys.stdin) hasta agotar la entrada"""
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                cmd = json.loads(line)
+            except json.JSONDecodeError:
+                self.emit({"error": "Invalid JSON", "input": line[:100]})
+                continue
+            try:
+                self.dispatch(cmd)
+            except SystemExit:
+                # "exit": responder antes los comandos lentos ya encolados
+                self.drain()
+                raise
+
+    def dispatch(self, cmd: Dict):
+        """Ejecuta un comando en línea o lo encola si es lento"""
+        action = cmd.get("action")
+        if action not in self.handlers:
+            if "id" in cmd:
+                self.emit({"event": "command_error", "id": cmd["id"], "action": action,
+                           "error": f"Acción desconocida: {action}"})
+            return
+
+        if action not in self.slow_actions:
+            self._run(_Request(cmd))
+            return
+
+        try:
+            timeout = _timeout(cmd.get("timeout", self.default_timeout))
+        except ValueError as e:
+            self._reject(cmd, str(e))
+            return
+        if self._closed:
+            self._reject(cmd, "Dispatcher cerrado")
+            return
+
+        if not self._started:
+            self._started = True
+            for worker in self._workers:
+                worker.start()
+            self._deadline_thread.start()
+
+        request = _Request(cmd)
+        if timeout:
+            with self._deadline_cond:
+                entry = (time.monotonic() + timeout, next(self._deadline_seq), request)
+                heapq.heappush(self._deadlines, entry)
+                if self._deadlines[0] is entry:
+                    self._deadline_cond.notify()
+        with self._stats_lock:
+            self.in_flight += 1
+        self._queue.put(request)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que terminen los comandos en curso (p.ej. al cerrarse stdin)"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.in_flight == 0,
+                                       self.default_timeout if timeout is None else timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Detiene el pool: los comandos ya encolados se responden antes.
+
+        Los hilos colgados en un handler se abandonan pasado `timeout` (son
+        daemon). Los comandos lentos posteriores se rechazan.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if not self._started:
+            return
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.monotonic() + (self.default_timeout if timeout is None else timeout)
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        with self._deadline_cond:
+            self._deadline_cond.notify()
+        self._deadline_thread.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "inFlight": self.in_flight,
+                "queued": self._queue.qsize(),
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "lateResults": self.late_results,
+                "errors": self.errors
+            }
+
+    def _reject(self, cmd: Dict, error: str):
+        with self._stats_lock:
+            self.errors += 1
+        response = {"event": "command_error", "action": cmd.get("action"), "error": error}
+        if "id" in cmd:
+            response["id"] = cmd["id"]
+        self.emit(response)
+
+    def _worker_loop(self):
+        if self.worker_init:
+            self.worker_init()
+        try:
+            while True:
+                request = self._queue.get()
+                if request is None:
+                    break
+                with request.lock:
+                    # Ya expiró mientras esperaba en la cola
+                    skip = request.done
+                if not skip:
+                    self._run(request)
+                with self._idle:
+                    self.in_flight -= 1
+                    self._idle.notify_all()
+        finally:
+            if self.worker_exit:
+                self.worker_exit()
+
+    def _deadline_loop(self):
+        """Emite command_timeout de los comandos que vencen sin respuesta"""
+        while True:
+            with self._deadline_cond:
+                while True:
+                    # Los ya respondidos no necesitan esperar a su vencimiento
+                    while self._deadlines and self._deadlines[0][2].done:
+                        heapq.heappop(self._deadlines)
+                    if self._closed and not any(w.is_alive() for w in self._workers):
+                        return
+                    wait = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+                    if wait is not None and wait <= 0:
+                        request = heapq.heappop(self._deadlines)[2]
+                        break
+                    if self._closed:
+                        # Cerrado con workers colgados: revisar a menudo si terminaron
+                        wait = 0.1 if wait is None else min(wait, 0.1)
+                    self._deadline_cond.wait(wait)
+            self._on_timeout(request)
+
+    def _run(self, request: _Request):
+        cmd = request.cmd
+        action = cmd.get("action")
+        try:
+            response = self.handlers[action](cmd)
+        except SystemExit:
+            raise
+        except Exception as e:
+            with self._stats_lock:
+                self.errors += 1
+            response = {"event": "command_error", "action": action, "error": str(e)}
+
+        with request.lock:
+            if request.done:
+                with self._stats_lock:
+                    self.late_results += 1
+                return
+            request.done = True
+
+        with self._stats_lock:
+            self.completed += 1
+
+        if response is None:
+            if "id" not in cmd:
+                return
+            response = {"event": "ack", "action": action}
+        if "id" in cmd:
+            response = {**response, "id": cmd["id"]}
+        self.emit(response)
+
+    def _on_timeout(self, request: _Request):
+        with request.lock:
+            if request.done:
+                return
+            request.done = True
+        with self._stats_lock:
+            self.timeouts += 1
+        cmd = request.cmd
+        response = {"event": "command_timeout", "action": cmd.get("action"),
+                    "error": "Tiempo de espera agotado"}
+        if "id" in cmd:
+            response["id"] = cmd["id"]
+        self.emit(response)
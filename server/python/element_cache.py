@@ -0,0 +1,169 @@
+"""
+Element Cache - Caché espacial de elementos UI ya resueltos
+Responde hit-tests de puntos que caen dentro de un rectángulo reciente sin
+volver a llamar a UI Automation (cada resolución son ~12 llamadas COM).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+class _Entry:
+    __slots__ = ("key", "element", "left", "top", "right", "bottom", "area", "stored_at", "cells")
+
+    def __init__(self, key: int, element: Dict, stored_at: float, cell_size: int):
+        bounds = element["bounds"]
+        self.key = key
+        self.element = element
+        self.left = bounds["x"]
+        self.top = bounds["y"]
+        self.right = bounds["x"] + bounds["width"]
+        self.bottom = bounds["y"] + bounds["height"]
+        self.area = max(1, bounds["width"] * bounds["height"])
+        self.stored_at = stored_at
+        self.cells = [
+            (cx, cy)
+            for cx in range(self.left // cell_size, (self.right - 1) // cell_size + 1)
+            for cy in range(self.top // cell_size, (self.bottom - 1) // cell_size + 1)
+        ]
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.left <= x < self.right and self.top <= y < self.bottom
+
+
+class HitTestCache:
+    """Caché LRU/TTL de elementos indexada por cuadrícula sobre `bounds`.
+
+    Solo deben guardarse elementos hoja: para un contenedor, un punto dentro
+    de su rectángulo puede pertenecer a un hijo que no está en caché.
+    El contexto (ventana en primer plano y geometría de la ventana objetivo)
+    se compara en cada consulta; si cambia, la caché se invalida completa.
+    """
+
+    def __init__(self, max_entries: int = 128, ttl: float = 1.0, cell_size: int = 128):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cell_size = cell_size
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._grid: Dict[Tuple[int, int], Set[int]] = {}
+        self._context: Optional[Hashable] = None
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def lookup(self, x: int, y: int, context: Hashable = None,
+               fields: Iterable[str] = None) -> Optional[Dict]:
+        """Devuelve una copia del elemento cacheado más pequeño que contiene (x, y).
+        Con `fields`, solo sirven entradas resueltas con al menos esos campos."""
+        if fields is not None and not isinstance(fields, frozenset):
+            fields = frozenset(fields)
+        now = time.monotonic()
+        with self._lock:
+            if context != self._context:
+                self._invalidate_locked()
+                self._context = context
+
+            best = None
+            keys = self._grid.get((x // self.cell_size, y // self.cell_size), ())
+            for key in list(keys):
+                entry = self._entries[key]
+                if now - entry.stored_at > self.ttl:
+                    self._remove_locked(entry)
+                    self.expirations += 1
+                    continue
+                if fields is not None and not entry.element.keys() >= fields:
+                    continue
+                if entry.contains(x, y) and (best is None or entry.area <= best.area):
+                    best = entry
+
+            if best is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best.key)
+            self.hits += 1
+            return dict(best.element)
+
+    def covers(self, x: int, y: int, context: Hashable = None, fields: frozenset = None) -> bool:
+        """¿Hay una entrada vigente para (x, y)? Sin contar acierto ni fallo
+        ni invalidar: lo usa el prefetch para no resolver lo ya cacheado."""
+        now = time.monotonic()
+        with self._lock:
+            if context != self._context:
+                return False
+            for key in self._grid.get((x // self.cell_size, y // self.cell_size), ()):
+                entry = self._entries[key]
+                if (now - entry.stored_at <= self.ttl and entry.contains(x, y)
+                        and (fields is None or entry.element.keys() >= fields)):
+                    return True
+        return False
+
+    def store(self, element: Dict, context: Hashable = None):
+        """Guarda un elemento hoja resuelto en `context`"""
+        bounds = element.get("bounds")
+        if not bounds or bounds["width"] <= 0 or bounds["height"] <= 0:
+            return
+
+        with self._lock:
+            if context != self._context:
+                self._invalidate_locked()
+                self._context = context
+
+            entry = _Entry(self._next_key, element, time.monotonic(), self.cell_size)
+            self._next_key += 1
+            # Una resolución nueva del mismo rectángulo reemplaza a la anterior
+            for key in list(self._grid.get(entry.cells[0], ())):
+                old = self._entries[key]
+                if (old.left, old.top, old.right, old.bottom) == (entry.left, entry.top, entry.right, entry.bottom):
+                    self._remove_locked(old)
+            self._entries[entry.key] = entry
+            for cell in entry.cells:
+                self._grid.setdefault(cell, set()).add(entry.key)
+
+            while len(self._entries) > self.max_entries:
+                _, oldest = self._entries.popitem(last=False)
+                self._unindex_locked(oldest)
+                self.evictions += 1
+
+    def invalidate(self):
+        """Vacía la caché (p.ej. al cambiar de ventana objetivo)"""
+        with self._lock:
+            self._invalidate_locked()
+            self._context = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+    def _invalidate_locked(self):
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self._grid.clear()
+
+    def _remove_locked(self, entry: _Entry):
+        self._entries.pop(entry.key, None)
+        self._unindex_locked(entry)
+
+    def _unindex_locked(self, entry: _Entry):
+        for cell in entry.cells:
+            bucket = self._grid.get(cell)
+            if bucket is not None:
+                bucket.discard(entry.key)
+                if not bucket:
+                    del self._grid[cell]
@@ -0,0 +1,360 @@
+"""
+Element Images - Recortes de pantalla de los elementos capturados
+
+La captura de la región del elemento (`bounds`) se hace en el hilo que la
+pide, en el momento del clic o de la captura, con el capturador persistente
+del backend (ScreenBackend). La codificación (PNG/JPEG) corre en un pool de
+hilos propio y la imagen sale por referencia: una ruta de archivo temporal o
+el nombre de un bloque de memoria compartida, nunca base64 dentro del evento.
+
+El evento (click, element_captured) lleva la referencia en cuanto se captura
+(`pending: true`); al terminar la codificación se emite `element_image` con
+el mismo `ref`. Los archivos se escriben de forma atómica (temporal +
+os.replace): la ruta nunca apunta a una imagen a medias.
+
+Deduplicación: un hash perceptual (dHash de 64 bits más el brillo medio) de
+cada recorte se compara con el del recorte anterior; si coinciden (misma
+medida y distancia de Hamming <= `threshold`) se reutiliza la imagen previa
+sin codificar ni escribir nada (`duplicateOf`).
+"""
+import io
+import itertools
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from backends.base import ScreenBackend
+from metrics import REGISTRY, StageMetrics
+
+OUTPUTS = ("file", "shm")
+FORMATS = ("png", "jpeg")
+
+# Lado de la rejilla del dHash: 9x8 muestras -> 64 bits
+_HASH_W, _HASH_H = 9, 8
+# Diferencia de brillo medio (0-255) que separa dos recortes lisos
+_MEAN_TOLERANCE = 8
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Referencias únicas en el proceso: un imager nuevo no pisa archivos de otro
+_refs = itertools.count(1)
+
+
+@lru_cache(maxsize=None)
+def _pil_image():
+    """Pillow.Image si está instalado (se importa en el primer uso)"""
+    try:
+        from PIL import Image
+        return Image
+    except ImportError:
+        return None
+
+
+def default_directory() -> str:
+    """ALQVIMIA_CAPTURES_DIR o el temporal del sistema"""
+    directory = os.environ.get("ALQVIMIA_CAPTURES_DIR") or os.path.join(tempfile.gettempdir(), "alqvimia-captures")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def image_hash(bgra: bytes, width: int, height: int) -> Tuple[int, int]:
+    """(dHash de 64 bits, brillo medio) de una imagen BGRA.
+
+    Muestrea una rejilla de 9x8 puntos (sin reescalar la imagen completa) y
+    compara cada muestra con su vecina de la derecha. El brillo medio
+    distingue recortes lisos de distinto color, que tienen el mismo dHash.
+    """
+    samples = []
+    for gy in range(_HASH_H):
+        y = min(height - 1, (2 * gy + 1) * height // (2 * _HASH_H))
+        row = y * width
+        for gx in range(_HASH_W):
+            i = (row + min(width - 1, (2 * gx + 1) * width // (2 * _HASH_W))) * 4
+            samples.append((bgra[i + 2] * 299 + bgra[i + 1] * 587 + bgra[i] * 114) // 1000)
+    bits = 0
+    for gy in range(_HASH_H):
+        base = gy * _HASH_W
+        for gx in range(_HASH_W - 1):
+            bits = (bits << 1) | (samples[base + gx] > samples[base + gx + 1])
+    return bits, sum(samples) // len(samples)
+
+
+def encode_png(bgra: bytes, width: int, height: int, level: int = 1) -> bytes:
+    """PNG RGB con zlib de la biblioteca estándar (sin Pillow)"""
+    rgb = bytearray(width * height * 3)
+    rgb[0::3] = bgra[2::4]
+    rgb[1::3] = bgra[1::4]
+    rgb[2::3] = bgra[0::4]
+    stride = width * 3
+    raw = b"".join(b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (_PNG_SIGNATURE
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, level))
+            + chunk(b"IEND", b""))
+
+
+def encode(bgra: bytes, width: int, height: int, fmt: str = "png", quality: int = 80) -> bytes:
+    """Codifica con Pillow si está instalado; PNG también sin él"""
+    image = _pil_image()
+    if image is None:
+        if fmt != "png":
+            raise RuntimeError(f"Formato {fmt} requiere Pillow (pip install Pillow)")
+        return encode_png(bgra, width, height)
+    buffer = io.BytesIO()
+    picture = image.frombuffer("RGB", (width, height), bgra, "raw", "BGRX", 0, 1)
+    if fmt == "jpeg":
+        picture.save(buffer, "JPEG", quality=quality)
+    else:
+        picture.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class _Job:
+    __slots__ = ("ref", "bgra", "width", "height", "target", "queued_at")
+
+    def __init__(self, ref: int, bgra: bytes, width: int, height: int, target: str):
+        self.ref = ref
+        self.bgra = bgra
+        self.width = width
+        self.height = height
+        self.target = target
+        self.queued_at = time.perf_counter()
+
+
+class ElementImager:
+    """Recorta, deduplica y codifica imágenes de elementos.
+
+    `output`: "file" (ruta en `directory`) o "shm" (multiprocessing.shared_memory,
+    el bloque vive hasta que sale de los `keep` más recientes o se cierra el
+    servicio). `on_ready(event)` recibe el evento `element_image` de cada
+    codificación terminada (desde un hilo del pool).
+    """
+
+    def __init__(self, screen: ScreenBackend, output: str = "file", directory: str = None,
+                 fmt: str = "png", quality: int = 80, workers: int = 2, max_pending: int = 64,
+                 dedupe: bool = True, threshold: int = 0, keep: int = 500, padding: int = 0,
+                 max_pixels: int = 4_000_000, on_ready: Callable[[Dict], None] = None,
+                 metrics: StageMetrics = None):
+        if output not in OUTPUTS:
+            raise ValueError(f"Salida de imagen no soportada: {output}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato de imagen no soportado: {fmt}")
+        self.screen = screen
+        self.output = output
+        self.directory = directory
+        self.format = fmt
+        self.quality = quality
+        self.dedupe = dedupe
+        self.threshold = max(0, int(threshold))
+        self.keep = max(1, int(keep))
+        self.padding = max(0, int(padding))
+        self.max_pixels = max_pixels
+        self.on_ready = on_ready
+        self.metrics = metrics or REGISTRY
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._workers = [
+            threading.Thread(target=self._worker_loop, daemon=True, name=f"image-encoder-{i}")
+            for i in range(max(1, int(workers)))
+        ]
+        self._lock = threading.Lock()
+        self._last: Optional[Tuple[int, int, int, int, Dict]] = None  # (ancho, alto, hash, brillo, ref)
+        self._stored: "deque[str]" = deque()   # rutas o nombres de shm, del más viejo al más nuevo
+        self._segments: Dict[str, object] = {}
+        self._closed = False
+
+        self.captured = 0
+        self.duplicates = 0
+        self.encoded = 0
+        self.dropped = 0
+        self.failed = 0
+        self.bytes_written = 0
+
+        if output == "file" and self.directory is None:
+            self.directory = default_directory()
+        for worker in self._workers:
+            worker.start()
+
+    # -- Captura (hilo del que llama) --
+
+    def capture(self, bounds: Dict) -> Optional[Dict]:
+        """Recorta `bounds` ({x, y, width, height}) y devuelve la referencia
+        de la imagen, o None si no se pudo capturar"""
+        if self._closed or not bounds:
+            return None
+        pad = self.padding
+        left, top = int(bounds["x"]) - pad, int(bounds["y"]) - pad
+        width, height = int(bounds["width"]) + 2 * pad, int(bounds["height"]) + 2 * pad
+        if width <= 0 or height <= 0 or width * height > self.max_pixels:
+            return None
+
+        try:
+            with self.metrics.time("image.grab"):
+                bgra, width, height = self.screen.grab(left, top, width, height)
+        except Exception:
+            # Contado por metrics.time en image.grab
+            return None
+
+        started = time.perf_counter()
+        bits, mean = image_hash(bgra, width, height)
+        self.metrics.observe("image.hash", time.perf_counter() - started)
+
+        with self._lock:
+            self.captured += 1
+            last = self._last
+            if (self.dedupe and last is not None and last[0] == width and last[1] == height
+                    and bin(last[2] ^ bits).count("1") <= self.threshold
+                    and abs(last[3] - mean) <= _MEAN_TOLERANCE):
+                self.duplicates += 1
+                previous = last[4]
+                return dict(previous, duplicateOf=previous["ref"], hash=f"{bits:016x}")
+            ref = next(_refs)
+
+        target = self._target(ref)
+        reference = {
+            "ref": ref,
+            "format": self.format,
+            "width": width,
+            "height": height,
+            "x": left,
+            "y": top,
+            "hash": f"{bits:016x}",
+            self._target_key(): target,
+            "pending": True
+        }
+        try:
+            self._queue.put_nowait(_Job(ref, bgra, width, height, target))
+        except queue.Full:
+            # Pool saturado: se pierde la imagen, no el evento ni el hilo del clic
+            with self._lock:
+                self.dropped += 1
+            return None
+        with self._lock:
+            self._last = (width, height, bits, mean, reference)
+        return dict(reference)
+
+    def _target_key(self) -> str:
+        return "path" if self.output == "file" else "shm"
+
+    def _target(self, ref: int) -> str:
+        extension = "jpg" if self.format == "jpeg" else "png"
+        if self.output == "file":
+            return os.path.join(self.directory, f"element-{os.getpid()}-{ref:06d}.{extension}")
+        return f"alq_{os.getpid()}_{ref}"
+
+    # -- Codificación (pool) --
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            self.metrics.observe("image.queue_wait", time.perf_counter() - job.queued_at)
+            try:
+                with self.metrics.time("image.encode"):
+                    data = encode(job.bgra, job.width, job.height, self.format, self.quality)
+                with self.metrics.time("image.write"):
+                    self._store(job.target, data)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                self._notify({"event": "element_image", "ref": job.ref, "error": f"{type(e).__name__}: {e}"})
+                continue
+            with self._lock:
+                self.encoded += 1
+                self.bytes_written += len(data)
+            self._notify({
+                "event": "element_image",
+                "ref": job.ref,
+                self._target_key(): job.target,
+                "format": self.format,
+                "bytes": len(data),
+                "encodeMs": round((time.perf_counter() - job.queued_at) * 1000, 3)
+            })
+
+    def _store(self, target: str, data: bytes):
+        if self.output == "file":
+            tmp = f"{target}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, target)
+        else:
+            from multiprocessing import shared_memory
+            segment = shared_memory.SharedMemory(name=target, create=True, size=len(data))
+            segment.buf[:len(data)] = data
+            with self._lock:
+                self._segments[target] = segment
+        with self._lock:
+            self._stored.append(target)
+            expired = [self._stored.popleft() for _ in range(len(self._stored) - self.keep)]
+        for old in expired:
+            self._discard(old)
+
+    def _discard(self, target: str):
+        try:
+            if self.output == "file":
+                os.remove(target)
+            else:
+                with self._lock:
+                    segment = self._segments.pop(target, None)
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+        except (OSError, BufferError) as e:
+            self.metrics.error("image.write", e)
+
+    def _notify(self, event: Dict):
+        if self.on_ready is not None:
+            try:
+                self.on_ready(event)
+            except Exception as e:
+                self.metrics.error("image.write", e)
+
+    def reset_dedupe(self):
+        """Olvida el último recorte (p.ej. al iniciar otra sesión)"""
+        with self._lock:
+            self._last = None
+
+    def close(self, timeout: float = 5.0):
+        """Termina las codificaciones pendientes y libera la memoria compartida
+        (los archivos se conservan para quien los consuma)"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join(timeout=timeout)
+        if self.output == "shm":
+            with self._lock:
+                targets = list(self._segments)
+                self._stored.clear()
+            for target in targets:
+                self._discard(target)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "output": self.output,
+                "format": self.format,
+                "directory": self.directory,
+                "captured": self.captured,
+                "duplicates": self.duplicates,
+                "encoded": self.encoded,
+                "pending": self._queue.qsize(),
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "stored": len(self._stored),
+                "bytesWritten": self.bytes_written
+            }
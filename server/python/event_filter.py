@@ -0,0 +1,188 @@
+"""
+Event Filter - Filtros de suscripción evaluados antes de serializar
+
+El cliente declara con `subscribe` qué eventos quiere. TrackingService los
+evalúa antes de construir el dict del evento (y por tanto antes de
+json.dumps), en orden de costo:
+
+    events           tipos de evento ("hover" incluye hover_update; "click",
+                     "type", "key", "shortcut"): sin hover no se emite nada
+                     del hit-test (el overlay sigue funcionando)
+    region           {x, y, width, height} o una lista: el punto del evento
+                     debe caer en alguna; se comprueba antes de inspeccionar
+    interactiveOnly  solo elementos interactivos
+    controlTypes     tipos permitidos ("ButtonControl" o "button")
+    classNames       className permitidos
+    maxRate          hovers por segundo como máximo (token bucket; 0 no deja
+                     pasar ninguno); los clics y el teclado no se limitan
+
+Los filtros de elemento solo necesitan campos baratos. Mientras descarten la
+mayoría de los elementos, las propiedades caras (value, parentName) se piden
+después y solo para los admitidos; si casi todos pasan, esa segunda consulta
+costaría más que lo que ahorra y se piden juntas.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EVENT_TYPES = ("hover", "click", "type", "key", "shortcut")
+
+# Tipo de suscripción de cada evento emitido
+EVENT_FAMILY = {"hover_update": "hover"}
+
+FILTERS = ("events", "region", "interactive", "controlType", "className", "rate")
+
+
+def _region(spec: Dict) -> Tuple[int, int, int, int]:
+    try:
+        x, y = int(spec["x"]), int(spec["y"])
+        width, height = int(spec["width"]), int(spec["height"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Región inválida: {spec!r} (se espera {{x, y, width, height}})")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Región vacía: {spec!r}")
+    return x, y, x + width, y + height
+
+
+class EventFilter:
+    """Filtros de la suscripción vigente y sus contadores de descarte.
+
+    Sin argumentos no filtra nada (la suscripción por defecto).
+    """
+
+    def __init__(self, events: Iterable[str] = None, interactive_only: bool = False,
+                 control_types: Iterable[str] = None, class_names: Iterable[str] = None,
+                 regions: Iterable[Tuple[int, int, int, int]] = None, max_rate: float = None):
+        self.events = frozenset(events) if events is not None else None
+        self.interactive_only = bool(interactive_only)
+        self.control_types = frozenset(control_types) if control_types else None
+        self.class_names = frozenset(class_names) if class_names else None
+        self.regions: List[Tuple[int, int, int, int]] = list(regions or ())
+        self.max_rate = float(max_rate) if max_rate is not None else None
+        self._tokens = self._burst()
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.admitted = {name: 0 for name in EVENT_TYPES}
+        self.dropped = {name: 0 for name in FILTERS}
+        self._element_checks = 0
+        self._element_drops = 0
+
+    @classmethod
+    def from_spec(cls, spec: Optional[Dict]) -> "EventFilter":
+        """Crea el filtro a partir del comando `subscribe` (ValueError si es inválido)"""
+        spec = spec or {}
+        events = spec.get("events")
+        if events is not None:
+            unknown = [e for e in events if e not in EVENT_TYPES]
+            if unknown:
+                raise ValueError(f"Tipos de evento desconocidos: {', '.join(map(str, unknown))}")
+        region = spec.get("region")
+        regions = [_region(r) for r in (region if isinstance(region, list) else [region])] if region else []
+        max_rate = spec.get("maxRate")
+        if max_rate is not None and (not isinstance(max_rate, (int, float)) or isinstance(max_rate, bool)
+                                     or not max_rate >= 0):
+            raise ValueError(f"maxRate inválido: {max_rate!r}")
+        return cls(events, spec.get("interactiveOnly", False), spec.get("controlTypes"),
+                   spec.get("classNames"), regions, max_rate)
+
+    @property
+    def element_fields(self) -> frozenset:
+        """Campos del elemento que necesitan los filtros de elemento"""
+        fields = set()
+        if self.interactive_only:
+            fields.add("isInteractive")
+        if self.control_types:
+            fields.update(("type", "controlType"))
+        if self.class_names:
+            fields.add("className")
+        return frozenset(fields)
+
+    @property
+    def has_element_filters(self) -> bool:
+        return bool(self.interactive_only or self.control_types or self.class_names)
+
+    @property
+    def defers_expensive(self) -> bool:
+        """¿Conviene pedir los campos caros solo tras admitir el elemento?"""
+        return self.has_element_filters and self._element_drops * 2 > self._element_checks
+
+    def wants(self, event_type: str) -> bool:
+        """¿La suscripción incluye este tipo de evento?"""
+        if self.events is None or EVENT_FAMILY.get(event_type, event_type) in self.events:
+            return True
+        self.dropped["events"] += 1
+        return False
+
+    def admits_point(self, x: int, y: int) -> bool:
+        if not self.regions:
+            return True
+        for left, top, right, bottom in self.regions:
+            if left <= x < right and top <= y < bottom:
+                return True
+        self.dropped["region"] += 1
+        return False
+
+    def admits_element(self, element: Optional[Dict]) -> bool:
+        """Filtros de elemento; sin elemento solo pasa si no hay ninguno activo"""
+        if not self.has_element_filters:
+            return True
+        self._element_checks += 1
+        element = element or {}
+        if self.interactive_only and not element.get("isInteractive"):
+            failed = "interactive"
+        elif self.control_types and (element.get("controlType") not in self.control_types
+                                     and element.get("type") not in self.control_types):
+            failed = "controlType"
+        elif self.class_names and element.get("className") not in self.class_names:
+            failed = "className"
+        else:
+            return True
+        self._element_drops += 1
+        self.dropped[failed] += 1
+        return False
+
+    def admit_rate(self) -> bool:
+        """Consume un hover del presupuesto de maxRate"""
+        if self.max_rate is None:
+            return True
+        if not self.max_rate:
+            self.dropped["rate"] += 1
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst(), self._tokens + (now - self._refilled) * self.max_rate)
+            self._refilled = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+        self.dropped["rate"] += 1
+        return False
+
+    def admit(self, event_type: str):
+        """Cuenta un evento que pasó los filtros y se emite"""
+        family = EVENT_FAMILY.get(event_type, event_type)
+        if family in self.admitted:
+            self.admitted[family] += 1
+
+    def _burst(self) -> float:
+        return max(1.0, (self.max_rate or 0.0) / 5)
+
+    def spec(self) -> Dict:
+        """Filtros vigentes en el formato de `subscribe`"""
+        return {
+            "events": sorted(self.events) if self.events is not None else None,
+            "interactiveOnly": self.interactive_only,
+            "controlTypes": sorted(self.control_types) if self.control_types else None,
+            "classNames": sorted(self.class_names) if self.class_names else None,
+            "region": [{"x": left, "y": top, "width": right - left, "height": bottom - top}
+                       for left, top, right, bottom in self.regions] or None,
+            "maxRate": self.max_rate
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "filters": self.spec(),
+            "admitted": dict(self.admitted),
+            "dropped": dict(self.dropped)
+        }
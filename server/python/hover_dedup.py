@@ -0,0 +1,113 @@
+"""
+Hover Dedup - Deduplicación de hover por identidad de elemento
+
+El primer hover sobre un elemento se emite completo; mientras el cursor siga
+sobre el mismo elemento (misma identidad) solo se emiten los campos que
+cambiaron y que la política considera relevantes.
+"""
+import hashlib
+from typing import Dict, Iterable, Optional, Tuple
+
+# Campos cuyo cambio se notifica por defecto. "value" queda fuera: los campos
+# de texto cambian constantemente mientras se escribe.
+DEFAULT_FIELDS = ("name", "isEnabled", "isVisible", "isInteractive", "bounds")
+
+# Diferencia (px) en bounds por debajo de la cual se ignora el cambio
+DEFAULT_BOUNDS_TOLERANCE = 4
+
+NEW = "new"
+DELTA = "delta"
+SAME = "same"
+
+
+def element_identity(runtime_id, element: Dict) -> str:
+    """Identidad estable de un elemento: el RuntimeId de UIA si está
+    disponible; si no, una huella de sus atributos estructurales."""
+    if runtime_id:
+        return "rt:" + ".".join(str(part) for part in runtime_id)
+
+    parts = [
+        element.get("controlType"), element.get("automationId"),
+        element.get("className"), element.get("parentName"), element.get("name")
+    ]
+    if not element.get("automationId") and not element.get("name"):
+        # Hermanos anónimos: distinguirlos por su posición
+        bounds = element.get("bounds") or {}
+        parts += [bounds.get("x"), bounds.get("y")]
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8)
+    return "fp:" + digest.hexdigest()
+
+
+class HoverDeduper:
+    """Decide qué se emite para cada hover.
+
+    `update(element)` devuelve (NEW, None) si cambió la identidad,
+    (DELTA, cambios) si cambió algún campo de la política o (SAME, None).
+    Con delta=False los cambios de la política también cuentan como NEW.
+    """
+
+    def __init__(self, fields: Iterable[str] = DEFAULT_FIELDS,
+                 bounds_tolerance: int = DEFAULT_BOUNDS_TOLERANCE, delta: bool = True):
+        self.fields = tuple(fields)
+        self.bounds_tolerance = bounds_tolerance
+        self.delta = delta
+        self._id: Optional[str] = None
+        self._sent: Dict = {}
+        self.full_events = 0
+        self.delta_events = 0
+        self.suppressed = 0
+
+    @classmethod
+    def from_policy(cls, policy: Optional[Dict]) -> "HoverDeduper":
+        """Crea el deduper a partir del parámetro `hoverPolicy` de start"""
+        policy = policy or {}
+        return cls(
+            policy.get("fields", DEFAULT_FIELDS),
+            policy.get("boundsTolerance", DEFAULT_BOUNDS_TOLERANCE),
+            policy.get("delta", True)
+        )
+
+    def reset(self):
+        self._id = None
+        self._sent = {}
+
+    def update(self, element: Dict) -> Tuple[str, Optional[Dict]]:
+        element_id = element.get("elementId")
+        if element_id is None or element_id != self._id:
+            self._id = element_id
+            self._sent = {field: element.get(field) for field in self.fields}
+            self.full_events += 1
+            return NEW, None
+
+        changes = {}
+        for field in self.fields:
+            value = element.get(field)
+            if not self._equal(field, self._sent.get(field), value):
+                changes[field] = value
+        if not changes:
+            self.suppressed += 1
+            return SAME, None
+
+        self._sent.update(changes)
+        if not self.delta:
+            self.full_events += 1
+            return NEW, None
+        self.delta_events += 1
+        return DELTA, changes
+
+    def _equal(self, field: str, old, new) -> bool:
+        if field == "bounds" and isinstance(old, dict) and isinstance(new, dict):
+            tolerance = self.bounds_tolerance
+            return all(abs((old.get(k) or 0) - (new.get(k) or 0)) <= tolerance
+                       for k in ("x", "y", "width", "height"))
+        return old == new
+
+    def stats(self) -> Dict:
+        return {
+            "fields": list(self.fields),
+            "boundsTolerance": self.bounds_tolerance,
+            "delta": self.delta,
+            "fullEvents": self.full_events,
+            "deltaEvents": self.delta_events,
+            "suppressed": self.suppressed
+        }
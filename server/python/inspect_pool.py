@@ -0,0 +1,356 @@
+"""
+Inspection Pool - Inspección UIA aislada en workers con plazo
+
+Si la aplicación bajo el cursor está colgada u ocupada, ControlFromPoint y la
+lectura de propiedades se bloquean durante segundos. Las inspecciones se
+ejecutan en un pool pequeño de hilos con COM inicializado y quien las pide
+(hilo de hover, worker de clics, comandos) espera como mucho su plazo
+(`deadline`); al vencer sigue sin elemento (InspectionTimeout).
+
+Un worker que no responde a tiempo se da por colgado: se retira y otro nuevo
+ocupa su lugar. Python no puede matar un hilo bloqueado en una llamada COM,
+así que el colgado termina solo cuando la llamada vuelve; `max_hung` acota
+cuántos pueden quedar así a la vez.
+
+Opcionalmente (`hedge_after`), si la llamada sigue sin respuesta pasado ese
+umbral se lanza una copia en otro worker libre y gana la primera respuesta.
+
+Cada proceso inspeccionado tiene una puntuación de lentitud (media móvil de
+la latencia, en ms; los plazos vencidos cuentan como el plazo completo). Tras
+`quarantine_after` plazos vencidos seguidos el proceso queda en cuarentena
+`quarantine` segundos: sus inspecciones fallan al instante en lugar de
+retirar más workers. Al terminar la cuarentena la siguiente llamada sondea.
+
+close() termina los workers (TrackingService.stop); la siguiente llamada a
+run() crea otros, así que el pool sigue sirviendo a los comandos.
+"""
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from metrics import REGISTRY, StageMetrics
+
+# Peso de la última muestra en la puntuación de lentitud
+_SCORE_ALPHA = 0.2
+
+# Procesos con puntuación que se conservan (los más recientes)
+_MAX_PROCESSES = 64
+
+
+class InspectionTimeout(TimeoutError):
+    """La inspección no respondió dentro de su plazo"""
+
+
+class _Task:
+    __slots__ = ("fn", "args", "lock", "done", "result", "error", "attempts", "winner", "abandoned")
+
+    def __init__(self, fn: Callable, args: tuple):
+        self.fn = fn
+        self.args = args
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.attempts = 0
+        self.winner = 0
+        self.abandoned = False
+
+    def claim(self) -> int:
+        """Número de intento para el worker que la toma (0 si ya no hace falta)"""
+        with self.lock:
+            if self.done.is_set():
+                return 0
+            self.attempts += 1
+            return self.attempts
+
+    def finish(self, attempt: int, result=None, error: BaseException = None) -> bool:
+        """Publica el resultado; False si otro intento ganó o se abandonó"""
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.result = result
+            self.error = error
+            self.winner = attempt
+            self.done.set()
+            return True
+
+    def abandon(self) -> bool:
+        """Marca la tarea como vencida; False si el resultado llegó justo antes"""
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.abandoned = True
+            self.done.set()
+            return True
+
+
+class _Worker:
+    __slots__ = ("name", "queue", "thread", "task", "since", "retired")
+
+    def __init__(self, name: str, tasks: "queue.SimpleQueue"):
+        self.name = name
+        # Cola de su generación: close() la cambia y los centinelas no se
+        # mezclan con los workers nuevos
+        self.queue = tasks
+        self.thread: Optional[threading.Thread] = None
+        self.task: Optional[_Task] = None
+        self.since = 0.0
+        self.retired = False
+
+
+class _ProcessScore:
+    __slots__ = ("score", "calls", "timeouts", "consecutive", "skipped", "quarantined_until", "last")
+
+    def __init__(self):
+        self.score = 0.0
+        self.calls = 0
+        self.timeouts = 0
+        self.consecutive = 0
+        self.skipped = 0
+        self.quarantined_until = 0.0
+        self.last = 0.0
+
+
+class InspectionPool:
+    """Pool de workers de inspección con plazo, reciclado y hedging.
+
+    `run(fn, *args, pid=..., deadline=...)` ejecuta `fn(*args)` en un worker
+    y devuelve su resultado (o relanza su excepción). `init_thread` y
+    `uninit_thread` preparan cada worker para UIA (COM).
+    """
+
+    def __init__(self, workers: int = 2, deadline: float = 0.3, hedge_after: float = None,
+                 max_hung: int = 8, quarantine: float = 2.0, quarantine_after: int = 2,
+                 init_thread: Callable[[], None] = None, uninit_thread: Callable[[], None] = None,
+                 metrics: StageMetrics = None):
+        self.workers = max(1, int(workers))
+        self.deadline = float(deadline)
+        self.hedge_after = float(hedge_after) if hedge_after else None
+        self.max_hung = max(0, int(max_hung))
+        self.quarantine = float(quarantine)
+        self.quarantine_after = max(1, int(quarantine_after))
+        self.init_thread = init_thread
+        self.uninit_thread = uninit_thread
+        self.metrics = metrics or REGISTRY
+        self._lock = threading.Lock()
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._live: List[_Worker] = []
+        self._hung: List[_Worker] = []
+        self._names = itertools.count(1)
+        self._processes: "OrderedDict[Optional[int], _ProcessScore]" = OrderedDict()
+
+        self.calls = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+        self.starved = 0
+
+    def configure(self, options: Dict):
+        """Aplica {workers, deadline, hedgeAfter, maxHung, quarantine, quarantineAfter}"""
+        with self._lock:
+            if "workers" in options:
+                self.workers = max(1, int(options["workers"]))
+            if "deadline" in options:
+                self.deadline = float(options["deadline"])
+            if "hedgeAfter" in options:
+                self.hedge_after = float(options["hedgeAfter"]) if options["hedgeAfter"] else None
+            if "maxHung" in options:
+                self.max_hung = max(0, int(options["maxHung"]))
+            if "quarantine" in options:
+                self.quarantine = float(options["quarantine"])
+            if "quarantineAfter" in options:
+                self.quarantine_after = max(1, int(options["quarantineAfter"]))
+            self._fill_locked()
+
+    # -- Llamadas --
+
+    def run(self, fn: Callable, *args, pid: int = None, deadline: float = None):
+        """Ejecuta `fn(*args)` en un worker; InspectionTimeout si vence el plazo"""
+        deadline = self.deadline if deadline is None else deadline
+        now = time.monotonic()
+        with self._lock:
+            process = self._process_locked(pid)
+            if process.quarantined_until > now:
+                process.skipped += 1
+                self.skipped += 1
+                raise InspectionTimeout(f"Proceso {pid} en cuarentena")
+            self.calls += 1
+            self._fill_locked()
+            tasks = self._queue
+
+        task = _Task(fn, args)
+        started = time.perf_counter()
+        tasks.put(task)
+
+        hedge = self.hedge_after
+        if hedge is not None and hedge < deadline:
+            if not task.done.wait(hedge) and self.has_idle():
+                # Copia en otro worker libre: gana la primera respuesta
+                with self._lock:
+                    self.hedges += 1
+                tasks.put(task)
+            task.done.wait(max(0.0, deadline - (time.perf_counter() - started)))
+        else:
+            task.done.wait(deadline)
+
+        if task.abandon():
+            self._timed_out(task, pid, deadline)
+            raise InspectionTimeout(f"Inspección sin respuesta en {deadline * 1000:g} ms")
+
+        elapsed = time.perf_counter() - started
+        self.metrics.observe("inspect.pool", elapsed)
+        with self._lock:
+            if task.winner > 1:
+                self.hedge_wins += 1
+            self._score_locked(pid, elapsed, timed_out=False)
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def has_idle(self) -> bool:
+        """¿Hay algún worker libre? (el prefetch especulativo solo usa esos)"""
+        with self._lock:
+            return any(worker.task is None for worker in self._live)
+
+    def _timed_out(self, task: _Task, pid: Optional[int], deadline: float):
+        self.metrics.error("inspect.pool", InspectionTimeout())
+        with self._lock:
+            self.timeouts += 1
+            self._score_locked(pid, deadline, timed_out=True)
+            # Los workers que siguen dentro de la tarea se dan por colgados
+            for worker in [w for w in self._live if w.task is task]:
+                worker.retired = True
+                self._live.remove(worker)
+                self._hung.append(worker)
+                self.recycled += 1
+            self._fill_locked()
+
+    def _score_locked(self, pid: Optional[int], seconds: float, timed_out: bool):
+        process = self._process_locked(pid)
+        process.calls += 1
+        process.last = time.monotonic()
+        ms = seconds * 1000
+        process.score = ms if process.calls == 1 else process.score + _SCORE_ALPHA * (ms - process.score)
+        if not timed_out:
+            process.consecutive = 0
+            return
+        process.timeouts += 1
+        process.consecutive += 1
+        if process.consecutive >= self.quarantine_after and self.quarantine > 0:
+            process.quarantined_until = time.monotonic() + self.quarantine
+            process.consecutive = 0
+
+    def _process_locked(self, pid: Optional[int]) -> _ProcessScore:
+        process = self._processes.get(pid)
+        if process is None:
+            process = self._processes[pid] = _ProcessScore()
+            while len(self._processes) > _MAX_PROCESSES:
+                self._processes.popitem(last=False)
+        else:
+            self._processes.move_to_end(pid)
+        return process
+
+    # -- Workers --
+
+    def _fill_locked(self):
+        """Completa el pool hasta `workers` (sin pasar de `max_hung` colgados)"""
+        self._hung = [w for w in self._hung if w.thread.is_alive()]
+        if len(self._hung) > self.max_hung:
+            # Demasiados colgados: no crear más hilos hasta que vuelvan
+            if len(self._live) < self.workers:
+                self.starved += 1
+            return
+        while len(self._live) < self.workers:
+            worker = _Worker(f"inspect-worker-{next(self._names)}", self._queue)
+            worker.thread = threading.Thread(target=self._worker_loop, args=(worker,), daemon=True,
+                                             name=worker.name)
+            self._live.append(worker)
+            worker.thread.start()
+
+    def _worker_loop(self, worker: _Worker):
+        if self.init_thread:
+            try:
+                self.init_thread()
+            except Exception as e:
+                self.metrics.error("inspect.pool", e)
+        try:
+            while not worker.retired:
+                task = worker.queue.get()
+                if task is None:
+                    break
+                attempt = task.claim()
+                if not attempt:
+                    continue
+                worker.since = time.perf_counter()
+                worker.task = task
+                try:
+                    result = task.fn(*task.args)
+                except Exception as e:
+                    task.finish(attempt, error=e)
+                else:
+                    task.finish(attempt, result)
+                finally:
+                    worker.task = None
+        finally:
+            if self.uninit_thread:
+                try:
+                    self.uninit_thread()
+                except Exception as e:
+                    self.metrics.error("inspect.pool", e)
+
+    def close(self, timeout: float = 1.0):
+        """Termina los workers: los libres al acabar lo ya encolado (se esperan
+        hasta `timeout`), los colgados al volver su llamada"""
+        with self._lock:
+            workers, self._live = self._live, []
+            tasks, self._queue = self._queue, queue.SimpleQueue()
+        for _ in workers:
+            tasks.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            if worker.thread is not threading.current_thread():
+                worker.thread.join(max(0.0, deadline - time.monotonic()))
+
+    # -- Estado --
+
+    def process_scores(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                str(pid) if pid is not None else "unknown": {
+                    "score": round(process.score, 1),
+                    "calls": process.calls,
+                    "timeouts": process.timeouts,
+                    "skipped": process.skipped,
+                    "quarantined": process.quarantined_until > now
+                }
+                for pid, process in sorted(self._processes.items(), key=lambda item: -item[1].score)
+            }
+
+    def stats(self) -> Dict:
+        now = time.perf_counter()
+        processes = self.process_scores()
+        with self._lock:
+            self._hung = [w for w in self._hung if w.thread.is_alive()]
+            return {
+                "workers": self.workers,
+                "live": len(self._live),
+                "busy": sum(1 for w in self._live if w.task is not None),
+                "hung": [{"name": w.name, "stuckMs": round((now - w.since) * 1000)} for w in self._hung],
+                "deadlineMs": round(self.deadline * 1000, 1),
+                "hedgeAfterMs": round(self.hedge_after * 1000, 1) if self.hedge_after else None,
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "recycled": self.recycled,
+                "hedges": self.hedges,
+                "hedgeWins": self.hedge_wins,
+                "skipped": self.skipped,
+                "starved": self.starved,
+                "latencyMs": self.metrics.histogram("inspect.pool").summary(),
+                "processes": processes
+            }
@@ -0,0 +1,281 @@
+"""
+Keyboard Tracker - Ráfagas de tecleo coalescidas en eventos `type`
+
+El hook de teclado solo encola (nombre, carácter, instante) y vuelve, igual
+que el hook de mouse: la latencia del tecleo no depende de UIA ni de la
+salida. Un worker consume la cola y agrupa las teclas consecutivas en una
+ráfaga por elemento enfocado; el elemento se resuelve una vez, al empezar la
+ráfaga, no por tecla.
+
+La ráfaga se cierra (y se emite un único `type`) por:
+    focus     cambio de foco a otro elemento (FocusChangedEvent del backend)
+    click     clic del mouse (lo avisa TrackingService desde el hook)
+    idle      `idle_timeout` segundos sin teclas
+    key       tecla especial (enter, tab, flechas, F1...) que se emite aparte
+    shortcut  combinación con ctrl/alt/win, que se emite aparte
+    length    `max_chars` caracteres en la ráfaga
+    stop      fin del tracking
+
+Backspace dentro de una ráfaga corrige su texto en lugar de emitirse. En los
+campos de contraseña el texto se enmascara, y también cuando no se sabe si lo
+es (el foco no se resolvió, p.ej. por el plazo del pool de inspección).
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from hover_dedup import element_identity
+from metrics import REGISTRY, StageMetrics
+
+# Nombres de pynput de las teclas modificadoras -> modificador
+MODIFIERS = {
+    "ctrl": "ctrl", "ctrl_l": "ctrl", "ctrl_r": "ctrl",
+    "alt": "alt", "alt_l": "alt", "alt_r": "alt",
+    "alt_gr": "alt_gr",
+    "shift": "shift", "shift_l": "shift", "shift_r": "shift",
+    "cmd": "win", "cmd_l": "win", "cmd_r": "win",
+}
+
+# Orden de los modificadores en los atajos ("ctrl+shift+s")
+_MODIFIER_ORDER = ("ctrl", "alt", "shift", "win")
+
+# Razones de cierre de una ráfaga
+FLUSH_REASONS = ("focus", "click", "idle", "key", "shortcut", "length", "stop")
+
+MASK_CHAR = "•"
+
+
+class _Burst:
+    __slots__ = ("element", "element_id", "window", "chars", "keys", "backspaces", "started", "wall_started",
+                 "last")
+
+    def __init__(self, element: Optional[Dict], window: Optional[int], started: float, wall_started: float):
+        self.element = element
+        self.window = window
+        self.element_id = element.get("elementId") if element else None
+        self.chars: List[str] = []
+        self.keys = 0
+        self.backspaces = 0
+        self.started = started
+        self.wall_started = wall_started
+        self.last = started
+
+
+class KeyboardTracker:
+    """Coalesce las teclas en eventos `type`, `key` y `shortcut`.
+
+    `resolve_focus()` devuelve el elemento enfocado y `resolve_window()` la
+    ventana en primer plano (se llaman en el worker al empezar cada ráfaga).
+    `emit(event, timestamp, window)` publica cada evento con la ventana a la
+    que fue el teclado: la del comienzo de la ráfaga, no la del cierre.
+    `init_thread`/`uninit_thread` preparan el worker para UIA (COM).
+    """
+
+    def __init__(self, resolve_focus: Callable[[], Optional[Dict]],
+                 emit: Callable[[Dict, float, Optional[int]], None], idle_timeout: float = 1.0,
+                 max_chars: int = 1000, init_thread: Callable[[], None] = None,
+                 uninit_thread: Callable[[], None] = None,
+                 subscribe_focus: Callable[[Callable], Optional[Callable]] = None,
+                 resolve_window: Callable[[], Optional[int]] = None, metrics: StageMetrics = None):
+        self.resolve_focus = resolve_focus
+        self.resolve_window = resolve_window
+        self.emit = emit
+        self.idle_timeout = max(0.05, float(idle_timeout))
+        self.max_chars = max(1, int(max_chars))
+        self.init_thread = init_thread
+        self.uninit_thread = uninit_thread
+        self.subscribe_focus = subscribe_focus
+        self.metrics = metrics or REGISTRY
+        # (tipo, nombre, carácter, t_perf, t_wall) | None para terminar
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._burst: Optional[_Burst] = None
+        self._modifiers = set()
+        self.hook_latency = self.metrics.histogram("keyboard.hook")
+
+        self.keys = 0
+        self.bursts = 0
+        self.events = {"type": 0, "key": 0, "shortcut": 0}
+        self.flushes = {reason: 0 for reason in FLUSH_REASONS}
+
+    # -- Hilo del hook (solo encolar) --
+
+    def on_press(self, key: str, char: Optional[str] = None):
+        started = time.perf_counter()
+        self._queue.put(("press", key, char, started, time.time()))
+        self.hook_latency.record(time.perf_counter() - started)
+
+    def on_release(self, key: str, char: Optional[str] = None):
+        if key in MODIFIERS:
+            self._queue.put(("release", key, char, time.perf_counter(), time.time()))
+
+    def flush(self, reason: str = "click"):
+        """Pide cerrar la ráfaga actual (desde cualquier hilo, no bloquea)"""
+        self._queue.put(("flush", reason, None, time.perf_counter(), time.time()))
+
+    def _on_focus(self, runtime_id: Optional[tuple]):
+        self._queue.put(("focus", runtime_id, None, time.perf_counter(), time.time()))
+
+    # -- Ciclo de vida --
+
+    def start(self):
+        self._thread = threading.Thread(target=self._worker_loop, daemon=True, name="keyboard-worker")
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """Emite la ráfaga pendiente y termina el worker"""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            if thread is not threading.current_thread():
+                thread.join(timeout=timeout)
+
+    # -- Worker --
+
+    def _worker_loop(self):
+        if self.init_thread:
+            self.init_thread()
+        # Suscripción desde el worker: los eventos de foco de UIA necesitan su apartamento COM
+        unsubscribe = self.subscribe_focus(self._on_focus) if self.subscribe_focus else None
+        try:
+            while True:
+                burst = self._burst
+                timeout = None if burst is None else max(0.0, burst.last + self.idle_timeout - time.perf_counter())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush("idle")
+                    continue
+                if item is None:
+                    self._flush("stop")
+                    break
+                try:
+                    self._handle(*item)
+                except Exception as e:
+                    self.metrics.error("keyboard.worker", e)
+        finally:
+            if unsubscribe:
+                unsubscribe()
+            if self.uninit_thread:
+                self.uninit_thread()
+
+    def _handle(self, kind: str, key, char: Optional[str], started: float, wall: float):
+        if kind == "release":
+            self._modifiers.discard(MODIFIERS[key])
+        elif kind == "flush":
+            self._flush(key)
+        elif kind == "focus":
+            # El foco de la propia ráfaga (p.ej. al empezar a teclear) no la cierra
+            burst = self._burst
+            if burst is not None and (key is None or element_identity(key, {}) != burst.element_id):
+                self._flush("focus")
+        elif kind == "press":
+            self.keys += 1
+            self._press(key, char, started, wall)
+
+    def _press(self, key: str, char: Optional[str], started: float, wall: float):
+        modifier = MODIFIERS.get(key)
+        if modifier is not None:
+            self._modifiers.add(modifier)
+            return
+
+        printable = char is not None and len(char) == 1 and char.isprintable()
+        held = [m for m in _MODIFIER_ORDER if m in self._modifiers and m != "shift"]
+        # AltGr (ctrl+alt en Windows) produce caracteres, no atajos
+        if held and not (printable and "alt_gr" in self._modifiers):
+            self._flush("shortcut")
+            combo = [m for m in _MODIFIER_ORDER if m in self._modifiers] + [key]
+            self._emit({"event": "shortcut", "keys": "+".join(combo)}, wall, self._window())
+            return
+
+        burst = self._burst
+        if printable:
+            if burst is None:
+                burst = self._begin(started, wall)
+            burst.chars.append(char)
+            burst.keys += 1
+            burst.last = started
+            if len(burst.chars) >= self.max_chars:
+                self._flush("length")
+            return
+
+        if key == "backspace" and burst is not None and burst.chars:
+            burst.chars.pop()
+            burst.backspaces += 1
+            burst.keys += 1
+            burst.last = started
+            return
+
+        # Tecla especial: cierra la ráfaga y se emite aparte, con el elemento
+        # de la ráfaga si la había (mismo foco)
+        element = burst.element if burst is not None else None
+        window = burst.window if burst is not None else self._window()
+        self._flush("key")
+        event = {"event": "key", "key": key}
+        modifiers = [m for m in _MODIFIER_ORDER if m in self._modifiers]
+        if modifiers:
+            event["modifiers"] = modifiers
+        if element is not None:
+            event["element"] = element
+        self._emit(event, wall, window)
+
+    def _begin(self, started: float, wall: float) -> _Burst:
+        element = None
+        try:
+            element = self.resolve_focus()
+        except Exception as e:
+            self.metrics.error("keyboard.focus", e)
+        self._burst = _Burst(element, self._window(), started, wall)
+        self.bursts += 1
+        return self._burst
+
+    def _window(self) -> Optional[int]:
+        if self.resolve_window is None:
+            return None
+        try:
+            return self.resolve_window()
+        except Exception as e:
+            self.metrics.error("keyboard.focus", e)
+            return None
+
+    def _flush(self, reason: str):
+        burst, self._burst = self._burst, None
+        if burst is None or not burst.keys:
+            return
+        self.flushes[reason] = self.flushes.get(reason, 0) + 1
+        text = "".join(burst.chars)
+        event = {
+            "event": "type",
+            "text": text,
+            "keys": burst.keys,
+            "backspaces": burst.backspaces,
+            "reason": reason,
+            "element": burst.element,
+            "timestamp": datetime.fromtimestamp(burst.wall_started).isoformat(),
+            "durationMs": round((burst.last - burst.started) * 1000, 1)
+        }
+        # Falla cerrado: solo sale en claro si consta que no es contraseña
+        if not burst.element or burst.element.get("isPassword") is not False:
+            event["text"] = MASK_CHAR * len(text)
+            event["masked"] = True
+        self._emit(event, burst.wall_started, burst.window)
+
+    def _emit(self, event: Dict, wall: float, window: Optional[int]):
+        self.events[event["event"]] += 1
+        with self.metrics.time("keyboard.emit"):
+            self.emit(event, wall, window)
+
+    def stats(self) -> Dict:
+        burst = self._burst
+        return {
+            "active": self._thread is not None,
+            "keys": self.keys,
+            "bursts": self.bursts,
+            "events": dict(self.events),
+            "flushes": dict(self.flushes),
+            "queued": self._queue.qsize(),
+            "pendingChars": len(burst.chars) if burst is not None else 0,
+            "hookUs": self.hook_latency.summary(scale=1e6, digits=1)
+        }
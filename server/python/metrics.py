@@ -0,0 +1,320 @@
+"""
+Metrics - Histogramas de latencia y contadores de error por etapa
+
+Cada etapa del pipeline (hit-test UIA, GetWindowRect, actualización del
+overlay, codificación y escritura del evento...) registra su duración en un
+histograma de buckets fijos: grabar una muestra es un bisect y un incremento,
+sin guardar las muestras. Los percentiles se estiman interpolando dentro del
+bucket (error acotado por el ancho del bucket, ~26%).
+
+Los errores que antes se descartaban con `except: pass` se cuentan por etapa
+y tipo de excepción. `prometheus_text()` exporta todo en formato de texto de
+Prometheus; PrometheusDumper lo escribe periódicamente a un archivo local.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional
+
+# Límites superiores de los buckets (segundos): 10 por década, de 1µs a ~80s
+BUCKET_BOUNDS = tuple(1e-6 * 10 ** (i / 10) for i in range(80))
+
+# Buckets exportados a Prometheus (uno por cada media década)
+_EXPORT_EVERY = 5
+
+
+class Histogram:
+    """Histograma de buckets fijos con la misma interfaz de resumen que una
+    ventana de latencias: record(seconds), count y summary(scale, digits)."""
+
+    __slots__ = ("name", "_counts", "_lock", "count", "total", "min", "max")
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds: float):
+        index = bisect_left(BUCKET_BOUNDS, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if self.max is None or seconds > self.max:
+                self.max = seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            return self._percentile_locked(p)
+
+    def _percentile_locked(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for index, bucket in enumerate(self._counts):
+            if not bucket or seen + bucket < rank:
+                seen += bucket
+                continue
+            # Interpolar dentro del bucket, acotado a los extremos observados
+            lower = max(BUCKET_BOUNDS[index - 1] if index > 0 else 0.0, self.min)
+            upper = min(BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max, self.max)
+            return lower + (upper - lower) * max(0.0, rank - seen) / bucket
+        return self.max
+
+    def summary(self, scale: float = 1000.0, digits: int = 3) -> Dict:
+        """Resumen escalado (por defecto en ms)"""
+        with self._lock:
+            if not self.count:
+                return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+            return {
+                "count": self.count,
+                "p50": round(self._percentile_locked(0.50) * scale, digits),
+                "p95": round(self._percentile_locked(0.95) * scale, digits),
+                "p99": round(self._percentile_locked(0.99) * scale, digits),
+                "max": round(self.max * scale, digits)
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(BUCKET_BOUNDS) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def snapshot(self):
+        """(buckets, count, suma) consistentes entre sí, para exportar"""
+        with self._lock:
+            return list(self._counts), self.count, self.total
+
+
+class _StageTimer:
+    """Context manager de `StageMetrics.time`: mide y cuenta la excepción
+    (que se propaga) en la misma etapa"""
+
+    __slots__ = ("_metrics", "_stage", "_started")
+
+    def __init__(self, metrics: "StageMetrics", stage: str):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.observe(self._stage, time.perf_counter() - self._started)
+        if exc is not None:
+            self._metrics.error(self._stage, exc)
+        return False
+
+
+class StageMetrics:
+    """Registro de histogramas y errores por etapa"""
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._errors: Dict[str, Dict[str, int]] = {}
+        self._last_errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def histogram(self, stage: str) -> Histogram:
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, Histogram(stage))
+        return histogram
+
+    def observe(self, stage: str, seconds: float):
+        self.histogram(stage).record(seconds)
+
+    def time(self, stage: str) -> _StageTimer:
+        """`with metrics.time("hover.hit_test"): ...`"""
+        return _StageTimer(self, stage)
+
+    def error(self, stage: str, exc: BaseException = None):
+        """Cuenta un error de la etapa (en lugar de descartarlo en silencio)"""
+        kind = type(exc).__name__ if exc is not None else "Error"
+        with self._lock:
+            counts = self._errors.setdefault(stage, {})
+            counts[kind] = counts.get(kind, 0) + 1
+            self._last_errors[stage] = f"{kind}: {exc}" if exc is not None else kind
+
+    def error_count(self, stage: str) -> int:
+        with self._lock:
+            return sum(self._errors.get(stage, {}).values())
+
+    def errors(self) -> Dict[str, Dict[str, int]]:
+        """Errores por etapa y tipo de excepción"""
+        with self._lock:
+            return {stage: dict(counts) for stage, counts in sorted(self._errors.items())}
+
+    def reset(self):
+        with self._lock:
+            histograms = list(self._histograms.values())
+            self._errors.clear()
+            self._last_errors.clear()
+            self.started_at = time.time()
+        for histogram in histograms:
+            histogram.reset()
+
+    def summary(self) -> Dict:
+        """Percentiles (ms) y errores por etapa"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            errors = {stage: dict(counts) for stage, counts in self._errors.items()}
+            last_errors = dict(self._last_errors)
+
+        stages = {}
+        for stage, histogram in histograms:
+            stages[stage] = dict(histogram.summary(), errors=sum(errors.get(stage, {}).values()))
+        for stage in errors:
+            stages.setdefault(stage, {"count": 0, "p50": None, "p95": None, "p99": None,
+                                      "max": None, "errors": sum(errors[stage].values())})
+        return {
+            "unit": "ms",
+            "sinceMs": round((time.time() - self.started_at) * 1000),
+            "stages": stages,
+            "errors": {stage: {"byType": counts, "last": last_errors.get(stage)}
+                       for stage, counts in sorted(errors.items())}
+        }
+
+    def prometheus_text(self, prefix: str = "alqvimia") -> str:
+        """Exporta histogramas y errores en formato de texto de Prometheus"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            errors = sorted((stage, dict(counts)) for stage, counts in self._errors.items())
+
+        lines = [
+            f"# HELP {prefix}_stage_seconds Duración de cada etapa del pipeline",
+            f"# TYPE {prefix}_stage_seconds histogram"
+        ]
+        for stage, histogram in histograms:
+            counts, count, total = histogram.snapshot()
+            label = _escape(stage)
+            cumulative = 0
+            for index, bound in enumerate(BUCKET_BOUNDS):
+                cumulative += counts[index]
+                if index % _EXPORT_EVERY == 0:
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{label}",le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{label}"}} {total:.9g}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{label}"}} {count}')
+
+        lines += [
+            f"# HELP {prefix}_stage_errors_total Errores por etapa y tipo de excepción",
+            f"# TYPE {prefix}_stage_errors_total counter"
+        ]
+        for stage, counts in errors:
+            for kind, value in sorted(counts.items()):
+                lines.append(f'{prefix}_stage_errors_total{{stage="{_escape(stage)}",error="{_escape(kind)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusDumper:
+    """Escribe `prometheus_text()` a `path` cada `interval` segundos.
+
+    La escritura es atómica (archivo temporal + os.replace) para que un
+    node_exporter con textfile collector nunca lea un archivo a medias.
+    """
+
+    def __init__(self, metrics: StageMetrics, path: str, interval: float = 15.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = max(0.5, float(interval))
+        self.dumps = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="metrics-dump")
+        self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo y deja un último volcado"""
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+        self.dump()
+
+    def dump(self):
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.metrics.prometheus_text())
+            os.replace(tmp, self.path)
+            self.dumps += 1
+        except OSError as e:
+            self.metrics.error("metrics.dump", e)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def stats(self) -> Dict:
+        return {"path": self.path, "interval": self.interval, "dumps": self.dumps}
+
+
+# Registro del proceso: tracking, overlay y el escritor de eventos lo comparten
+REGISTRY = StageMetrics()
+
+_dumper: Optional[PrometheusDumper] = None
+_dumper_lock = threading.Lock()
+
+
+def configure_dump(path: Optional[str], interval: float = 15.0,
+                   metrics: StageMetrics = None) -> Optional[PrometheusDumper]:
+    """Inicia (o detiene, con path vacío) el volcado periódico"""
+    global _dumper
+    with _dumper_lock:
+        if _dumper is not None:
+            _dumper.stop()
+            _dumper = None
+        if path:
+            _dumper = PrometheusDumper(metrics or REGISTRY, path, interval)
+            _dumper.start()
+        return _dumper
+
+
+def configure_from_env():
+    """ALQVIMIA_METRICS_FILE / ALQVIMIA_METRICS_INTERVAL"""
+    path = os.environ.get("ALQVIMIA_METRICS_FILE")
+    if path:
+        configure_dump(path, float(os.environ.get("ALQVIMIA_METRICS_INTERVAL", "15")))
+
+
+def shutdown():
+    """Último volcado al salir del servicio"""
+    configure_dump(None)
+
+
+def build_metrics_commands(metrics: StageMetrics = None) -> Dict:
+    """Comando `metrics` (compartido por tracking y overlay)"""
+    metrics = metrics or REGISTRY
+
+    def cmd_metrics(cmd: dict):
+        if "prometheusFile" in cmd:
+            configure_dump(cmd["prometheusFile"], cmd.get("interval", 15.0), metrics)
+        response = {"event": "metrics", **metrics.summary()}
+        if cmd.get("format") == "prometheus":
+            response["prometheus"] = metrics.prometheus_text()
+        with _dumper_lock:
+            response["dump"] = _dumper.stats() if _dumper else None
+        if cmd.get("reset"):
+            metrics.reset()
+        return response
+
+    return {"metrics": cmd_metrics}
@@ -0,0 +1,502 @@
+"""
+Overlay - Dibuja resaltados visuales sobre elementos UI usando GDI
+Implementación única compartida por overlay_service, tracking_service y el daemon
+
+Modos de render (ALQVIMIA_OVERLAY o el argumento `mode`):
+
+    layered  una ventana retenida transparente, click-through y topmost que
+             solo se actualiza cuando cambia el conjunto de resaltados;
+             limpiar es ocultarla (por defecto si el backend la soporta)
+    desktop  dibujo directo en el DC del escritorio a ~30 FPS; limpiar
+             invalida el escritorio y repinta todas las ventanas
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from backends import OverlaySurface, PlatformBackend, rgb
+from metrics import REGISTRY, StageMetrics
+
+# Constantes para colores
+RED = rgb(255, 0, 0)
+GREEN = rgb(34, 197, 94)  # #22c55e
+BLUE = rgb(59, 130, 246)
+ORANGE = rgb(255, 165, 0)
+PURPLE = rgb(139, 92, 246)
+
+COLORS = {
+    "green": GREEN,
+    "red": RED,
+    "blue": BLUE,
+    "orange": ORANGE,
+    "purple": PURPLE
+}
+
+# Id del resaltado principal (hover y comando highlight)
+PRIMARY = "primary"
+
+# Alto reservado para la etiqueta sobre el rectángulo
+LABEL_HEIGHT = 16
+# Ancho estimado por carácter de etiqueta (área de la ventana retenida)
+LABEL_CHAR_WIDTH = 8
+
+LAYERED = "layered"
+DESKTOP = "desktop"
+MODES = (LAYERED, DESKTOP)
+
+# Sin cambios, el hilo de la ventana retenida despierta así para atender mensajes
+PUMP_INTERVAL = 0.1
+
+# Espera máxima a que el resaltado quitado para una captura deje de verse
+CAPTURE_HIDE_TIMEOUT = 0.1
+
+# Pens del pool como máximo: los colores los elige el cliente (highlight_many),
+# al superarlo se borra el usado hace más tiempo
+PEN_POOL_SIZE = 16
+
+GDI_COUNTERS = ("dcsAcquired", "dcsReleased", "objectsCreated", "objectsDeleted",
+                "surfacesCreated", "surfacesClosed")
+
+
+def resolve_color(color: Union[int, str, None]) -> int:
+    """Acepta un COLORREF, un nombre ("green", "red", ...) o "#rrggbb" """
+    if isinstance(color, int):
+        return color
+    if isinstance(color, str) and color.startswith("#") and len(color) == 7:
+        try:
+            return rgb(int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16))
+        except ValueError:
+            pass
+    return COLORS.get(color, GREEN)
+
+
+def _overlaps(rect: Tuple[int, int, int, int], border: int, area: Tuple[int, int, int, int]) -> bool:
+    """¿El borde de `rect` (x, y, ancho, alto) cae dentro de `area`?"""
+    x, y, width, height = rect
+    ax, ay, aw, ah = area
+    return (x - border < ax + aw and ax < x + width + border
+            and y - border < ay + ah and ay < y + height + border)
+
+
+class Highlight:
+    """Un rectángulo resaltado"""
+
+    __slots__ = ("rect", "color", "width", "label")
+
+    def __init__(self, rect: Tuple[int, int, int, int], color: int, width: int, label: Optional[str] = None):
+        self.rect = rect
+        self.color = color
+        self.width = width
+        self.label = label
+
+    def snapshot(self) -> Tuple:
+        return (self.rect, self.color, self.width, self.label)
+
+
+class ElementOverlay:
+    """Dibuja un overlay sobre elementos UI.
+
+    Mantiene un conjunto de resaltados por id. En modo layered se publican en
+    la ventana retenida solo cuando el conjunto cambia; en modo desktop se
+    dibujan todos en el DC del escritorio con una sola adquisición por frame.
+    Los pens salen de un pool por (color, ancho) que vive lo mismo que el
+    overlay.
+    """
+
+    def __init__(self, backend: PlatformBackend, metrics: StageMetrics = None, mode: str = None):
+        self.gdi = backend.gdi
+        self.windows = backend.overlay
+        self.metrics = metrics or REGISTRY
+        mode = mode or os.environ.get("ALQVIMIA_OVERLAY") or LAYERED
+        if mode not in MODES:
+            raise ValueError(f"Modo de overlay desconocido: {mode}")
+        self.mode = mode if self.windows.available else DESKTOP
+        self.highlights: Dict[str, Highlight] = {}
+        self.overlay_thread: Optional[threading.Thread] = None
+        self.running = False
+        self.border_width = 3
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._next_id = 0
+        self._pens: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._null_brush = None
+        # La ventana retenida no sale en las capturas (si no, hidden_for_capture)
+        self.excluded_from_capture = False
+        # Versión del conjunto pedida (con _lock) y la ya dibujada (con _shown)
+        self._version = 0
+        self._shown_version = 0
+        self._shown = threading.Condition()
+
+        self.frames = 0          # dibujados en el DC del escritorio (modo desktop)
+        self.updates = 0         # actualizaciones de la ventana retenida (modo layered)
+        self.invalidations = 0   # invalidaciones de todo el escritorio
+        self.pen_evictions = 0
+        # Recursos GDI adquiridos y liberados (diagnostics: fugas de DCs y pens)
+        self.gdi_counts = {name: 0 for name in GDI_COUNTERS}
+
+    @property
+    def current_rect(self) -> Optional[Tuple[int, int, int, int]]:
+        """Rectángulo del resaltado principal"""
+        with self._lock:
+            primary = self.highlights.get(PRIMARY)
+            return primary.rect if primary else None
+
+    def start(self):
+        """Inicia el hilo de overlay"""
+        if not self.running:
+            self.running = True
+            self.overlay_thread = threading.Thread(target=self._draw_loop, daemon=True, name="overlay")
+            self.overlay_thread.start()
+
+    def stop(self):
+        """Detiene el overlay y libera el pool de objetos GDI"""
+        self.running = False
+        with self._lock:
+            self.highlights.clear()
+        self._changed.set()
+        if self.overlay_thread and self.overlay_thread is not threading.current_thread():
+            self.overlay_thread.join(timeout=1.0)
+        self._clear_overlay()
+        self._release_pool()
+
+    def set_highlight(self, x: int, y: int, width: int, height: int, color: Union[int, str] = GREEN):
+        """Establece el rectángulo a resaltar"""
+        with self._lock:
+            self.highlights[PRIMARY] = Highlight((x, y, width, height), resolve_color(color), self.border_width)
+        self._changed.set()
+
+    def highlight_many(self, items: Iterable[Dict], replace: bool = True) -> List[str]:
+        """Agrega (o reemplaza) un lote de resaltados.
+        Cada item: {id?, x, y, width, height, color?, label?, borderWidth?}.
+        Devuelve los ids asignados."""
+        ids = []
+        with self._lock:
+            if replace:
+                primary = self.highlights.get(PRIMARY)
+                self.highlights.clear()
+                if primary:
+                    self.highlights[PRIMARY] = primary
+            for item in items:
+                hid = item.get("id")
+                if hid is None:
+                    hid = f"h{self._next_id}"
+                    self._next_id += 1
+                hid = str(hid)
+                self.highlights[hid] = Highlight(
+                    (item.get("x", 0), item.get("y", 0), item.get("width", 100), item.get("height", 100)),
+                    resolve_color(item.get("color", "green")),
+                    item.get("borderWidth", self.border_width),
+                    item.get("label")
+                )
+                ids.append(hid)
+        self._changed.set()
+        return ids
+
+    def update_highlight(self, highlight_id: str, **fields) -> bool:
+        """Modifica campos de un resaltado (x, y, width, height, color, label, borderWidth)"""
+        with self._lock:
+            current = self.highlights.get(str(highlight_id))
+            if current is None:
+                return False
+            x, y, w, h = current.rect
+            self.highlights[str(highlight_id)] = Highlight(
+                (fields.get("x", x), fields.get("y", y), fields.get("width", w), fields.get("height", h)),
+                resolve_color(fields["color"]) if "color" in fields else current.color,
+                fields.get("borderWidth", current.width),
+                fields.get("label", current.label)
+            )
+        self._changed.set()
+        return True
+
+    @contextmanager
+    def hidden_for_capture(self, rect: Tuple[int, int, int, int]):
+        """Quita el resaltado principal mientras se captura `rect` (x, y,
+        ancho, alto) si lo pisa y la ventana no está excluida de las capturas.
+        Espera a que deje de verse y al salir lo repone si nadie lo cambió."""
+        with self._lock:
+            primary = self.highlights.get(PRIMARY)
+            hide = (self.running and primary is not None and not self.excluded_from_capture
+                    and _overlaps(primary.rect, primary.width, rect))
+            if hide:
+                del self.highlights[PRIMARY]
+                self._version += 1
+                version = self._version
+        if not hide:
+            yield
+            return
+        self._changed.set()
+        with self._shown:
+            self._shown.wait_for(lambda: self._shown_version >= version, CAPTURE_HIDE_TIMEOUT)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self.running and PRIMARY not in self.highlights:
+                    self.highlights[PRIMARY] = primary
+            self._changed.set()
+
+    def _mark_shown(self, version: int):
+        with self._shown:
+            if version > self._shown_version:
+                self._shown_version = version
+                self._shown.notify_all()
+
+    def remove_highlight(self, highlight_id: str) -> bool:
+        """Quita un resaltado; el hilo de dibujo actualiza su área"""
+        with self._lock:
+            removed = self.highlights.pop(str(highlight_id), None) is not None
+        if removed:
+            self._changed.set()
+        return removed
+
+    def clear(self):
+        """Limpia todos los resaltados"""
+        with self._lock:
+            self.highlights.clear()
+        self._changed.set()
+        self._clear_overlay()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = len(self.highlights)
+        return {
+            "mode": self.mode,
+            "running": self.running,
+            "highlights": count,
+            "frames": self.frames,
+            "updates": self.updates,
+            "desktopInvalidations": self.invalidations,
+            "pens": len(self._pens),
+            "penEvictions": self.pen_evictions
+        }
+
+    def resource_stats(self) -> Dict:
+        """Recursos GDI adquiridos vs liberados; `live*` debe volver a 0 tras stop()"""
+        counts = dict(self.gdi_counts)
+        return {
+            **counts,
+            "liveDcs": counts["dcsAcquired"] - counts["dcsReleased"],
+            "liveObjects": counts["objectsCreated"] - counts["objectsDeleted"],
+            "liveSurfaces": counts["surfacesCreated"] - counts["surfacesClosed"]
+        }
+
+    def _clear_overlay(self):
+        """Limpia el overlay. En modo layered lo hace el hilo de la ventana
+        (ocultarla); en modo desktop se fuerza el redibujado del escritorio"""
+        if self.mode == LAYERED:
+            return
+        try:
+            self.invalidations += 1
+            self.gdi.invalidate_rect(None)
+            self.gdi.update_desktop()
+        except Exception as e:
+            self.metrics.error("overlay.invalidate", e)
+
+    def _draw_loop(self):
+        """Loop principal: ventana retenida o, si no se puede crear, el DC del escritorio"""
+        surface = None
+        if self.mode == LAYERED:
+            try:
+                surface = self.windows.create_surface()
+                self.gdi_counts["surfacesCreated"] += 1
+                self.excluded_from_capture = surface.excluded_from_capture
+            except Exception as e:
+                self.metrics.error("overlay.surface", e)
+                self.mode = DESKTOP
+        if surface is None:
+            self._desktop_loop()
+            return
+        try:
+            self._layered_loop(surface)
+        finally:
+            self.excluded_from_capture = False
+            try:
+                surface.close()
+                self.gdi_counts["surfacesClosed"] += 1
+            except Exception as e:
+                self.metrics.error("overlay.surface", e)
+
+    def _layered_loop(self, surface: OverlaySurface):
+        """Publica el conjunto de resaltados solo cuando cambia"""
+        last: Tuple = ()
+
+        while self.running:
+            self._changed.wait(PUMP_INTERVAL)
+            self._changed.clear()
+            try:
+                surface.pump()
+                with self._lock:
+                    current = tuple(h.snapshot() for h in self.highlights.values())
+                    version = self._version
+                if current != last:
+                    with self.metrics.time("overlay.update"):
+                        self._present(surface, current)
+                    last = current
+                self._mark_shown(version)
+            except Exception as e:
+                self.metrics.error("overlay.update", e)
+                time.sleep(0.1)
+        try:
+            surface.hide()
+        except Exception as e:
+            self.metrics.error("overlay.update", e)
+
+    def _present(self, surface: OverlaySurface, items: Tuple):
+        """Una actualización de la ventana: todos los resaltados, o ocultarla"""
+        self.updates += 1
+        if not items:
+            surface.hide()
+            return
+        left = top = right = bottom = None
+        for (x, y, width, height), _, border, label in items:
+            margin = (border or self.border_width) + 2
+            item_left, item_right = x - margin, x + width + margin
+            item_top, item_bottom = y - margin, y + height + margin
+            if label:
+                item_top = min(item_top, y - LABEL_HEIGHT if y >= LABEL_HEIGHT else y + 2)
+                item_right = max(item_right, x + len(str(label)) * LABEL_CHAR_WIDTH)
+            left = item_left if left is None else min(left, item_left)
+            top = item_top if top is None else min(top, item_top)
+            right = item_right if right is None else max(right, item_right)
+            bottom = item_bottom if bottom is None else max(bottom, item_bottom)
+        hdc = surface.begin(left, top, right, bottom)
+        self._draw_items(hdc, items, surface.color_key)
+        surface.present()
+
+    def _desktop_loop(self):
+        """Redibuja en el DC del escritorio a ~30 FPS (otras ventanas pintan encima)"""
+        last: Dict[str, Tuple] = {}
+
+        while self.running:
+            try:
+                with self._lock:
+                    current = {hid: h.snapshot() for hid, h in self.highlights.items()}
+                    version = self._version
+
+                # Limpiar los resaltados que cambiaron o desaparecieron
+                for hid, previous in last.items():
+                    now = current.get(hid)
+                    if now is None or now[0] != previous[0] or now[2:] != previous[2:]:
+                        self._invalidate_rect(previous[0], previous[2], bool(previous[3]))
+
+                if current:
+                    with self.metrics.time("overlay.frame"):
+                        self._draw_all(current.values())
+                    self.frames += 1
+                last = current
+                self._mark_shown(version)
+
+                time.sleep(0.033)  # ~30 FPS
+
+            except Exception as e:
+                self.metrics.error("overlay.frame", e)
+                time.sleep(0.1)
+
+    def _draw_all(self, items: Iterable[Tuple]):
+        """Dibuja todos los resaltados con una sola adquisición de DC"""
+        gdi = self.gdi
+        try:
+            # Obtener DC del escritorio
+            hdc = gdi.get_dc()
+            if not hdc:
+                self.metrics.error("overlay.get_dc")
+                return
+        except Exception as e:
+            self.metrics.error("overlay.get_dc", e)
+            return
+        self.gdi_counts["dcsAcquired"] += 1
+
+        try:
+            self._draw_items(hdc, items)
+        except Exception as e:
+            self.metrics.error("overlay.draw", e)
+        finally:
+            # Liberar DC
+            try:
+                gdi.release_dc(hdc)
+                self.gdi_counts["dcsReleased"] += 1
+            except Exception as e:
+                self.metrics.error("overlay.release", e)
+
+    def _draw_items(self, hdc: int, items: Iterable[Tuple], color_key: Optional[int] = None):
+        """Dibuja los resaltados en `hdc`. Un color igual a `color_key` (el
+        transparente de la ventana retenida) se desplaza para seguir visible."""
+        gdi = self.gdi
+        old_brush = gdi.select_object(hdc, self._brush())
+        old_pen = None
+        try:
+            for (x, y, width, height), color, border, label in items:
+                if color == color_key:
+                    color ^= 1
+                previous = gdi.select_object(hdc, self._pen(color, border))
+                if old_pen is None:
+                    old_pen = previous
+                gdi.rectangle(hdc, x, y, x + width, y + height)
+                if label:
+                    text_y = y - LABEL_HEIGHT if y >= LABEL_HEIGHT else y + 2
+                    gdi.draw_text(hdc, x, text_y, str(label), color)
+        finally:
+            # Restaurar objetos anteriores también si falló el dibujo: un pen
+            # del pool seleccionado en un DC no se puede borrar después
+            if old_pen is not None:
+                gdi.select_object(hdc, old_pen)
+            gdi.select_object(hdc, old_brush)
+
+    def _pen(self, color: int, width: int) -> int:
+        """Pen del pool para (color, ancho); se crea la primera vez.
+
+        El pool es LRU de PEN_POOL_SIZE: el desalojado no puede estar
+        seleccionado en el DC (solo lo está el del item anterior, que es el
+        más reciente), así que se borra en el momento.
+        """
+        key = (color, width)
+        pen = self._pens.get(key)
+        if pen is not None:
+            self._pens.move_to_end(key)
+            return pen
+        pen = self.gdi.create_pen(self.gdi.PS_SOLID, width, color)
+        if not pen:
+            raise OSError(f"CreatePen falló (color {color:#08x}, ancho {width})")
+        self.gdi_counts["objectsCreated"] += 1
+        self._pens[key] = pen
+        if len(self._pens) > PEN_POOL_SIZE:
+            _, evicted = self._pens.popitem(last=False)
+            self.pen_evictions += 1
+            self._delete_pen(evicted)
+        return pen
+
+    def _brush(self) -> int:
+        if self._null_brush is None:
+            self._null_brush = self.gdi.get_null_brush()
+        return self._null_brush
+
+    def _release_pool(self):
+        """Libera los pens del pool (los stock objects no se liberan)"""
+        pens, self._pens = self._pens, OrderedDict()
+        for pen in pens.values():
+            self._delete_pen(pen)
+
+    def _delete_pen(self, pen: int):
+        try:
+            self.gdi.delete_object(pen)
+            self.gdi_counts["objectsDeleted"] += 1
+        except Exception as e:
+            self.metrics.error("overlay.release", e)
+
+    def _invalidate_rect(self, rect: Tuple[int, int, int, int], border: int = None, label: bool = False):
+        """Invalida un área para que se redibuje"""
+        try:
+            x, y, w, h = rect
+            margin = (border or self.border_width) + 2
+            top = y - margin - (LABEL_HEIGHT if label else 0)
+            self.gdi.invalidate_rect((
+                x - margin,
+                top,
+                x + w + margin,
+                y + h + margin
+            ))
+        except Exception as e:
+            self.metrics.error("overlay.invalidate", e)
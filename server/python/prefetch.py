@@ -0,0 +1,364 @@
+"""
+Prefetch - Resolución especulativa de elementos a partir de la trayectoria
+del cursor
+
+El hook de mouse solo guarda (instante, x, y) en un buffer circular. Un
+worker extrapola la trayectoria de las últimas muestras y resuelve por
+adelantado el elemento donde se espera que el cursor se detenga:
+
+    trajectory  en movimiento: si el cursor desacelera, el punto de parada
+                estimado (v² / 2a); si no, la posición a `horizon` segundos
+    rest        el cursor lleva `settle` segundos quieto: su posición actual
+                (la resolución se solapa con la espera de `hover_delay`)
+
+Los resultados van a un PrefetchBuffer pequeño y de vida corta que el hover
+consulta antes de llamar a UIA. Las consultas especulativas tienen un
+presupuesto por segundo (token bucket) y solo se lanzan si hay un worker de
+inspección libre; `hits`, `used` y `wasted` miden el acierto.
+"""
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from metrics import REGISTRY, StageMetrics
+
+PREDICTION_KINDS = ("trajectory", "rest")
+
+
+class _Prefetched:
+    __slots__ = ("left", "top", "right", "bottom", "area", "element", "context", "stored_at", "used")
+
+    def __init__(self, element: Dict, context: Hashable, stored_at: float):
+        bounds = element["bounds"]
+        self.left = bounds["x"]
+        self.top = bounds["y"]
+        self.right = bounds["x"] + bounds["width"]
+        self.bottom = bounds["y"] + bounds["height"]
+        self.area = max(1, bounds["width"] * bounds["height"])
+        self.element = element
+        self.context = context
+        self.stored_at = stored_at
+        self.used = False
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.left <= x < self.right and self.top <= y < self.bottom
+
+
+class PrefetchBuffer:
+    """Elementos hoja resueltos por adelantado (pocos y de vida corta).
+
+    Igual que HitTestCache solo sirve una entrada si su contexto (primer
+    plano y geometría) coincide y tiene los campos pedidos. Mientras una
+    resolución especulativa está en vuelo, una consulta a pocos píxeles de su
+    punto la espera (`join_timeout`) en lugar de duplicar la llamada a UIA.
+    """
+
+    def __init__(self, max_entries: int = 16, ttl: float = 0.5, join_radius: int = 4,
+                 join_timeout: float = 0.3):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.join_radius = join_radius
+        self.join_timeout = join_timeout
+        self._entries: List[_Prefetched] = []
+        self._inflight: Optional[Tuple[int, int, threading.Event]] = None
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.joined = 0
+        self.stored = 0
+        self.used = 0
+        self.wasted = 0
+
+    def lookup(self, x: int, y: int, context: Hashable, fields: frozenset) -> Optional[Dict]:
+        """Copia del elemento prefetcheado que contiene (x, y), o None"""
+        with self._lock:
+            self.lookups += 1
+            element = self._find_locked(x, y, context, fields, claim=True)
+            inflight = self._inflight
+        if element is not None or inflight is None:
+            return element
+        px, py, done = inflight
+        if abs(px - x) > self.join_radius or abs(py - y) > self.join_radius:
+            return None
+        # La resolución de este mismo punto ya está en vuelo: esperarla
+        done.wait(self.join_timeout)
+        with self._lock:
+            element = self._find_locked(x, y, context, fields, claim=True)
+            if element is not None:
+                self.joined += 1
+        return element
+
+    def covers(self, x: int, y: int, context: Hashable, fields: frozenset) -> bool:
+        """¿Ya hay una entrada válida para (x, y)? (sin contar como consulta)"""
+        with self._lock:
+            return self._find_locked(x, y, context, fields, claim=False) is not None
+
+    def begin(self, x: int, y: int) -> threading.Event:
+        """Marca una resolución especulativa en vuelo en (x, y)"""
+        done = threading.Event()
+        with self._lock:
+            self._inflight = (x, y, done)
+        return done
+
+    def end(self, done: threading.Event):
+        with self._lock:
+            if self._inflight is not None and self._inflight[2] is done:
+                self._inflight = None
+        done.set()
+
+    def store(self, element: Dict, context: Hashable):
+        bounds = element.get("bounds")
+        if not bounds or bounds["width"] <= 0 or bounds["height"] <= 0:
+            return
+        entry = _Prefetched(element, context, time.monotonic())
+        with self._lock:
+            self.stored += 1
+            # Una resolución nueva del mismo rectángulo reemplaza a la anterior
+            for old in [e for e in self._entries if (e.left, e.top, e.right, e.bottom)
+                        == (entry.left, entry.top, entry.right, entry.bottom)]:
+                self._drop_locked(old)
+            self._entries.append(entry)
+            while len(self._entries) > self.max_entries:
+                self._drop_locked(self._entries[0])
+
+    def clear(self):
+        with self._lock:
+            for entry in list(self._entries):
+                self._drop_locked(entry)
+
+    def _find_locked(self, x: int, y: int, context: Hashable, fields: frozenset,
+                     claim: bool) -> Optional[Dict]:
+        now = time.monotonic()
+        best = None
+        for entry in list(self._entries):
+            if now - entry.stored_at > self.ttl or entry.context != context:
+                self._drop_locked(entry)
+                continue
+            if entry.contains(x, y) and entry.element.keys() >= fields and (
+                    best is None or entry.area <= best.area):
+                best = entry
+        if best is None:
+            return None
+        if claim:
+            self.hits += 1
+            if not best.used:
+                best.used = True
+                self.used += 1
+        return {key: best.element[key] for key in best.element if key in fields}
+
+    def _drop_locked(self, entry: _Prefetched):
+        self._entries.remove(entry)
+        if not entry.used:
+            self.wasted += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hitRate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "joined": self.joined,
+                "stored": self.stored,
+                "used": self.used,
+                "wasted": self.wasted
+            }
+
+
+class TrajectoryPrefetcher:
+    """Predice el punto de llegada del cursor y lo resuelve en segundo plano.
+
+    `resolve(x, y)` devuelve (elemento hoja | None, contexto) y
+    `covered(x, y)` indica si la caché de hit-test o el buffer ya tienen el
+    punto.
+    `has_capacity()` (opcional) dice si hay un worker de inspección libre.
+    """
+
+    def __init__(self, resolve: Callable[[int, int], Tuple[Optional[Dict], Hashable]],
+                 covered: Callable[[int, int], bool], buffer: PrefetchBuffer = None,
+                 budget: float = 20.0, horizon: float = 0.05, window: float = 0.06,
+                 settle: float = 0.02, min_speed: float = 150.0, max_distance: int = 400,
+                 interval: float = 0.015, has_capacity: Callable[[], bool] = None,
+                 init_thread: Callable[[], None] = None, uninit_thread: Callable[[], None] = None,
+                 metrics: StageMetrics = None):
+        self.resolve = resolve
+        self.covered = covered
+        self.buffer = buffer or PrefetchBuffer()
+        self.budget = max(0.0, float(budget))
+        self.horizon = float(horizon)
+        self.window = float(window)
+        self.settle = float(settle)
+        self.min_speed = float(min_speed)
+        self.max_distance = int(max_distance)
+        self.interval = float(interval)
+        self.has_capacity = has_capacity
+        self.init_thread = init_thread
+        self.uninit_thread = uninit_thread
+        self.metrics = metrics or REGISTRY
+        # (t, x, y) del hook; deque acotada: append atómico sin lock
+        self._samples: deque = deque(maxlen=16)
+        self._wake = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._tokens = self._capacity()
+        self._refilled = time.monotonic()
+        self._unusable_at: Optional[Tuple[int, int]] = None  # último punto sin hoja
+
+        self.samples = 0
+        self.predictions = {kind: 0 for kind in PREDICTION_KINDS}
+        self.issued = 0
+        self.skipped = {"budget": 0, "busy": 0, "covered": 0, "repeat": 0}
+        self.unusable = 0
+        self.errors = 0
+
+    # -- Hilo del hook --
+
+    def on_move(self, x: int, y: int):
+        self._samples.append((time.perf_counter(), x, y))
+        self.samples += 1
+        if not self._wake.is_set():
+            self._wake.set()
+
+    # -- Ciclo de vida --
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._worker_loop, daemon=True, name="prefetch-worker")
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        self._running = False
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=timeout)
+        self.buffer.clear()
+
+    # -- Worker --
+
+    def _worker_loop(self):
+        if self.init_thread:
+            self.init_thread()
+        resting = False  # hay movimiento sin predicción de reposo todavía
+        last_prediction = 0.0
+        try:
+            while self._running:
+                woke = self._wake.wait(self.settle if resting else None)
+                if not self._running:
+                    break
+                if not woke:
+                    # Sin movimiento durante `settle`: el cursor reposa
+                    resting = False
+                    samples = list(self._samples)
+                    if samples:
+                        self._predicted("rest", samples[-1][1], samples[-1][2])
+                    continue
+                self._wake.clear()
+                resting = True
+                now = time.perf_counter()
+                if now - last_prediction < self.interval:
+                    continue
+                last_prediction = now
+                target = self._extrapolate(list(self._samples))
+                if target is not None:
+                    self._predicted("trajectory", *target)
+        finally:
+            if self.uninit_thread:
+                self.uninit_thread()
+
+    def _extrapolate(self, samples: List[Tuple[float, int, int]]) -> Optional[Tuple[int, int]]:
+        """Punto de llegada estimado, o None si el cursor va lento (lo cubre `rest`)"""
+        if len(samples) < 3:
+            return None
+        last_t = samples[-1][0]
+        recent = [s for s in samples if last_t - s[0] <= self.window]
+        if len(recent) < 3:
+            return None
+        (t0, x0, y0), (t1, x1, y1), (t2, x2, y2) = recent[0], recent[len(recent) // 2], recent[-1]
+        dt = t2 - t0
+        if dt <= 0:
+            return None
+        vx, vy = (x2 - x0) / dt, (y2 - y0) / dt
+        speed = math.hypot(vx, vy)
+        if speed < self.min_speed:
+            return None
+
+        distance = speed * self.horizon
+        d1, d2 = t1 - t0, t2 - t1
+        if d1 > 0 and d2 > 0:
+            s1 = math.hypot(x1 - x0, y1 - y0) / d1
+            s2 = math.hypot(x2 - x1, y2 - y1) / d2
+            accel = (s2 - s1) / ((d1 + d2) / 2)
+            if accel < 0:
+                # Desacelerando: distancia de frenado con deceleración constante
+                distance = min(distance * 4, s2 * s2 / (-2 * accel))
+        distance = min(distance, self.max_distance)
+        return int(round(x2 + vx / speed * distance)), int(round(y2 + vy / speed * distance))
+
+    def _capacity(self) -> float:
+        return max(1.0, self.budget / 5)
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self._capacity(), self._tokens + (now - self._refilled) * self.budget)
+        self._refilled = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def _predicted(self, kind: str, x: int, y: int):
+        self.predictions[kind] += 1
+        if self._unusable_at == (x, y):
+            self.skipped["repeat"] += 1
+            return
+        try:
+            if self.covered(x, y):
+                self.skipped["covered"] += 1
+                return
+        except Exception as e:
+            self.errors += 1
+            self.metrics.error("prefetch.resolve", e)
+            return
+        if self.has_capacity is not None and not self.has_capacity():
+            self.skipped["busy"] += 1
+            return
+        if not self._take_token():
+            self.skipped["budget"] += 1
+            return
+
+        self._unusable_at = None
+        self.issued += 1
+        done = self.buffer.begin(x, y)
+        try:
+            with self.metrics.time("prefetch.resolve"):
+                element, context = self.resolve(x, y)
+            if element is None:
+                # Contenedor o nada bajo el punto: no se puede servir por rectángulo
+                self.unusable += 1
+                self._unusable_at = (x, y)
+            else:
+                self.buffer.store(element, context)
+        except Exception:
+            # Contado por metrics.time en prefetch.resolve
+            self.errors += 1
+        finally:
+            self.buffer.end(done)
+
+    def stats(self) -> Dict:
+        buffer = self.buffer.stats()
+        return {
+            "active": self._thread is not None,
+            "budgetPerSecond": self.budget,
+            "samples": self.samples,
+            "predictions": dict(self.predictions),
+            "issued": self.issued,
+            "skipped": dict(self.skipped),
+            "unusable": self.unusable,
+            "errors": self.errors,
+            "usefulRate": round(buffer["used"] / self.issued, 4) if self.issued else 0.0,
+            "buffer": buffer
+        }
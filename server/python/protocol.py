@@ -0,0 +1,417 @@
+"""
+Protocolo de salida - Escribe los eventos del servicio en stdout
+
+Modos (se negocian en el handshake: `ready` anuncia `protocols` y el comando
+`start` elige uno con `protocol`; el evento `tracking_started` se escribe en el
+modo anterior y todo lo que sigue usa el modo nuevo):
+
+- "json":   una línea JSON por evento (modo por defecto)
+- "binary": frames con prefijo de longitud que agrupan varios eventos escritos
+            dentro de una ventana corta (`batch_window`)
+
+Frame binario:  u32 BE longitud del payload | payload = secuencia de registros
+Registro JSON:  u8 0x01 | u32 LE longitud | JSON UTF-8
+Registro hover: u8 0x02 | i32 LE x, y, bounds.x, bounds.y, bounds.width,
+                bounds.height | u8 flags (bit0 isEnabled, bit1 isVisible,
+                bit2 isInteractive) | 7 cadenas (name, type, controlType,
+                className, automationId, value, parentName), cada una
+                u16 LE longitud (0xFFFF = null, 0xFFFE = campo ausente) + UTF-8
+Registro hover con identidad: u8 0x03 | igual que 0x02 + cadena elementId
+Los campos de texto no resueltos (niveles de detalle) van como ausentes.
+Los hover con una forma distinta a la estándar se envían como registro JSON.
+
+Escritura: los productores (hook del mouse, hilo de hover, comandos) solo
+encolan; un hilo escritor dedicado codifica y escribe. Si el lector del pipe
+va lento, los hover que se quedan viejos en la cola se descartan (el último
+gana) y el resto de eventos espera su turno sin perderse.
+"""
+import json
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+
+from metrics import REGISTRY, StageMetrics
+
+PROTOCOLS = ("json", "binary")
+
+# Eventos de hover: "el último gana" cuando la salida se atasca
+_HOVER_EVENTS = frozenset(("hover", "hover_update"))
+
+RECORD_JSON = 0x01
+RECORD_HOVER = 0x02
+RECORD_HOVER_ID = 0x03
+
+_FRAME_HEADER = struct.Struct(">I")
+_JSON_HEADER = struct.Struct("<BI")
+_HOVER_HEADER = struct.Struct("<BiiiiiiB")
+_STR_LEN = struct.Struct("<H")
+_NULL_STR = 0xFFFF
+_ABSENT_STR = 0xFFFE
+
+_HOVER_KEYS = frozenset(("event", "x", "y", "element"))
+_ELEMENT_KEYS = frozenset((
+    "name", "type", "controlType", "className", "automationId", "value",
+    "isEnabled", "isVisible", "isInteractive", "bounds", "parentName"
+))
+_ELEMENT_ID_KEYS = _ELEMENT_KEYS | {"elementId"}
+_ELEMENT_REQUIRED = frozenset(("isEnabled", "isVisible", "isInteractive", "bounds"))
+_ELEMENT_STRINGS = ("name", "type", "controlType", "className", "automationId", "value", "parentName")
+_ELEMENT_ID_STRINGS = _ELEMENT_STRINGS + ("elementId",)
+_BOUNDS_KEYS = frozenset(("x", "y", "width", "height"))
+
+
+def _encode_hover(event: Dict) -> Optional[bytes]:
+    """Codifica un hover estándar con struct fijo; None si no tiene la forma esperada"""
+    if event.keys() != _HOVER_KEYS:
+        return None
+    element = event["element"]
+    if not isinstance(element, dict):
+        return None
+    keys = element.keys()
+    if not (keys <= _ELEMENT_ID_KEYS and keys >= _ELEMENT_REQUIRED):
+        return None
+    if "elementId" in keys:
+        kind, string_keys = RECORD_HOVER_ID, _ELEMENT_ID_STRINGS
+    else:
+        kind, string_keys = RECORD_HOVER, _ELEMENT_STRINGS
+    bounds = element["bounds"]
+    if not isinstance(bounds, dict) or bounds.keys() != _BOUNDS_KEYS:
+        return None
+
+    flags = 0
+    for bit, key in enumerate(("isEnabled", "isVisible", "isInteractive")):
+        value = element[key]
+        if not isinstance(value, bool):
+            return None
+        if value:
+            flags |= 1 << bit
+
+    try:
+        parts = [_HOVER_HEADER.pack(
+            kind, event["x"], event["y"],
+            bounds["x"], bounds["y"], bounds["width"], bounds["height"], flags
+        )]
+    except (struct.error, TypeError):
+        return None
+
+    for key in string_keys:
+        if key not in element:
+            parts.append(_STR_LEN.pack(_ABSENT_STR))
+            continue
+        value = element[key]
+        if value is None:
+            parts.append(_STR_LEN.pack(_NULL_STR))
+            continue
+        if not isinstance(value, str):
+            return None
+        raw = value.encode("utf-8")
+        if len(raw) >= _ABSENT_STR:
+            return None
+        parts.append(_STR_LEN.pack(len(raw)))
+        parts.append(raw)
+    return b"".join(parts)
+
+
+def encode_record(event: Dict) -> bytes:
+    """Codifica un evento como registro binario"""
+    if event.get("event") == "hover":
+        encoded = _encode_hover(event)
+        if encoded is not None:
+            return encoded
+    raw = json.dumps(event, separators=(",", ":")).encode("utf-8")
+    return _JSON_HEADER.pack(RECORD_JSON, len(raw)) + raw
+
+
+def decode_records(payload: bytes) -> Iterator[Dict]:
+    """Decodifica los registros de un payload (inverso de encode_record)"""
+    offset = 0
+    view = memoryview(payload)
+    while offset < len(payload):
+        kind = payload[offset]
+        if kind == RECORD_JSON:
+            _, length = _JSON_HEADER.unpack_from(payload, offset)
+            offset += _JSON_HEADER.size
+            yield json.loads(bytes(view[offset:offset + length]).decode("utf-8"))
+            offset += length
+        elif kind == RECORD_HOVER or kind == RECORD_HOVER_ID:
+            _, x, y, bx, by, bw, bh, flags = _HOVER_HEADER.unpack_from(payload, offset)
+            offset += _HOVER_HEADER.size
+            strings = {}
+            for key in (_ELEMENT_ID_STRINGS if kind == RECORD_HOVER_ID else _ELEMENT_STRINGS):
+                (length,) = _STR_LEN.unpack_from(payload, offset)
+                offset += _STR_LEN.size
+                if length == _ABSENT_STR:
+                    continue
+                if length == _NULL_STR:
+                    strings[key] = None
+                else:
+                    strings[key] = bytes(view[offset:offset + length]).decode("utf-8")
+                    offset += length
+            element = {}
+            for key in ("name", "type", "controlType", "className", "automationId", "value"):
+                if key in strings:
+                    element[key] = strings[key]
+            element["isEnabled"] = bool(flags & 1)
+            element["isVisible"] = bool(flags & 2)
+            element["isInteractive"] = bool(flags & 4)
+            element["bounds"] = {"x": bx, "y": by, "width": bw, "height": bh}
+            for key in ("parentName", "elementId"):
+                if key in strings:
+                    element[key] = strings[key]
+            yield {"event": "hover", "x": x, "y": y, "element": element}
+        else:
+            raise ValueError(f"Tipo de registro desconocido: {kind}")
+
+
+def decode_frames(data: bytes) -> List[Dict]:
+    """Decodifica una secuencia completa de frames"""
+    events = []
+    offset = 0
+    while offset < len(data):
+        (length,) = _FRAME_HEADER.unpack_from(data, offset)
+        offset += _FRAME_HEADER.size
+        events.extend(decode_records(data[offset:offset + length]))
+        offset += length
+    return events
+
+
+class EventWriter:
+    """Escritor de eventos hacia stdout (o el stream indicado).
+
+    `emit` nunca hace E/S: encola el evento y vuelve, así el hook del mouse,
+    el hilo de hover y el bucle de comandos no se bloquean aunque el lector
+    del pipe vaya lento. Un único hilo escritor vacía la cola en orden.
+
+    Las respuestas, clics y demás eventos nunca se descartan. Los hover son
+    "el último gana": si al llegar uno nuevo el anterior sigue en cola (el
+    pipe está atascado), el viejo se descarta o se fusiona con el nuevo
+    (`coalesced` cuenta los descartados).
+
+    En modo binario el escritor agrupa los eventos de `batch_window` en un
+    frame; `emit(..., flush=True)` (respuestas a comandos, clics) lo escribe
+    sin esperar la ventana, conservando el orden.
+    """
+
+    def __init__(self, stream=None, mode: str = "json", batch_window: float = 0.005,
+                 max_batch_bytes: int = 64 * 1024, coalesce_hovers: bool = True,
+                 metrics: StageMetrics = None):
+        if mode not in PROTOCOLS:
+            raise ValueError(f"Protocolo desconocido: {mode}")
+        self._stream = stream
+        # `mode` es el protocolo pedido; `_write_mode` el que usa el escritor
+        # (cambia al llegarle el marcador de set_mode)
+        self.mode = mode
+        self._write_mode = mode
+        self.batch_window = batch_window
+        self.max_batch_bytes = max_batch_bytes
+        self.coalesce_hovers = coalesce_hovers
+        self.metrics = metrics or REGISTRY
+        self._cond = threading.Condition()
+        # Entradas [evento | None si se descartó, flush, t_encolado, modo_siguiente]
+        self._queue: deque = deque()
+        self._hover: Optional[list] = None   # último hover aún en cola
+        self._urgent = False
+        self._busy = False
+        self._closed = False
+        self._broken = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.events_written = 0
+        self.bytes_written = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_queued = 0
+
+    @property
+    def stream(self):
+        # Resolver sys.stdout en cada uso permite redirigirlo (benchmarks)
+        return self._stream if self._stream is not None else sys.stdout
+
+    def emit(self, event: Dict, flush: bool = False):
+        """Encola un evento (no bloquea por E/S)"""
+        with self._cond:
+            if self._closed or self._broken:
+                self.dropped += 1
+                return
+            entry = [event, flush, time.perf_counter(), None]
+            if self.coalesce_hovers and event.get("event") in _HOVER_EVENTS:
+                self._coalesce_locked(entry)
+            self._enqueue_locked(entry)
+
+    def set_mode(self, mode: str, announce: Optional[Dict] = None):
+        """Cambia de protocolo; `announce` se escribe en el modo anterior"""
+        if mode not in PROTOCOLS:
+            raise ValueError(f"Protocolo desconocido: {mode}")
+        with self._cond:
+            if self._closed or self._broken:
+                self.mode = mode
+                return
+            self._enqueue_locked([announce, True, time.perf_counter(), mode])
+            self.mode = mode
+
+    def flush(self, timeout: float = None) -> bool:
+        """Espera a que el escritor vacíe la cola; False si vence `timeout`"""
+        with self._cond:
+            if self._thread is threading.current_thread():
+                return False
+            self._urgent = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: (not self._queue and not self._busy) or self._thread is None, timeout
+            )
+
+    def close(self, timeout: float = 2.0):
+        """Escribe lo pendiente y termina el hilo escritor; después se descarta todo"""
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "protocol": self.mode,
+                "events": self.events_written,
+                "bytes": self.bytes_written,
+                "writes": self.writes,
+                "queued": len(self._queue),
+                "maxQueued": self.max_queued,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped
+            }
+
+    # -- Productores --
+
+    def _enqueue_locked(self, entry: list):
+        self._queue.append(entry)
+        if len(self._queue) > self.max_queued:
+            self.max_queued = len(self._queue)
+        if entry[1]:
+            self._urgent = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer_loop, daemon=True, name="event-writer")
+            self._thread.start()
+        self._cond.notify_all()
+
+    def _coalesce_locked(self, entry: list):
+        """Descarta el hover anterior si sigue en cola; el nuevo va al final"""
+        pending, self._hover = self._hover, entry
+        if pending is None or pending[0] is None:
+            return
+        merged = _merge_hover(pending[0], entry[0])
+        if merged is not None:
+            pending[0] = None
+            entry[0] = merged
+            self.coalesced += 1
+
+    # -- Hilo escritor --
+
+    def _writer_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    self._thread = None
+                    self._cond.notify_all()
+                    return
+                if self._write_mode == "binary" and self.batch_window and not self._urgent:
+                    # Agrupar lo que llegue dentro de la ventana (o hasta un flush)
+                    self._cond.wait_for(lambda: self._urgent or self._closed, self.batch_window)
+                entries, self._queue = self._queue, deque()
+                # Los hover tomados ya no se pueden descartar desde emit
+                self._hover = None
+                self._urgent = False
+                self._busy = True
+            try:
+                self._write_entries(entries)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _write_entries(self, entries):
+        chunk = []
+        size = 0
+        mode = self._write_mode
+        for event, _, enqueued, next_mode in entries:
+            if event is not None:
+                started = time.perf_counter()
+                self.metrics.observe("output.queue", started - enqueued)
+                try:
+                    data = json.dumps(event) + "\n" if mode == "json" else encode_record(event)
+                except (TypeError, ValueError) as e:
+                    # Evento no serializable: se pierde él, no el escritor
+                    self.metrics.error("output.encode", e)
+                    with self._cond:
+                        self.dropped += 1
+                    data = None
+                if data is not None:
+                    self.metrics.observe("output.encode", time.perf_counter() - started)
+                    chunk.append(data)
+                    size += len(data)
+            if next_mode is not None or size >= self.max_batch_bytes:
+                self._write_chunk(mode, chunk, size)
+                chunk, size = [], 0
+            if next_mode is not None:
+                mode = self._write_mode = next_mode
+        self._write_chunk(mode, chunk, size)
+
+    def _write_chunk(self, mode: str, chunk: list, size: int):
+        if not chunk:
+            return
+        if self._broken:
+            with self._cond:
+                self.dropped += len(chunk)
+            return
+        started = time.perf_counter()
+        try:
+            stream = self.stream
+            if mode == "json":
+                stream.write("".join(chunk))
+                stream.flush()
+                written = size
+            else:
+                frame = _FRAME_HEADER.pack(size) + b"".join(chunk)
+                raw = getattr(stream, "buffer", None)
+                if raw is None:
+                    stream.write(frame)
+                    stream.flush()
+                else:
+                    stream.flush()
+                    raw.write(frame)
+                    raw.flush()
+                written = len(frame)
+        except (OSError, ValueError) as e:
+            # Pipe roto o stream cerrado: no tiene sentido seguir escribiendo
+            self.metrics.error("output.write", e)
+            with self._cond:
+                self._broken = True
+                self.dropped += len(chunk)
+            return
+        self.metrics.observe("output.write", time.perf_counter() - started)
+        with self._cond:
+            self.events_written += len(chunk)
+            self.bytes_written += written
+            self.writes += 1
+
+
+def _merge_hover(old: Dict, new: Dict) -> Optional[Dict]:
+    """Fusiona dos hover pendientes en uno equivalente al último; None si no
+    se pueden fusionar (un hover_update de otro elemento)"""
+    if new.get("event") == "hover":
+        return new
+    element_id = new.get("elementId")
+    if old.get("event") == "hover":
+        element = old.get("element")
+        if not isinstance(element, dict) or element_id is None or element.get("elementId") != element_id:
+            return None
+        return {**old, "x": new.get("x"), "y": new.get("y"),
+                "element": {**element, **(new.get("changes") or {})}}
+    if old.get("elementId") == element_id:
+        return {**new, "changes": {**(old.get("changes") or {}), **(new.get("changes") or {})}}
+    return None
@@ -0,0 +1,278 @@
+"""
+Session Log - Grabación de sesiones en disco con compresión por chunks
+
+Formato del archivo (.alqlog), solo se agrega al final:
+
+    cabecera   b"ALQLOG1\\n"
+    chunk*     _CHUNK_HEADER (marca, t_inicio, t_fin, eventos, bytes comprimidos,
+               bytes originales) + zlib(eventos JSON separados por "\\n")
+
+El índice de tiempo va en un archivo aparte (<ruta>.idx) con una entrada
+fija por chunk (offset, t_inicio, t_fin, eventos). Con él se puede buscar
+por tiempo y leer un rango descomprimiendo solo los chunks que lo cubren.
+Si el índice falta (sesión cortada), se reconstruye recorriendo las
+cabeceras de los chunks sin descomprimir.
+
+SessionRecorder escribe desde un hilo propio: `record()` solo encola en una
+cola acotada (nunca bloquea los hilos de hook ni de hover) y la memoria no
+depende de la duración de la sesión: cola + un chunk en construcción.
+"""
+import json
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+MAGIC = b"ALQLOG1\n"
+_CHUNK_MARK = b"C"
+_CHUNK_HEADER = struct.Struct("<cddIII")
+_INDEX_ENTRY = struct.Struct("<QddI")
+
+# Eventos que se graban por defecto
+RECORDED_EVENTS = ("click", "hover", "hover_update", "element_captured", "type", "key", "shortcut")
+
+
+def default_path() -> str:
+    """Ruta de una sesión nueva en ALQVIMIA_SESSIONS_DIR (o el temporal)"""
+    directory = os.environ.get("ALQVIMIA_SESSIONS_DIR") or os.path.join(tempfile.gettempdir(), "alqvimia-sessions")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, datetime.now().strftime("session-%Y%m%d-%H%M%S.alqlog"))
+
+
+class SessionRecorder:
+    """Graba eventos en un .alqlog desde un hilo escritor.
+
+    Un chunk se cierra al llegar a `chunk_events` eventos, `chunk_bytes`
+    bytes sin comprimir o `chunk_seconds` desde su primer evento. Si la cola
+    se llena (disco lento) los eventos se descartan y se cuentan en `dropped`.
+    """
+
+    def __init__(self, path: str = None, chunk_events: int = 512, chunk_bytes: int = 256 * 1024,
+                 chunk_seconds: float = 2.0, max_queue: int = 10000, level: int = 6,
+                 event_types: Iterable[str] = RECORDED_EVENTS):
+        self.path = path or default_path()
+        self.chunk_events = max(1, int(chunk_events))
+        self.chunk_bytes = max(1024, int(chunk_bytes))
+        self.chunk_seconds = max(0.05, float(chunk_seconds))
+        self.level = level
+        self.event_types = frozenset(event_types) if event_types else None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._index = None
+        self.started_at: Optional[float] = None
+
+        self.events = 0
+        self.dropped = 0
+        self.chunks = 0
+        self.raw_bytes = 0
+        self.written_bytes = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        self._file = open(self.path, "ab")
+        if not exists:
+            self._file.write(MAGIC)
+            self._file.flush()
+        self._index = open(self.path + ".idx", "ab")
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True, name="session-writer")
+        self._thread.start()
+
+    def record(self, event: Dict, timestamp: float = None):
+        """Encola un evento (no bloquea: si la cola está llena se descarta)"""
+        if self._thread is None:
+            return
+        if self.event_types is not None and event.get("event") not in self.event_types:
+            return
+        try:
+            self._queue.put_nowait((timestamp if timestamp is not None else time.time(), event))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout: float = 5.0) -> Dict:
+        """Escribe lo pendiente, cierra el archivo y devuelve las estadísticas"""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            if thread is not threading.current_thread():
+                thread.join(timeout=timeout)
+        return self.stats()
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def _writer_loop(self):
+        lines: List[bytes] = []
+        size = 0
+        first = last = None
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = False
+
+                if item is None or item is False:
+                    if lines:
+                        self._write_chunk(lines, first, last)
+                        lines, size, first, last, deadline = [], 0, None, None, None
+                    if item is None:
+                        break
+                    continue
+
+                timestamp, event = item
+                try:
+                    line = json.dumps(dict(event, ts=round(timestamp, 6)), separators=(",", ":")).encode("utf-8")
+                except (TypeError, ValueError) as e:
+                    self._error(e)
+                    continue
+                if not lines:
+                    first = last = timestamp
+                    deadline = time.monotonic() + self.chunk_seconds
+                # Los hilos de clic y hover encolan con su propio instante:
+                # el rango del chunk cubre el mínimo y el máximo
+                first = min(first, timestamp)
+                last = max(last, timestamp)
+                lines.append(line)
+                size += len(line) + 1
+                self.events += 1
+
+                if len(lines) >= self.chunk_events or size >= self.chunk_bytes:
+                    self._write_chunk(lines, first, last)
+                    lines, size, first, last, deadline = [], 0, None, None, None
+        finally:
+            for handle in (self._file, self._index):
+                try:
+                    handle.close()
+                except Exception as e:
+                    self._error(e)
+
+    def _write_chunk(self, lines: List[bytes], first: float, last: float):
+        raw = b"\n".join(lines)
+        compressed = zlib.compress(raw, self.level)
+        try:
+            offset = self._file.tell()
+            self._file.write(_CHUNK_HEADER.pack(_CHUNK_MARK, first, last, len(lines), len(compressed), len(raw)))
+            self._file.write(compressed)
+            self._file.flush()
+            # El índice se escribe después del chunk: una entrada siempre apunta a datos completos
+            self._index.write(_INDEX_ENTRY.pack(offset, first, last, len(lines)))
+            self._index.flush()
+        except OSError as e:
+            self._error(e)
+            return
+        self.chunks += 1
+        self.raw_bytes += len(raw)
+        self.written_bytes += _CHUNK_HEADER.size + len(compressed)
+
+    def _error(self, exc: Exception):
+        self.errors += 1
+        self.last_error = f"{type(exc).__name__}: {exc}"
+
+    def stats(self) -> Dict:
+        return {
+            "path": self.path,
+            "active": self.active,
+            "events": self.events,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "chunks": self.chunks,
+            "rawBytes": self.raw_bytes,
+            "writtenBytes": self.written_bytes,
+            "ratio": round(self.raw_bytes / self.written_bytes, 2) if self.written_bytes else None,
+            "errors": self.errors,
+            "lastError": self.last_error
+        }
+
+
+class SessionReader:
+    """Lectura de un .alqlog por rango de tiempo usando el índice"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index = self._load_index()
+
+    def _load_index(self) -> List[tuple]:
+        """Entradas (offset, t_inicio, t_fin, eventos) ordenadas por offset"""
+        size = os.path.getsize(self.path)
+        entries = []
+        idx_path = self.path + ".idx"
+        if os.path.exists(idx_path):
+            with open(idx_path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % _INDEX_ENTRY.size
+            entries = [entry for entry in _INDEX_ENTRY.iter_unpack(data[:usable])]
+
+        # Chunks escritos después de la última entrada del índice (sesión cortada)
+        if entries:
+            offset, _, _, _ = entries[-1]
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                header = f.read(_CHUNK_HEADER.size)
+            resume = offset + _CHUNK_HEADER.size + _CHUNK_HEADER.unpack(header)[4]
+        else:
+            resume = len(MAGIC)
+        if resume < size:
+            entries.extend(self._scan(resume, size))
+        return entries
+
+    def _scan(self, offset: int, size: int) -> List[tuple]:
+        entries = []
+        with open(self.path, "rb") as f:
+            if offset == len(MAGIC):
+                f.seek(0)
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"No es un archivo de sesión: {self.path}")
+            while offset + _CHUNK_HEADER.size <= size:
+                f.seek(offset)
+                mark, first, last, count, compressed, _ = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+                end = offset + _CHUNK_HEADER.size + compressed
+                if mark != _CHUNK_MARK or end > size:
+                    break  # chunk incompleto al final
+                entries.append((offset, first, last, count))
+                offset = end
+        return entries
+
+    def info(self) -> Dict:
+        return {
+            "path": self.path,
+            "chunks": len(self.index),
+            "events": sum(entry[3] for entry in self.index),
+            "start": self.index[0][1] if self.index else None,
+            "end": max((entry[2] for entry in self.index), default=None),
+            "bytes": os.path.getsize(self.path)
+        }
+
+    def read(self, start: float = None, end: float = None, event_types: Iterable[str] = None,
+             limit: int = None) -> Iterator[Dict]:
+        """Eventos con start <= ts <= end, en orden de grabación"""
+        types = frozenset(event_types) if event_types else None
+        emitted = 0
+        with open(self.path, "rb") as f:
+            for offset, first, last, _ in self.index:
+                if (start is not None and last < start) or (end is not None and first > end):
+                    continue
+                f.seek(offset)
+                header = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+                for line in zlib.decompress(f.read(header[4])).split(b"\n"):
+                    event = json.loads(line)
+                    ts = event.get("ts", 0)
+                    if (start is not None and ts < start) or (end is not None and ts > end):
+                        continue
+                    if types is not None and event.get("event") not in types:
+                        continue
+                    yield event
+                    emitted += 1
+                    if limit is not None and emitted >= limit:
+                        return
@@ -0,0 +1,122 @@
+"""
+Startup - Mide el tiempo hasta `ready` y el costo de los imports
+
+Este módulo debe importarse antes que el resto de módulos del servicio: su
+instante de carga es el origen de las mediciones. Los imports diferidos se
+registran con record_import(); importtime_report() desglosa el arranque por
+módulo con `python -X importtime` en un subproceso.
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+T0 = time.perf_counter()
+
+_marks: Dict[str, float] = {}
+_imports: List[Dict] = []
+_lock = threading.Lock()
+_phase = threading.local()
+
+
+def mark(name: str):
+    """Registra un hito (p.ej. "ready") relativo a T0"""
+    with _lock:
+        _marks.setdefault(name, time.perf_counter() - T0)
+
+
+def elapsed_ms(name: str) -> Optional[float]:
+    with _lock:
+        value = _marks.get(name)
+    return round(value * 1000, 2) if value is not None else None
+
+
+@contextmanager
+def prewarming():
+    """Marca los imports del hilo actual como fase "prewarm" """
+    _phase.name = "prewarm"
+    try:
+        yield
+    finally:
+        _phase.name = None
+
+
+def record_import(module: str, seconds: float):
+    """Registra un import diferido (en demanda o por prewarm)"""
+    with _lock:
+        _imports.append({
+            "module": module,
+            "ms": round(seconds * 1000, 2),
+            "phase": getattr(_phase, "name", None) or "on-demand",
+            "atMs": round((time.perf_counter() - T0) * 1000, 2)
+        })
+
+
+def prewarm_in_background(callback) -> threading.Thread:
+    """Ejecuta `callback` (p.ej. backend.prewarm) en un hilo daemon"""
+    def run():
+        with prewarming():
+            try:
+                callback()
+            finally:
+                mark("prewarmed")
+
+    thread = threading.Thread(target=run, daemon=True, name="prewarm")
+    thread.start()
+    return thread
+
+
+def importtime_report(modules: Iterable[str], cwd: str = None, top: int = 25) -> List[Dict]:
+    """Ejecuta `python -X importtime` importando `modules` y devuelve los
+    módulos más costosos (tiempo propio y acumulado en ms)"""
+    code = "\n".join(
+        f"try:\n    import {name}\nexcept Exception:\n    pass" for name in modules
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, timeout=60, env=os.environ.copy()
+    )
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            rows.append({
+                "module": name.strip(),
+                "selfMs": round(int(self_us) / 1000, 2),
+                "cumulativeMs": round(int(cumulative_us) / 1000, 2),
+                "depth": max(0, len(name) - len(name.lstrip()) - 1) // 2
+            })
+        except ValueError:
+            continue
+
+    rows.sort(key=lambda r: r["cumulativeMs"], reverse=True)
+    return rows[:top]
+
+
+def report(heavy_modules: Iterable[str] = (), service_modules: Iterable[str] = (),
+           include_importtime: bool = True) -> Dict:
+    """Resumen de arranque para el comando startup_report"""
+    with _lock:
+        imports = list(_imports)
+    heavy_modules = list(heavy_modules)
+    loaded = {entry["module"] for entry in imports}
+
+    data = {
+        "event": "startup_report",
+        "timeToReadyMs": elapsed_ms("ready"),
+        "prewarmedAtMs": elapsed_ms("prewarmed"),
+        "deferredImports": imports,
+        "pendingModules": [m for m in heavy_modules if m not in loaded]
+    }
+    if include_importtime:
+        data["startupImports"] = importtime_report(service_modules)
+        if heavy_modules:
+            data["heavyImports"] = importtime_report(heavy_modules)
+    return data
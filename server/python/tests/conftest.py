@@ -0,0 +1,11 @@
+"""
+Pruebas de comportamiento - Se ejecutan contra el escritorio simulado o
+con fakes propios, sin Windows ni dependencias nativas.
+
+Uso:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
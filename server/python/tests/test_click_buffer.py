@@ -0,0 +1,105 @@
+"""
+Anillo de clics: políticas de desborde y lecturas con cursor
+"""
+import threading
+import time
+
+from click_buffer import BLOCK, DROP_NEWEST, DROP_OLDEST, ClickBuffer, ClickRecord
+
+
+def _fill(buffer: ClickBuffer, count: int):
+    return [buffer.push(ClickRecord(i, i, "left", 1000.0 + i, {"name": f"b{i}", "bounds": {
+        "x": i, "y": i, "width": 10, "height": 10}})) for i in range(count)]
+
+
+def test_drop_oldest_keeps_newest():
+    buffer = ClickBuffer(3, DROP_OLDEST)
+    assert all(_fill(buffer, 5))
+    assert [r.seq for r in buffer.drain()] == [2, 3, 4]
+    assert buffer.dropped == 2 and buffer.overflows == 2
+    assert len(buffer) == 0
+
+
+def test_drop_newest_rejects_incoming():
+    buffer = ClickBuffer(3, DROP_NEWEST)
+    assert _fill(buffer, 5) == [True, True, True, False, False]
+    assert [r.seq for r in buffer.drain()] == [0, 1, 2]
+    assert buffer.rejected == 2
+
+
+def test_block_waits_for_space():
+    buffer = ClickBuffer(2, BLOCK, block_timeout=2.0)
+    _fill(buffer, 2)
+    threading.Timer(0.05, lambda: buffer.drain(1)).start()
+    started = time.monotonic()
+    assert buffer.push(ClickRecord(9, 9, "left", 0.0, None))
+    assert 0.03 < time.monotonic() - started < 1.5
+    assert buffer.blocked_waits == 1
+
+
+def test_record_round_trip():
+    buffer = ClickBuffer(4)
+    buffer.push(ClickRecord(5, 6, "right", 1700000000.0, {
+        "name": "Aceptar", "type": "button", "bounds": {"x": 1, "y": 2, "width": 3, "height": 4}}))
+    event = buffer.drain()[0].to_event()
+    assert event["clickType"] == "right" and (event["x"], event["y"]) == (5, 6)
+    assert event["element"]["name"] == "Aceptar"
+    assert event["element"]["bounds"] == {"x": 1, "y": 2, "width": 3, "height": 4}
+    assert event["element"]["automationId"] is None
+
+
+def test_read_is_at_least_once_until_acknowledged():
+    buffer = ClickBuffer(8)
+    _fill(buffer, 3)
+    records, gap, start = buffer.read(0)
+    assert [r.seq for r in records] == [0, 1, 2] and gap == 0 and start == 0
+    # Respuesta perdida: el mismo cursor vuelve a traerlos
+    assert [r.seq for r in buffer.read(0)[0]] == [0, 1, 2]
+    records, _, start = buffer.read(2, max_items=5)
+    assert [r.seq for r in records] == [2] and start == 2
+    assert len(buffer) == 1
+
+
+def test_read_reports_gap_after_drop_oldest():
+    buffer = ClickBuffer(3)
+    _fill(buffer, 6)
+    records, gap, _ = buffer.read(0)
+    assert gap == 3
+    assert [r.seq for r in records] == [3, 4, 5]
+
+
+def test_one_reader_cannot_delete_anothers_unread():
+    buffer = ClickBuffer(8)
+    _fill(buffer, 4)
+    buffer.read(0, reader="a")
+    buffer.read(0, reader="b")
+    buffer.read(4, reader="a")
+    records, gap, _ = buffer.read(0, reader="b")
+    assert [r.seq for r in records] == [0, 1, 2, 3] and gap == 0
+    buffer.read(4, reader="b")
+    assert len(buffer) == 0
+
+
+def test_foreign_cursor_acknowledges_nothing():
+    buffer = ClickBuffer(8)
+    _fill(buffer, 3)
+    # Cursor de una sesión anterior (más allá del próximo seq)
+    records, gap, start = buffer.read(500)
+    assert [r.seq for r in records] == [0, 1, 2] and gap == 0 and start == 0
+    # Cursor válido en número pero de otra sesión
+    records, _, _ = buffer.read(3, session="otra")
+    assert [r.seq for r in records] == [0, 1, 2]
+    assert len(buffer) == 3
+    buffer.read(3, session=buffer.session)
+    assert len(buffer) == 0
+
+
+def test_release_stops_retaining():
+    buffer = ClickBuffer(8)
+    _fill(buffer, 2)
+    buffer.read(0, reader="a")
+    buffer.read(0, reader="b")
+    buffer.read(2, reader="a")
+    assert len(buffer) == 2
+    buffer.release("b")
+    assert len(buffer) == 0
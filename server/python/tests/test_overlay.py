@@ -0,0 +1,191 @@
+"""
+Overlay con un renderer falso que registra cada operación: cuántas
+actualizaciones de la ventana retenida y cuántos repintados del escritorio
+cuesta cada cambio de resaltados.
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from backends.base import GDIBackend, OverlaySurface, OverlayWindowBackend
+from overlay import LAYERED, PRIMARY, PUMP_INTERVAL, ElementOverlay
+
+
+class RecordingGDI(GDIBackend):
+    """GDI que solo anota las llamadas"""
+
+    def __init__(self):
+        self.calls = []
+        self._next = 100
+
+    def _handle(self) -> int:
+        self._next += 1
+        return self._next
+
+    def get_dc(self) -> int:
+        self.calls.append(("get_dc",))
+        return self._handle()
+
+    def release_dc(self, hdc: int):
+        self.calls.append(("release_dc", hdc))
+
+    def create_pen(self, style: int, width: int, color: int) -> int:
+        self.calls.append(("create_pen", width, color))
+        return self._handle()
+
+    def get_null_brush(self) -> int:
+        return 1
+
+    def select_object(self, hdc: int, obj: int) -> int:
+        return 0
+
+    def delete_object(self, obj: int):
+        self.calls.append(("delete_object", obj))
+
+    def rectangle(self, hdc: int, left: int, top: int, right: int, bottom: int):
+        self.calls.append(("rectangle", left, top, right, bottom))
+
+    def draw_text(self, hdc: int, x: int, y: int, text: str, color: int):
+        self.calls.append(("draw_text", text))
+
+    def invalidate_rect(self, rect=None):
+        self.calls.append(("invalidate_rect", rect))
+
+    def update_desktop(self):
+        self.calls.append(("update_desktop",))
+
+
+class RecordingSurface(OverlaySurface):
+    """Ventana retenida falsa: `updates` guarda ("present", área) o ("hide",)"""
+
+    color_key = 0
+
+    def __init__(self, excluded: bool = False):
+        self.updates = []
+        self.visible = False
+        self.closed = False
+        self.excluded_from_capture = excluded
+        self._area = None
+
+    def begin(self, left: int, top: int, right: int, bottom: int) -> int:
+        self._area = (left, top, right, bottom)
+        return 7
+
+    def present(self):
+        self.updates.append(("present", self._area))
+        self.visible = True
+
+    def hide(self):
+        if self.visible:
+            self.updates.append(("hide",))
+            self.visible = False
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingOverlayWindow(OverlayWindowBackend):
+    available = True
+
+    def __init__(self, excluded: bool = False):
+        self.excluded = excluded
+        self.surfaces = []
+
+    def create_surface(self) -> RecordingSurface:
+        surface = RecordingSurface(self.excluded)
+        self.surfaces.append(surface)
+        return surface
+
+
+def _wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("la condición no se cumplió a tiempo")
+        time.sleep(0.005)
+
+
+def _settle():
+    """Deja pasar un par de vueltas del hilo de render"""
+    time.sleep(PUMP_INTERVAL * 2.5)
+
+
+@pytest.fixture
+def overlay():
+    backend = SimpleNamespace(gdi=RecordingGDI(), overlay=RecordingOverlayWindow())
+    overlay = ElementOverlay(backend, mode=LAYERED)
+    overlay.start()
+    _wait_for(lambda: backend.overlay.surfaces)
+    yield overlay, backend.overlay.surfaces[0], backend.gdi
+    overlay.stop()
+
+
+def test_highlight_change_costs_one_update(overlay):
+    overlay, surface, gdi = overlay
+    overlay.set_highlight(100, 100, 50, 20)
+    _wait_for(lambda: surface.updates)
+    _settle()
+    assert len(surface.updates) == 1
+    assert surface.updates[0][0] == "present"
+
+    overlay.set_highlight(200, 120, 60, 30)
+    _wait_for(lambda: len(surface.updates) >= 2)
+    _settle()
+    # Sin cambios el hilo solo atiende mensajes: ninguna actualización más
+    assert len(surface.updates) == 2
+    # La ventana retenida no obliga a repintar el escritorio
+    assert not [c for c in gdi.calls if c[0] in ("invalidate_rect", "update_desktop")]
+
+
+def test_clear_costs_one_update(overlay):
+    overlay, surface, gdi = overlay
+    overlay.highlight_many([{"x": 10 + i * 40, "y": 10, "width": 30, "height": 20} for i in range(5)])
+    _wait_for(lambda: surface.updates)
+    _settle()
+    before = len(surface.updates)
+
+    overlay.clear()
+    _wait_for(lambda: len(surface.updates) > before)
+    _settle()
+    assert surface.updates[before:] == [("hide",)]
+    assert not [c for c in gdi.calls if c[0] in ("invalidate_rect", "update_desktop")]
+
+
+def test_many_highlights_are_one_update(overlay):
+    overlay, surface, gdi = overlay
+    overlay.highlight_many([{"x": 10 + i * 40, "y": 10, "width": 30, "height": 20} for i in range(8)])
+    _wait_for(lambda: surface.updates)
+    _settle()
+    assert len(surface.updates) == 1
+    assert len([c for c in gdi.calls if c[0] == "rectangle"]) == 8
+
+
+def test_capture_hides_primary_when_not_excluded(overlay):
+    overlay, surface, _ = overlay
+    overlay.set_highlight(100, 100, 50, 20)
+    _wait_for(lambda: surface.updates)
+
+    with overlay.hidden_for_capture((100, 100, 50, 20)):
+        # El render ya publicó el conjunto sin el resaltado principal
+        assert PRIMARY not in overlay.highlights
+        assert surface.updates[-1] == ("hide",)
+    _wait_for(lambda: surface.updates[-1][0] == "present")
+    assert overlay.current_rect == (100, 100, 50, 20)
+
+
+def test_capture_leaves_excluded_overlay_alone():
+    backend = SimpleNamespace(gdi=RecordingGDI(), overlay=RecordingOverlayWindow(excluded=True))
+    overlay = ElementOverlay(backend, mode=LAYERED)
+    overlay.start()
+    try:
+        _wait_for(lambda: backend.overlay.surfaces)
+        surface = backend.overlay.surfaces[0]
+        overlay.set_highlight(100, 100, 50, 20)
+        _wait_for(lambda: surface.updates)
+        with overlay.hidden_for_capture((100, 100, 50, 20)):
+            assert PRIMARY in overlay.highlights
+        _settle()
+        assert len(surface.updates) == 1
+    finally:
+        overlay.stop()
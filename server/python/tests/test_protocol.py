@@ -0,0 +1,115 @@
+"""
+Protocolo de salida: lo que escribe EventWriter se decodifica igual a lo emitido
+"""
+import io
+import json
+import time
+
+import pytest
+
+from protocol import EventWriter, decode_frames, encode_record, decode_records
+
+
+def _hover(i: int, **element) -> dict:
+    return {
+        "event": "hover",
+        "x": 100 + i,
+        "y": 200 - i,
+        "element": {
+            "name": f"Campo {i}",
+            "type": "edit",
+            "controlType": "EditControl",
+            "className": "Edit",
+            "automationId": f"txt_{i}",
+            "value": None,
+            "isEnabled": True,
+            "isVisible": i % 2 == 0,
+            "isInteractive": True,
+            "bounds": {"x": 90 + i, "y": 190, "width": 110, "height": -3},
+            "parentName": "Formulário ✓",
+            **element
+        }
+    }
+
+
+EVENTS = [
+    _hover(1),
+    _hover(2, elementId="42.7"),
+    # Hover con forma no estándar: viaja como registro JSON
+    {"event": "hover", "x": 1, "y": 2, "element": {"name": "sin bounds"}},
+    {"event": "click", "seq": 0, "x": 5, "y": 6, "clickType": "left", "element": None},
+    {"event": "pending_clicks", "id": 3, "clicks": [], "cursor": 0, "missed": 0},
+    {"event": "type", "text": "ñandú 😀", "keys": 7, "masked": False},
+]
+
+
+def _run(mode: str, events, **kwargs) -> bytes:
+    raw = io.BytesIO()
+    stream = io.TextIOWrapper(raw, encoding="utf-8", write_through=False)
+    writer = EventWriter(stream, mode=mode, coalesce_hovers=False, **kwargs)
+    for event in events:
+        writer.emit(event)
+    assert writer.flush(timeout=2.0)
+    writer.close()
+    stream.flush()
+    return raw.getvalue()
+
+
+def test_json_round_trip():
+    data = _run("json", EVENTS)
+    assert [json.loads(line) for line in data.decode("utf-8").splitlines()] == EVENTS
+
+
+@pytest.mark.parametrize("batch_window", [0.0, 0.02])
+def test_binary_round_trip(batch_window):
+    assert decode_frames(_run("binary", EVENTS, batch_window=batch_window)) == EVENTS
+
+
+def test_compact_hover_records():
+    # Hover estándar: registro compacto, más pequeño que su JSON
+    for event, kind in ((_hover(1), 0x02), (_hover(2, elementId="42.7"), 0x03)):
+        record = encode_record(event)
+        assert record[0] == kind
+        assert len(record) < len(json.dumps(event))
+        assert list(decode_records(record)) == [event]
+
+
+def test_switch_mode_announces_in_previous_mode():
+    raw = io.BytesIO()
+    stream = io.TextIOWrapper(raw, encoding="utf-8", write_through=False)
+    writer = EventWriter(stream, mode="json", coalesce_hovers=False)
+    writer.emit({"event": "ready"})
+    writer.set_mode("binary", {"event": "tracking_started", "protocol": "binary"})
+    writer.emit(_hover(3))
+    writer.emit({"event": "click", "seq": 1, "x": 0, "y": 0})
+    assert writer.flush(timeout=2.0)
+    writer.close()
+    stream.flush()
+
+    data = raw.getvalue()
+    first, rest = data.split(b"\n", 1)
+    second, frames = rest.split(b"\n", 1)
+    assert json.loads(first) == {"event": "ready"}
+    assert json.loads(second) == {"event": "tracking_started", "protocol": "binary"}
+    assert decode_frames(frames) == [_hover(3), {"event": "click", "seq": 1, "x": 0, "y": 0}]
+
+
+def test_stale_hovers_coalesce_but_other_events_survive():
+    class SlowStream(io.StringIO):
+        def write(self, s):
+            time.sleep(0.01)
+            return super().write(s)
+
+    stream = SlowStream()
+    writer = EventWriter(stream, mode="json")
+    for i in range(50):
+        writer.emit(_hover(i))
+        if i % 10 == 0:
+            writer.emit({"event": "click", "seq": i // 10, "x": i, "y": i})
+    assert writer.flush(timeout=5.0)
+    writer.close()
+
+    written = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [e["seq"] for e in written if e["event"] == "click"] == [0, 1, 2, 3, 4]
+    # El último hover siempre llega
+    assert written[-1] == _hover(49)
@@ -0,0 +1,86 @@
+"""
+Sesiones grabadas: lo que escribe SessionRecorder se lee por rango con SessionReader
+"""
+import os
+
+import pytest
+
+from session_log import MAGIC, SessionReader, SessionRecorder
+
+T0 = 1700000000.0
+
+
+@pytest.fixture
+def session(tmp_path):
+    """20 clics (uno por segundo) y un hover cada 5, en chunks de 4 eventos"""
+    path = str(tmp_path / "s.alqlog")
+    recorder = SessionRecorder(path, chunk_events=4)
+    recorder.start()
+    for i in range(20):
+        recorder.record({"event": "click", "seq": i}, T0 + i)
+        if i % 5 == 0:
+            recorder.record({"event": "hover", "x": i, "y": i}, T0 + i + 0.5)
+    # No grabable por defecto
+    recorder.record({"event": "status"}, T0)
+    stats = recorder.stop()
+    assert stats["events"] == 24 and stats["dropped"] == 0 and stats["errors"] == 0
+    return path
+
+
+def test_info(session):
+    info = SessionReader(session).info()
+    assert info["events"] == 24
+    assert info["chunks"] == 6
+    assert info["start"] == T0 and info["end"] == T0 + 19
+
+
+def test_read_everything_in_order(session):
+    events = list(SessionReader(session).read())
+    assert [e["seq"] for e in events if e["event"] == "click"] == list(range(20))
+    assert [e["ts"] for e in events] == sorted(e["ts"] for e in events)
+
+
+def test_read_time_range(session):
+    events = list(SessionReader(session).read(T0 + 5, T0 + 9))
+    assert [(e["event"], e.get("seq")) for e in events] == [
+        ("click", 5), ("hover", None), ("click", 6), ("click", 7), ("click", 8), ("click", 9)]
+
+
+def test_read_types_and_limit(session):
+    reader = SessionReader(session)
+    assert [e["x"] for e in reader.read(event_types=["hover"])] == [0, 5, 10, 15]
+    assert [e["seq"] for e in reader.read(start=T0 + 10, event_types=["click"], limit=3)] == [10, 11, 12]
+
+
+def test_index_rebuilt_from_chunk_headers(session):
+    expected = list(SessionReader(session).read())
+    os.remove(session + ".idx")
+    reader = SessionReader(session)
+    assert reader.info()["chunks"] == 6
+    assert list(reader.read()) == expected
+
+
+def test_truncated_tail_is_ignored(session):
+    expected = list(SessionReader(session).read())
+    with open(session, "ab") as f:
+        f.write(b"C" + b"\x00" * 10)  # chunk cortado a medias
+    assert list(SessionReader(session).read()) == expected
+
+
+def test_append_resumes_session(session):
+    recorder = SessionRecorder(session, chunk_events=4)
+    recorder.start()
+    recorder.record({"event": "click", "seq": 20}, T0 + 20)
+    recorder.stop()
+    with open(session, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC
+    reader = SessionReader(session)
+    assert reader.info()["events"] == 25
+    assert [e["seq"] for e in reader.read(start=T0 + 19.5)] == [20]
+
+
+def test_not_a_session(tmp_path):
+    path = tmp_path / "otro.alqlog"
+    path.write_bytes(b"hola mundo, esto no es una sesion")
+    with pytest.raises(ValueError):
+        SessionReader(str(path))
@@ -2,135 +2,35 @@
 Tracking Service - Rastrea mouse, detecta elementos UI y envía eventos
 Combina mouse tracking, UI inspection y overlay en un servicio unificado
 """
-import json
+import os
+import queue
 import sys
 import time
 import threading
-import ctypes
-from ctypes import wintypes
-from typing import Optional, Tuple, Dict, Callable
+from typing import Optional, Tuple, Dict, Callable, Hashable
 from datetime import datetime
 
-# Inicializar COM para Windows UI Automation
-import pythoncom
-
-# Importar pynput para tracking global del mouse
-try:
-    from pynput import mouse
-    PYNPUT_AVAILABLE = True
-except ImportError:
-    PYNPUT_AVAILABLE = False
-    print(json.dumps({"warning": "pynput no disponible, usar: pip install pynput"}), flush=True)
-
-# Importar uiautomation para detección de elementos
-try:
-    import uiautomation as auto
-    UIAUTOMATION_AVAILABLE = True
-except ImportError:
-    UIAUTOMATION_AVAILABLE = False
-    print(json.dumps({"warning": "uiautomation no disponible, usar: pip install uiautomation"}), flush=True)
-
-# APIs de Windows para overlay
-import win32gui
-import win32api
-import win32con
-
-user32 = ctypes.windll.user32
-gdi32 = ctypes.windll.gdi32
-
-# Colores
-GREEN = win32api.RGB(34, 197, 94)
-RED = win32api.RGB(239, 68, 68)
-BLUE = win32api.RGB(59, 130, 246)
-
-
-class ElementOverlay:
-    """Dibuja overlay sobre elementos"""
-
-    def __init__(self):
-        self.current_rect = None
-        self.running = False
-        self.thread = None
-        self.color = GREEN
-        self.border_width = 3
-        self._lock = threading.Lock()
-
-    def start(self):
-        if not self.running:
-            self.running = True
-            self.thread = threading.Thread(target=self._draw_loop, daemon=True)
-            self.thread.start()
-
-    def stop(self):
-        self.running = False
-        self.current_rect = None
-        self._clear()
-
-    def set_highlight(self, x, y, w, h, is_interactive=True):
-        with self._lock:
-            self.current_rect = (x, y, w, h)
-            self.color = GREEN if is_interactive else BLUE
-
-    def clear(self):
-        with self._lock:
-            self.current_rect = None
-        self._clear()
-
-    def _clear(self):
-        try:
-            user32.InvalidateRect(None, None, True)
-        except:
-            pass
-
-    def _draw_loop(self):
-        last_rect = None
-        while self.running:
-            try:
-                with self._lock:
-                    current = self.current_rect
-                    color = self.color
-
-                if current:
-                    if last_rect and last_rect != current:
-                        self._invalidate(last_rect)
-                    self._draw_rect(*current, color)
-                    last_rect = current
-                elif last_rect:
-                    self._invalidate(last_rect)
-                    last_rect = None
-
-                time.sleep(0.033)
-            except:
-                time.sleep(0.1)
-
-    def _draw_rect(self, x, y, w, h, color):
-        try:
-            hdc = user32.GetDC(None)
-            if not hdc:
-                return
-
-            pen = gdi32.CreatePen(win32con.PS_SOLID, self.border_width, color)
-            old_pen = gdi32.SelectObject(hdc, pen)
-            brush = gdi32.GetStockObject(win32con.NULL_BRUSH)
-            old_brush = gdi32.SelectObject(hdc, brush)
-
-            gdi32.Rectangle(hdc, x, y, x + w, y + h)
-
-            gdi32.SelectObject(hdc, old_pen)
-            gdi32.SelectObject(hdc, old_brush)
-            gdi32.DeleteObject(pen)
-            user32.ReleaseDC(None, hdc)
-        except:
-            pass
-
-    def _invalidate(self, rect):
-        try:
-            x, y, w, h = rect
-            m = self.border_width + 2
-            r = (ctypes.c_long * 4)(x - m, y - m, x + w + m, y + h + m)
-            user32.InvalidateRect(None, ctypes.byref(r), True)
-        except:
-            pass
+# startup primero: su instante de carga es el origen de time-to-ready
+import startup
+from backends import PlatformBackend, get_backend
+from dispatcher import CommandDispatcher
+from click_buffer import POLICIES as CLICK_POLICIES, ClickBuffer, ClickRecord
+from element_cache import HitTestCache
+from diagnostics import build_diagnostics_commands
+from element_images import ElementImager
+from event_filter import EventFilter
+from hover_dedup import DELTA, NEW, SAME, HoverDeduper, element_identity
+from inspect_pool import InspectionPool
+from keyboard_tracker import KeyboardTracker
+from metrics import REGISTRY, StageMetrics, build_metrics_commands, configure_from_env
+from metrics import shutdown as shutdown_metrics
+from overlay import BLUE, GREEN, PRIMARY, ElementOverlay
+from overlay_service import build_highlight_commands
+from prefetch import PrefetchBuffer, TrajectoryPrefetcher
+from protocol import PROTOCOLS, EventWriter
+from session_log import SessionReader, SessionRecorder
+from ui_tree import UITreeSnapshot
+from window_geometry import WindowGeometry
 
 
 class UIInspector:
@@ -160,328 +60,1074 @@ class UIInspector:
 
     INTERACTIVE_TYPES = ['button', 'edit', 'checkbox', 'combobox', 'link', 'menuitem', 'listitem', 'tabitem']
 
-    def get_element_at_point(self, x: int, y: int) -> Optional[Dict]:
-        """Obtiene información del elemento en una posición"""
-        if not UIAUTOMATION_AVAILABLE:
+    # Orden de los campos en el elemento emitido
+    FIELD_ORDER = (
+        "name", "type", "controlType", "className", "automationId", "value",
+        "isEnabled", "isVisible", "isInteractive", "bounds", "parentName", "isPassword", "elementId"
+    )
+
+    # Propiedades UIA que necesita cada campo
+    FIELD_PROPERTIES = {
+        "name": ("Name",),
+        "type": ("ControlTypeName",),
+        "controlType": ("ControlTypeName",),
+        "className": ("ClassName",),
+        "automationId": ("AutomationId",),
+        "value": ("Value",),
+        "isEnabled": ("IsEnabled",),
+        "isVisible": ("IsOffscreen",),
+        "isInteractive": ("ControlTypeName",),
+        "bounds": ("BoundingRectangle",),
+        "parentName": ("ParentName",),
+        "isPassword": ("IsPassword",),
+        "elementId": ("RuntimeId",),
+    }
+
+    # Niveles de detalle: minimal para el overlay, standard para hover,
+    # full para captura y clics (valor y padre cuestan llamadas extra)
+    _MINIMAL = ("bounds", "type", "controlType", "isInteractive", "elementId")
+    _STANDARD = _MINIMAL + ("name", "className", "automationId", "isEnabled", "isVisible")
+    LEVELS = {
+        "minimal": frozenset(_MINIMAL),
+        "standard": frozenset(_STANDARD),
+        "full": frozenset(_STANDARD + ("value", "parentName")),
+    }
+    # Campos que cuestan llamadas extra: con filtros de suscripción se piden
+    # solo para los elementos admitidos (complete_element)
+    EXPENSIVE_FIELDS = frozenset(("value", "parentName"))
+
+    def __init__(self, backend: PlatformBackend, metrics: StageMetrics = None,
+                 geometry: WindowGeometry = None, pool: InspectionPool = None):
+        self.uia = backend.uia
+        self.window = backend.window
+        self.cache = HitTestCache()
+        self.metrics = metrics or REGISTRY
+        self.geometry = geometry or WindowGeometry(backend.window, metrics=self.metrics)
+        # Con pool, las consultas UIA corren en workers con plazo (apps colgadas)
+        self.pool = pool
+        # Elementos resueltos por adelantado según la trayectoria (start con `prefetch`)
+        self.prefetch: Optional[PrefetchBuffer] = None
+        self._pids: Dict[int, Optional[int]] = {}
+
+    def _window_context(self):
+        """Contexto de validez de la caché: ventana en primer plano y geometrías
+        (de WindowGeometry, sin GetWindowRect mientras lleguen eventos)"""
+        started = time.perf_counter()
+        context = self.geometry.context()
+        self.metrics.observe("inspect.window_rect", time.perf_counter() - started)
+        return context
+
+    def resolve_fields(self, level: str = "full", fields=None) -> frozenset:
+        """Campos a resolver: la lista `fields` si se indica (bounds siempre
+        incluido, lo necesitan overlay y caché) o los del nivel"""
+        if fields:
+            return frozenset(f for f in fields if f in self.FIELD_PROPERTIES) | {"bounds"}
+        return self.LEVELS.get(level, self.LEVELS["full"])
+
+    def _process_of(self, hwnd: Optional[int]) -> Optional[int]:
+        """Proceso dueño de la ventana (cacheado por handle)"""
+        if not hwnd:
+            return None
+        pid = self._pids.get(hwnd)
+        if pid is None and hwnd not in self._pids:
+            if len(self._pids) >= 256:
+                self._pids.clear()
+            pid = self._pids[hwnd] = self.window.window_process(hwnd)
+        return pid
+
+    def _query(self, pid: Optional[int], deadline: Optional[float], fn: Callable, *args):
+        """Ejecuta la consulta UIA en el pool (con plazo) o en este hilo"""
+        if self.pool is None:
+            return fn(*args)
+        return self.pool.run(fn, *args, pid=pid, deadline=deadline)
+
+    def get_element_at_point(self, x: int, y: int, use_cache: bool = True,
+                             level: str = "full", fields=None, deadline: float = None) -> Optional[Dict]:
+        """Obtiene información del elemento en una posición.
+
+        Solo se piden a UIA las propiedades de los campos del nivel (o de
+        `fields`), todas en una consulta (UIABackend.inspect_point). Con pool
+        la consulta espera como mucho `deadline` (o el plazo del pool).
+        """
+        if not self.uia.available:
             return None
 
+        wanted = fields if isinstance(fields, frozenset) else self.resolve_fields(level, fields)
+
+        context = None
+        if use_cache:
+            try:
+                context = self._window_context()
+            except Exception as e:
+                self.metrics.error("inspect.window_rect", e)
+                use_cache = False
+            else:
+                cached = self.cache.lookup(x, y, context, wanted)
+                if cached is None and self.prefetch is not None:
+                    cached = self.prefetch.lookup(x, y, context, wanted)
+                    if cached is not None:
+                        self.cache.store(cached, context)
+                if cached is not None:
+                    return {key: cached[key] for key in self.FIELD_ORDER if key in wanted}
+
+        properties = {prop for field in wanted for prop in self.FIELD_PROPERTIES[field]}
+        if use_cache:
+            properties.add("IsLeaf")
+
+        started = time.perf_counter()
         try:
-            control = auto.ControlFromPoint(x, y)
-            if not control:
+            pid = self._process_of(self.window.window_from_point(x, y)) if self.pool else None
+            values = self._query(pid, deadline, self.uia.inspect_point, x, y, properties)
+            self.metrics.observe("inspect.uia", time.perf_counter() - started)
+            if not values:
                 return None
 
-            rect = control.BoundingRectangle
-            control_type = control.ControlTypeName
-            element_type = self.CONTROL_TYPE_MAP.get(control_type, 'unknown')
+            element = self.build_element(values, wanted)
 
-            # Obtener nombre del padre
-            parent = control.GetParentControl()
-            parent_name = parent.Name if parent else None
+            # Solo las hojas son seguras de cachear por rectángulo
+            if use_cache and values.get("IsLeaf"):
+                self.cache.store(element, context)
 
-            # Intentar obtener valor
-            value = None
-            try:
-                if hasattr(control, 'GetValuePattern'):
-                    vp = control.GetValuePattern()
-                    if vp:
-                        value = vp.Value
-            except:
-                pass
+            return dict(element)
+        except Exception as e:
+            self.metrics.error("inspect.uia", e)
+            return None
 
-            return {
-                "name": control.Name or "",
-                "type": element_type,
-                "controlType": control_type,
-                "className": control.ClassName or "",
-                "automationId": control.AutomationId or "",
-                "value": value,
-                "isEnabled": control.IsEnabled,
-                "isVisible": not control.IsOffscreen,
-                "isInteractive": element_type in self.INTERACTIVE_TYPES,
-                "bounds": {
-                    "x": rect.left,
-                    "y": rect.top,
-                    "width": rect.width(),
-                    "height": rect.height()
-                },
-                "parentName": parent_name
-            }
+    def complete_element(self, x: int, y: int, element: Dict, fields: frozenset,
+                         deadline: float = None) -> Dict:
+        """Agrega a `element` los campos `fields` con una consulta más (sin
+        caché: son los campos caros diferidos hasta pasar los filtros)"""
+        properties = {prop for field in fields for prop in self.FIELD_PROPERTIES[field]}
+        merged = dict(element)
+        started = time.perf_counter()
+        try:
+            pid = self._process_of(self.window.window_from_point(x, y)) if self.pool else None
+            values = self._query(pid, deadline, self.uia.inspect_point, x, y, properties)
+            self.metrics.observe("inspect.uia", time.perf_counter() - started)
+            if values:
+                merged.update(self.build_element(values, fields))
         except Exception as e:
+            self.metrics.error("inspect.uia", e)
+        return {key: merged[key] for key in self.FIELD_ORDER if key in merged}
+
+    def resolve_leaf(self, x: int, y: int, wanted: frozenset,
+                     deadline: float = None) -> Tuple[Optional[Dict], Hashable]:
+        """Resolución para el prefetch: (elemento si es hoja, contexto), sin
+        pasar por la caché de hit-test"""
+        context = self._window_context()
+        properties = {prop for field in wanted for prop in self.FIELD_PROPERTIES[field]} | {"IsLeaf"}
+        pid = self._process_of(self.window.window_from_point(x, y)) if self.pool else None
+        values = self._query(pid, deadline, self.uia.inspect_point, x, y, properties)
+        if not values or not values.get("IsLeaf"):
+            return None, context
+        return self.build_element(values, wanted), context
+
+    def is_resolved(self, x: int, y: int, wanted: frozenset) -> bool:
+        """¿La caché o el buffer de prefetch ya responden (x, y)?"""
+        context = self._window_context()
+        prefetch = self.prefetch
+        return self.cache.covers(x, y, context, wanted) or (
+            prefetch is not None and prefetch.covers(x, y, context, wanted))
+
+    def get_focused_element(self, level: str = "standard", fields=None,
+                            deadline: float = None) -> Optional[Dict]:
+        """Elemento con el foco del teclado (una consulta, sin caché de hit-test)"""
+        if not self.uia.available:
+            return None
+        wanted = fields if isinstance(fields, frozenset) else self.resolve_fields(level, fields)
+        properties = {prop for field in wanted for prop in self.FIELD_PROPERTIES[field]}
+        try:
+            with self.metrics.time("inspect.focus"):
+                pid = self._process_of(self.geometry.foreground()[0]) if self.pool else None
+                values = self._query(pid, deadline, self.uia.inspect_focused, properties)
+        except Exception:
+            # Contado por metrics.time en inspect.focus
             return None
+        return self.build_element(values, wanted) if values else None
+
+    def build_element(self, values: Dict, wanted: frozenset) -> Dict:
+        control_type = values.get("ControlTypeName")
+        element_type = self.CONTROL_TYPE_MAP.get(control_type, 'unknown')
+        element = {}
+        for field in self.FIELD_ORDER:
+            if field not in wanted:
+                continue
+            if field == "name":
+                element[field] = values["Name"] or ""
+            elif field == "type":
+                element[field] = element_type
+            elif field == "controlType":
+                element[field] = control_type
+            elif field == "className":
+                element[field] = values["ClassName"] or ""
+            elif field == "automationId":
+                element[field] = values["AutomationId"] or ""
+            elif field == "value":
+                element[field] = values["Value"]
+            elif field == "isEnabled":
+                element[field] = values["IsEnabled"]
+            elif field == "isVisible":
+                element[field] = not values["IsOffscreen"]
+            elif field == "isInteractive":
+                element[field] = element_type in self.INTERACTIVE_TYPES
+            elif field == "bounds":
+                left, top, right, bottom = values["BoundingRectangle"]
+                element[field] = {
+                    "x": left,
+                    "y": top,
+                    "width": right - left,
+                    "height": bottom - top
+                }
+            elif field == "parentName":
+                element[field] = values["ParentName"]
+            elif field == "isPassword":
+                element[field] = bool(values["IsPassword"])
+        if "elementId" in wanted:
+            element["elementId"] = element_identity(values.get("RuntimeId"), element)
+        return element
 
 
 class TrackingService:
     """Servicio principal de tracking"""
 
-    def __init__(self):
-        self.overlay = ElementOverlay()
-        self.inspector = UIInspector()
+    def __init__(self, backend: PlatformBackend, output: EventWriter = None,
+                 overlay: ElementOverlay = None, metrics: StageMetrics = None):
+        self.backend = backend
+        self.metrics = metrics or REGISTRY
+        self.output = output or EventWriter(metrics=self.metrics)
+        # El daemon comparte un único overlay entre tracking y clientes de overlay
+        self.overlay = overlay or ElementOverlay(backend, self.metrics)
+        # Geometría de las ventanas objetivo, actualizada por eventos de ventana
+        self.geometry = WindowGeometry(backend.window, metrics=self.metrics)
+        # Inspecciones en workers con plazo: una app colgada no congela hover ni comandos
+        self.inspect_pool = InspectionPool(
+            init_thread=backend.uia.init_thread,
+            uninit_thread=backend.uia.uninit_thread,
+            metrics=self.metrics
+        )
+        self.command_deadline = 3.0  # plazo de clics, capturas y foco (el de hover es el del pool)
+        self.inspector = UIInspector(backend, self.metrics, self.geometry, self.inspect_pool)
+        self.tree = UITreeSnapshot(self.inspector)
         self.is_tracking = False
         self.mouse_listener = None
         self.current_position = (0, 0)
-        self.last_element = None
-        self.pending_clicks = []
-        self.target_window_handle = None
+        self.hover_dedup = HoverDeduper()
+        self.pending_clicks = ClickBuffer()
+        self.target_window_handle = None  # handle principal (snapshot, find_elements)
+        self.target_pid = None
         self.capture_mode = "auto"  # auto, manual
-        self.hover_delay = 0.1  # segundos
+        self.hover_delay = 0.1  # segundos que el mouse debe reposar antes del hit-test
+        self.hover_level = "standard"  # nivel de detalle de los eventos hover
+        # Filtros de la suscripción (`subscribe`), evaluados antes de serializar
+        self.event_filter = EventFilter()
+        self._hover_fields = self.inspector.resolve_fields(self.hover_level)
+        self._click_fields = UIInspector.LEVELS["full"]
         self.last_move_time = 0
-        self._lock = threading.Lock()
         self._hover_thread = None
-
-    def start(self, target_handle: int = None):
-        """Inicia el tracking"""
+        # Señal de movimiento: despierta al hilo de hover solo cuando hay trabajo
+        self._move_event = threading.Event()
+        # Clics crudos del hook pendientes de inspección: (x, y, button, t_hook, t_wall)
+        self._click_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._click_thread = None
+        # Grabación de la sesión en disco (start con `record`)
+        self.recorder: Optional[SessionRecorder] = None
+        self.last_recording: Optional[str] = None
+        # Recortes de pantalla de los elementos (start con `images` o capture con `image`)
+        self.imager: Optional[ElementImager] = None
+        self.click_images = False
+        # Teclado (start con `keyboard`): ráfagas coalescidas en eventos type
+        self.keyboard: Optional[KeyboardTracker] = None
+        self.keyboard_listener = None
+        self.keyboard_skipped = 0
+        # Prefetch especulativo por trayectoria (start con `prefetch`)
+        self.prefetcher: Optional[TrajectoryPrefetcher] = None
+        self.hook_latency = self.metrics.histogram("click.hook")
+        self.click_latency = self.metrics.histogram("click.total")
+
+    def start(self, target_handle: int = None, hover_delay: float = None, protocol: str = None,
+              click_capacity: int = None, click_overflow: str = None, hover_policy: Dict = None,
+              hover_level: str = None, record=None, target_pid: int = None, images=None,
+              keyboard=None, inspection: Dict = None, prefetch=None):
+        """Inicia el tracking.
+
+        `target_handle` puede ser un handle o una lista de handles; con
+        `target_pid` se siguen todas las ventanas del proceso (también los
+        diálogos que abra después). `record` activa la grabación de la
+        sesión: True (ruta por defecto), una ruta, o {path, chunkEvents,
+        chunkSeconds, events}. `images` agrega a cada clic el recorte del
+        elemento: True o las opciones de configure_images. `keyboard` activa
+        el tracking de teclado: True o {idleTimeout, maxChars, level}.
+        `inspection` ajusta el pool de inspección: {workers, deadline,
+        commandDeadline, hedgeAfter, maxHung, quarantine, quarantineAfter}
+        (tiempos en segundos). `prefetch` resuelve por adelantado el elemento
+        donde se espera que pare el cursor: True o {budget, horizon, settle,
+        ttl, maxEntries}.
+        """
         if self.is_tracking:
             return
 
-        self.target_window_handle = target_handle
+        # Primero: opciones de imagen inválidas fallan antes de tocar el estado
+        if images:
+            self.configure_images(images if isinstance(images, dict) else None)
+        self.click_images = bool(images)
+        if inspection:
+            self.configure_inspection(inspection)
+
+        if isinstance(target_handle, (list, tuple, set)):
+            handles = list(target_handle)
+        else:
+            handles = [target_handle] if target_handle else []
+        self.geometry.set_targets(handles, target_pid)
+        self.target_window_handle = self.geometry.primary
+        self.target_pid = target_pid
+        self.inspector.cache.invalidate()
+        if hover_delay is not None:
+            self.hover_delay = max(0.0, float(hover_delay))
         self.is_tracking = True
-        self.pending_clicks = []
+        if hover_policy is not None:
+            self.hover_dedup = HoverDeduper.from_policy(hover_policy)
+        self.hover_dedup.reset()
+        if hover_level in UIInspector.LEVELS:
+            self.hover_level = hover_level
+        self._update_fields()
+        self.pending_clicks = ClickBuffer(
+            click_capacity or self.pending_clicks.capacity,
+            click_overflow or self.pending_clicks.policy
+        )
+        self._move_event.clear()
+
+        if record:
+            options = record if isinstance(record, dict) else {}
+            self.recorder = SessionRecorder(
+                record if isinstance(record, str) else options.get("path"),
+                chunk_events=options.get("chunkEvents", 512),
+                chunk_seconds=options.get("chunkSeconds", 2.0),
+                **({"event_types": options["events"]} if "events" in options else {})
+            )
+            self.recorder.start()
+            self.last_recording = self.recorder.path
 
         # Iniciar overlay
         self.overlay.start()
 
+        # Teclado antes que el mouse: un clic temprano ya puede cerrar su ráfaga
+        self.keyboard = None
+        if keyboard and self.backend.keyboard.available:
+            self._start_keyboard(keyboard if isinstance(keyboard, dict) else {})
+
+        # Prefetch antes que el mouse: recibe las muestras desde el primer movimiento
+        self.prefetcher = None
+        if prefetch and self.backend.mouse.available:
+            self._start_prefetch(prefetch if isinstance(prefetch, dict) else {})
+
         # Iniciar listener de mouse
-        if PYNPUT_AVAILABLE:
-            self.mouse_listener = mouse.Listener(
+        if self.backend.mouse.available:
+            self.mouse_listener = self.backend.mouse.create_listener(
                 on_move=self._on_mouse_move,
                 on_click=self._on_mouse_click
             )
             self.mouse_listener.start()
 
         # Iniciar hilo de hover detection
-        self._hover_thread = threading.Thread(target=self._hover_loop, daemon=True)
+        self._hover_thread = threading.Thread(target=self._hover_loop, daemon=True, name="hover")
         self._hover_thread.start()
 
-        print(json.dumps({
+        # Iniciar worker de inspección de clics
+        self._click_thread = threading.Thread(target=self._click_loop, daemon=True, name="click-inspector")
+        self._click_thread.start()
+
+        # tracking_started se escribe en el protocolo actual; lo que sigue usa el negociado
+        self.output.set_mode(protocol or self.output.mode, announce={
             "event": "tracking_started",
-            "targetHandle": target_handle
-        }), flush=True)
+            "targetHandle": target_handle,
+            "targetHandles": list(self.geometry.handles),
+            "targetPid": target_pid,
+            "protocol": protocol or self.output.mode,
+            "recording": self.recorder.path if self.recorder else None
+        })
 
     def stop(self):
         """Detiene el tracking"""
         self.is_tracking = False
+        # Despertar al hilo de hover para que termine
+        self._move_event.set()
 
         if self.mouse_listener:
             self.mouse_listener.stop()
             self.mouse_listener = None
 
-        self.overlay.stop()
+        if self.prefetcher:
+            self.inspector.prefetch = None
+            self.prefetcher.stop()
 
-        print(json.dumps({
-            "event": "tracking_stopped"
-        }), flush=True)
+        # La ráfaga de teclado pendiente se emite (y graba) antes de tracking_stopped
+        if self.keyboard_listener:
+            self.keyboard_listener.stop()
+            self.keyboard_listener = None
+        if self.keyboard:
+            self.keyboard.stop()
+
+        # El worker procesa los clics ya encolados antes de terminar
+        if self._click_thread:
+            self._click_queue.put(None)
+            if self._click_thread is not threading.current_thread():
+                self._click_thread.join(timeout=2.0)
+            self._click_thread = None
+
+        # Sin tracking no hacen falta workers de inspección (un comando posterior crea otros)
+        self.inspect_pool.close()
+
+        self.overlay.stop()
+        self.geometry.clear()
+
+        # Termina las codificaciones pendientes: sus element_image salen antes de tracking_stopped
+        if self.imager:
+            self.imager.close()
+            self.imager = None
+
+        # Después del worker de clics: los clics encolados también se graban
+        recording = None
+        if self.recorder:
+            recording = self.recorder.stop()
+            self.recorder = None
+
+        self.output.emit({
+            "event": "tracking_stopped",
+            "recording": recording
+        }, flush=True)
+
+    def _update_fields(self):
+        """Campos de hover y clic: los del nivel más los que vigilan la
+        política de hover y los filtros de la suscripción"""
+        self._hover_fields = self.inspector.resolve_fields(self.hover_level) | (
+            frozenset(self.hover_dedup.fields) & UIInspector.FIELD_PROPERTIES.keys()
+        ) | self.event_filter.element_fields
+        self._click_fields = UIInspector.LEVELS["full"] | self.event_filter.element_fields
+
+    def subscribe(self, spec: Dict = None) -> EventFilter:
+        """Reemplaza los filtros de la suscripción (sin filtros: todos los eventos).
+        ValueError si la especificación es inválida."""
+        self.event_filter = EventFilter.from_spec(spec)
+        self._update_fields()
+        return self.event_filter
+
+    def _inspect_for_event(self, x: int, y: int, fields: frozenset, deadline: float = None,
+                           on_admitted: Callable[[Optional[Dict]], None] = None) -> Tuple[Optional[Dict], bool]:
+        """(elemento, admitido) para un evento. Mientras los filtros de
+        elemento descarten la mayoría, los campos caros solo se piden si el
+        elemento pasa los filtros. `on_admitted` corre en cuanto se sabe que
+        pasa (con los bounds ya resueltos), antes de esos campos caros."""
+        event_filter = self.event_filter
+        deferred = fields & UIInspector.EXPENSIVE_FIELDS if event_filter.defers_expensive else frozenset()
+        element = self.inspector.get_element_at_point(x, y, fields=fields - deferred, deadline=deadline)
+        if not event_filter.admits_element(element):
+            return element, False
+        if on_admitted is not None:
+            on_admitted(element)
+        if element is not None and deferred:
+            element = self.inspector.complete_element(x, y, element, deferred, deadline)
+        return element, True
 
     def _on_mouse_move(self, x: int, y: int):
         """Callback cuando el mouse se mueve"""
         self.current_position = (x, y)
-        self.last_move_time = time.time()
+        self.last_move_time = time.monotonic()
+        self._move_event.set()
+        prefetcher = self.prefetcher
+        if prefetcher is not None:
+            prefetcher.on_move(x, y)
 
     def _on_mouse_click(self, x: int, y: int, button, pressed: bool):
-        """Callback cuando se hace clic"""
+        """Callback cuando se hace clic.
+
+        Corre en el hilo del hook de mouse: solo marca el instante y encola.
+        Windows descarta los hooks que tardan, así que la inspección UIA se
+        hace en _click_loop.
+        """
         if not pressed or not self.is_tracking:
             return
-
-        # Verificar si el clic está dentro de la ventana objetivo
-        if self.target_window_handle:
+        started = time.perf_counter()
+        keyboard = self.keyboard
+        if keyboard is not None:
+            keyboard.flush("click")
+        self._click_queue.put((x, y, button, started, time.time()))
+        self.hook_latency.record(time.perf_counter() - started)
+
+    def _click_loop(self):
+        """Worker de clics: resuelve el elemento y emite el evento `click`.
+
+        Mantiene su apartamento COM durante todo el tracking.
+        """
+        self.backend.uia.init_thread()
+        try:
+            while True:
+                item = self._click_queue.get()
+                if item is None:
+                    break
+                try:
+                    self._process_click(*item)
+                except Exception as e:
+                    self.metrics.error("click.total", e)
+        finally:
             try:
-                rect = win32gui.GetWindowRect(self.target_window_handle)
-                if not (rect[0] <= x <= rect[2] and rect[1] <= y <= rect[3]):
-                    return
-            except:
-                pass
+                self.backend.uia.uninit_thread()
+            except Exception as e:
+                self.metrics.error("click.total", e)
+
+    def _process_click(self, x: int, y: int, button, hooked_at: float, wall_time: float):
+        metrics = self.metrics
+        started = time.perf_counter()
+        metrics.observe("click.queue_wait", started - hooked_at)
+
+        # Verificar si el clic está dentro de alguna ventana objetivo (en memoria)
+        if not self.geometry.contains(x, y):
+            return
+
+        # Filtros de la suscripción que no necesitan inspeccionar
+        event_filter = self.event_filter
+        if not event_filter.wants("click") or not event_filter.admits_point(x, y):
+            return
 
-        click_type = "right" if button == mouse.Button.right else "left"
+        click_type = "right" if button == "right" else "left"
 
-        # Obtener elemento en la posición del clic (con COM inicializado)
+        # Recorte en cuanto se conocen los bounds: antes de los campos caros,
+        # para que la pantalla sea lo más parecida posible a la del clic
+        images = []
+
+        def grab(element):
+            if self.click_images and element and element.get("bounds"):
+                images.append(self.element_image(element["bounds"]))
+
+        # Obtener elemento en la posición del clic
         element = None
+        admitted = True
+        inspect_started = time.perf_counter()
         try:
-            pythoncom.CoInitialize()
-            element = self.inspector.get_element_at_point(x, y)
+            element, admitted = self._inspect_for_event(x, y, self._click_fields, self.command_deadline, grab)
         except Exception as e:
-            pass
-        finally:
-            try:
-                pythoncom.CoUninitialize()
-            except:
-                pass
-
-        click_data = {
-            "event": "click",
-            "x": x,
-            "y": y,
-            "clickType": click_type,
-            "timestamp": datetime.now().isoformat(),
-            "element": element
-        }
+            metrics.error("click.inspect", e)
+        metrics.observe("click.inspect", time.perf_counter() - inspect_started)
+        if not admitted:
+            return
 
-        with self._lock:
-            self.pending_clicks.append(click_data)
+        record = ClickRecord(x, y, click_type, wall_time, element, images[0] if images else None)
+        self.pending_clicks.push(record)
 
-        # Emitir evento inmediatamente
-        print(json.dumps(click_data), flush=True)
+        # Emitir evento inmediatamente (también si el buffer lo descartó)
+        event_filter.admit("click")
+        event = record.to_event()
+        with metrics.time("click.emit"):
+            self.output.emit(event, flush=True)
+        self.record_event(event, wall_time)
+        self.click_latency.record(time.perf_counter() - hooked_at)
 
     def _hover_loop(self):
-        """Loop para detectar hover y actualizar overlay"""
+        """Loop para detectar hover y actualizar overlay.
+
+        Event-driven: el hilo duerme hasta que _on_mouse_move lo despierta.
+        Las ráfagas de movimiento se colapsan a la última posición y el
+        hit-test se hace solo cuando el mouse reposa `hover_delay` segundos.
+        """
         # Inicializar COM para este hilo
-        pythoncom.CoInitialize()
+        self.backend.uia.init_thread()
 
-        last_pos = (0, 0)
-        last_update = 0
+        metrics = self.metrics
+        last_pos = None
 
         try:
             while self.is_tracking:
+                self._move_event.wait()
+                if not self.is_tracking:
+                    break
+
                 try:
+                    # Debounce: esperar a que el mouse deje de moverse
+                    while self.is_tracking:
+                        self._move_event.clear()
+                        remaining = self.hover_delay - (time.monotonic() - self.last_move_time)
+                        if remaining <= 0 or not self._move_event.wait(remaining):
+                            break
+
                     x, y = self.current_position
-                    current_time = time.time()
-
-                    # Solo actualizar si el mouse se movió o pasó tiempo
-                    if (x, y) != last_pos or (current_time - last_update) > 0.5:
-                        # Verificar si está dentro de ventana objetivo
-                        in_target = True
-                        if self.target_window_handle:
-                            try:
-                                rect = win32gui.GetWindowRect(self.target_window_handle)
-                                in_target = rect[0] <= x <= rect[2] and rect[1] <= y <= rect[3]
-                            except:
-                                in_target = False
-
-                        if in_target:
-                            # Obtener elemento bajo el cursor
-                            element = self.inspector.get_element_at_point(x, y)
-
-                            if element and element.get("bounds"):
-                                bounds = element["bounds"]
-                                is_interactive = element.get("isInteractive", False)
-
-                                self.overlay.set_highlight(
-                                    bounds["x"],
-                                    bounds["y"],
-                                    bounds["width"],
-                                    bounds["height"],
-                                    is_interactive
-                                )
-
-                                # Emitir evento de hover si cambió el elemento
-                                if element != self.last_element:
-                                    self.last_element = element
-                                    print(json.dumps({
-                                        "event": "hover",
-                                        "x": x,
-                                        "y": y,
-                                        "element": element
-                                    }), flush=True)
-                            else:
-                                self.overlay.clear()
+                    if (x, y) == last_pos or not self.is_tracking:
+                        continue
+                    last_pos = (x, y)
+                    started = time.perf_counter()
+
+                    # Verificar si está dentro de alguna ventana objetivo (en memoria)
+                    if not self.geometry.contains(x, y):
+                        self.overlay.remove_highlight(PRIMARY)
+                        continue
+
+                    # Sin hover suscrito en este punto solo se resuelve lo que usa el overlay
+                    event_filter = self.event_filter
+                    emit = event_filter.wants("hover") and event_filter.admits_point(x, y)
+
+                    # Obtener elemento bajo el cursor (solo los campos del nivel de hover)
+                    with metrics.time("hover.hit_test"):
+                        if emit:
+                            element, emit = self._inspect_for_event(x, y, self._hover_fields)
                         else:
-                            self.overlay.clear()
-
-                        last_pos = (x, y)
-                        last_update = current_time
-
-                    time.sleep(0.05)  # 20 FPS para hover detection
+                            element = self.inspector.get_element_at_point(x, y, level="minimal")
+
+                    if element and element.get("bounds"):
+                        bounds = element["bounds"]
+                        is_interactive = element.get("isInteractive", False)
+
+                        with metrics.time("hover.overlay_update"):
+                            self.overlay.set_highlight(
+                                bounds["x"],
+                                bounds["y"],
+                                bounds["width"],
+                                bounds["height"],
+                                GREEN if is_interactive else BLUE
+                            )
+
+                        # Hover completo al cambiar de elemento; después solo los
+                        # campos que cambiaron según la política
+                        kind, changes = self.hover_dedup.update(element) if emit else (SAME, None)
+                        if kind != SAME and not event_filter.admit_rate():
+                            # Descartado por maxRate: el próximo hover vuelve a ser completo
+                            self.hover_dedup.reset()
+                            kind = SAME
+                        event = None
+                        if kind == NEW:
+                            event = {
+                                "event": "hover",
+                                "x": x,
+                                "y": y,
+                                "element": element
+                            }
+                        elif kind == DELTA:
+                            event = {
+                                "event": "hover_update",
+                                "x": x,
+                                "y": y,
+                                "elementId": element["elementId"],
+                                "changes": changes
+                            }
+                        if event is not None:
+                            event_filter.admit("hover")
+                            with metrics.time("hover.emit"):
+                                self.output.emit(event)
+                            self.record_event(event)
+                    else:
+                        self.overlay.remove_highlight(PRIMARY)
+                    metrics.observe("hover.total", time.perf_counter() - started)
 
                 except Exception as e:
+                    metrics.error("hover.total", e)
                     time.sleep(0.1)
         finally:
-            pythoncom.CoUninitialize()
+            self.backend.uia.uninit_thread()
+
+    def _start_prefetch(self, options: Dict):
+        buffer = PrefetchBuffer(
+            max_entries=options.get("maxEntries", 16),
+            ttl=options.get("ttl", 0.5)
+        )
+        self.prefetcher = TrajectoryPrefetcher(
+            lambda x, y: self.inspector.resolve_leaf(x, y, self._hover_fields),
+            lambda x, y: self.inspector.is_resolved(x, y, self._hover_fields),
+            buffer,
+            budget=options.get("budget", 20.0),
+            horizon=options.get("horizon", 0.05),
+            settle=options.get("settle", min(0.02, self.hover_delay / 2)),
+            has_capacity=self.inspect_pool.has_idle,
+            init_thread=self.backend.uia.init_thread,
+            uninit_thread=self.backend.uia.uninit_thread,
+            metrics=self.metrics
+        )
+        self.inspector.prefetch = buffer
+        self.prefetcher.start()
+
+    def _start_keyboard(self, options: Dict):
+        fields = self.inspector.resolve_fields(options.get("level", "standard")) | {"isPassword"}
+        self.keyboard_skipped = 0
+        self.keyboard = KeyboardTracker(
+            lambda: self.inspector.get_focused_element(fields=fields, deadline=self.command_deadline),
+            self._emit_keyboard,
+            idle_timeout=options.get("idleTimeout", 1.0),
+            max_chars=options.get("maxChars", 1000),
+            init_thread=self.backend.uia.init_thread,
+            uninit_thread=self.backend.uia.uninit_thread,
+            subscribe_focus=self.backend.uia.subscribe_focus_changes,
+            resolve_window=lambda: self.geometry.foreground()[0],
+            metrics=self.metrics
+        )
+        self.keyboard.start()
+        self.keyboard_listener = self.backend.keyboard.create_listener(
+            on_press=self.keyboard.on_press,
+            on_release=self.keyboard.on_release
+        )
+        self.keyboard_listener.start()
+
+    def _keyboard_in_target(self, event: Dict, window: Optional[int]) -> bool:
+        """¿La tecla fue a una ventana objetivo? (lo tecleado en otras
+        aplicaciones no se emite ni se graba). Sin elemento enfocado decide
+        `window`, la de primer plano al empezar la ráfaga."""
+        if not self.geometry.has_targets:
+            return True
+        bounds = (event.get("element") or {}).get("bounds")
+        if bounds:
+            return self.geometry.contains(bounds["x"] + bounds["width"] // 2,
+                                          bounds["y"] + bounds["height"] // 2)
+        if window is None:
+            window = self.geometry.foreground()[0]
+        return window in self.geometry.handles
+
+    def _emit_keyboard(self, event: Dict, timestamp: float, window: Optional[int] = None):
+        """Salida del KeyboardTracker (hilo del worker de teclado)"""
+        if not self.event_filter.wants(event["event"]):
+            return
+        if not self._keyboard_in_target(event, window):
+            self.keyboard_skipped += 1
+            return
+        self.event_filter.admit(event["event"])
+        self.output.emit(event, flush=True)
+        self.record_event(event, timestamp)
+
+    def record_event(self, event: Dict, timestamp: float = None):
+        """Graba el evento si hay una sesión activa (solo encola)"""
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record(event, timestamp)
+
+    def read_recording(self, path: str = None, start: float = None, end: float = None,
+                       event_types=None, limit: int = 1000) -> Dict:
+        """Lee un rango de una sesión grabada (por defecto la última)"""
+        path = path or self.last_recording
+        if not path:
+            raise ValueError("No hay sesión grabada")
+        reader = SessionReader(path)
+        events = list(reader.read(start, end, event_types, limit))
+        return {**reader.info(), "returned": len(events), "events": events}
+
+    def get_pending_clicks(self, max_items: int = None, cursor: int = None, reader: str = "default",
+                           session: str = None) -> Dict:
+        """Obtiene clics pendientes.
+
+        Sin cursor los extrae y borra; con cursor confirma para `reader` los
+        anteriores y devuelve los siguientes sin borrarlos (ver ClickBuffer.read).
+        """
+        buffer = self.pending_clicks
+        if cursor is None:
+            records = buffer.drain(max_items)
+            clicks = [record.to_event() for record in records]
+            return {
+                "clicks": clicks,
+                "cursor": clicks[-1]["seq"] + 1 if clicks else buffer.oldest_seq,
+                "session": buffer.session,
+                "remaining": len(buffer),
+                "missed": 0
+            }
+        records, gap, start = buffer.read(cursor, max_items, reader, session)
+        clicks = [record.to_event() for record in records]
+        next_cursor = start + len(clicks)
+        return {
+            "clicks": clicks,
+            "cursor": next_cursor,
+            "session": buffer.session,
+            "remaining": buffer.next_seq - next_cursor,
+            "missed": gap
+        }
 
-    def get_pending_clicks(self):
-        """Obtiene y limpia los clics pendientes"""
-        with self._lock:
-            clicks = self.pending_clicks.copy()
-            self.pending_clicks = []
-        return clicks
+    def configure_inspection(self, options: Dict):
+        """Ajusta el pool de inspección (ver start)"""
+        if "commandDeadline" in options:
+            self.command_deadline = float(options["commandDeadline"])
+        self.inspect_pool.configure(options)
+
+    def configure_images(self, options: Dict = None) -> ElementImager:
+        """Crea (o reemplaza) el ElementImager.
+
+        Opciones: output ("file" | "shm"), format ("png" | "jpeg"), quality,
+        directory, dedupe, threshold (bits de Hamming), padding, workers, keep.
+        """
+        options = options or {}
+        previous = self.imager
+        self.imager = ElementImager(
+            self.backend.screen,
+            output=options.get("output", "file"),
+            directory=options.get("directory"),
+            fmt=options.get("format", "png"),
+            quality=options.get("quality", 80),
+            workers=options.get("workers", 2),
+            dedupe=options.get("dedupe", True),
+            threshold=options.get("threshold", 0),
+            keep=options.get("keep", 500),
+            padding=options.get("padding", 0),
+            on_ready=lambda event: self.output.emit(event, flush=True),
+            metrics=self.metrics
+        )
+        if previous is not None:
+            previous.close()
+        return self.imager
+
+    def element_image(self, bounds: Dict) -> Optional[Dict]:
+        """Recorte del elemento (referencia; se codifica en el pool del imager),
+        sin el resaltado del overlay"""
+        imager = self.imager
+        if imager is None or not self.backend.screen.available:
+            return None
+        pad = imager.padding
+        area = (bounds["x"] - pad, bounds["y"] - pad, bounds["width"] + 2 * pad, bounds["height"] + 2 * pad)
+        with self.overlay.hidden_for_capture(area):
+            return imager.capture(bounds)
+
+    def resource_stats(self) -> Dict:
+        """Recursos vivos y colas (comando diagnostics): deben volver a su
+        nivel tras cada ráfaga de trabajo y a 0 tras stop()"""
+        pool = self.inspect_pool.stats()
+        recorder, imager = self.recorder, self.imager
+        return {
+            "overlay": self.overlay.resource_stats(),
+            "inspection": {"liveWorkers": pool["live"], "liveHung": len(pool["hung"])},
+            "output": {"queued": self.output.stats().get("queued", 0)},
+            "clicks": {"queued": self._click_queue.qsize()},
+            "recording": {"queued": recorder.stats()["queued"]} if recorder else None,
+            "images": {"queued": imager.stats()["pending"]} if imager else None
+        }
 
-    def capture_element(self, x: int, y: int) -> Optional[Dict]:
+    def capture_element(self, x: int, y: int, level: str = "full", fields=None) -> Optional[Dict]:
         """Captura un elemento en una posición específica"""
-        element = self.inspector.get_element_at_point(x, y)
+        with self.metrics.time("capture.inspect"):
+            element = self.inspector.get_element_at_point(x, y, use_cache=False, level=level, fields=fields,
+                                                          deadline=self.command_deadline)
         if element:
             element["capturedAt"] = datetime.now().isoformat()
-            print(json.dumps({
-                "event": "element_captured",
-                "element": element
-            }), flush=True)
         return element
 
 
-# Instancia global
-service = TrackingService()
-
-
-def process_command(cmd: dict):
-    """Procesa un comando recibido"""
-    action = cmd.get("action")
-
-    if action == "start":
-        handle = cmd.get("targetHandle")
-        service.start(handle)
-
-    elif action == "stop":
+def build_commands(service: TrackingService, status_extra: Callable[[], Dict] = None) -> Dict:
+    """Tabla de comandos de tracking (usada también por el daemon).
+    `status_extra` agrega campos al evento status (p.ej. estadísticas del dispatcher)."""
+    output = service.output
+
+    def cmd_start(cmd: dict):
+        protocol = cmd.get("protocol")
+        if protocol is not None and protocol not in PROTOCOLS:
+            output.emit({"error": f"Protocolo no soportado: {protocol}"}, flush=True)
+            protocol = None
+        overflow = cmd.get("clickOverflow")
+        if overflow is not None and overflow not in CLICK_POLICIES:
+            output.emit({"error": f"Política de clics no soportada: {overflow}"}, flush=True)
+            overflow = None
+        try:
+            service.start(cmd.get("targetHandles") or cmd.get("targetHandle"), cmd.get("hoverDelay"), protocol,
+                          cmd.get("clickCapacity"), overflow, cmd.get("hoverPolicy"), cmd.get("hoverLevel"),
+                          cmd.get("record"), cmd.get("targetPid"), cmd.get("images"), cmd.get("keyboard"),
+                          cmd.get("inspection"), cmd.get("prefetch"))
+        except OSError as e:
+            return {"error": f"No se pudo abrir la grabación: {e}"}
+        except ValueError as e:
+            return {"error": str(e)}
+
+    def cmd_stop(cmd: dict):
         service.stop()
 
-    elif action == "capture":
+    def cmd_capture(cmd: dict):
         x = cmd.get("x", 0)
         y = cmd.get("y", 0)
-        element = service.capture_element(x, y)
+        image = cmd.get("image")
+        if image and (service.imager is None or isinstance(image, dict)):
+            try:
+                service.configure_images(image if isinstance(image, dict) else None)
+            except ValueError as e:
+                return {"event": "capture_failed", "x": x, "y": y, "error": str(e)}
+        element = service.capture_element(x, y, cmd.get("level", "full"), cmd.get("fields"))
         if not element:
-            print(json.dumps({"event": "capture_failed", "x": x, "y": y}), flush=True)
-
-    elif action == "get_clicks":
-        clicks = service.get_pending_clicks()
-        print(json.dumps({"event": "pending_clicks", "clicks": clicks}), flush=True)
-
-    elif action == "get_element":
+            return {"event": "capture_failed", "x": x, "y": y}
+        event = {"event": "element_captured", "element": element}
+        if image and element.get("bounds"):
+            event["image"] = service.element_image(element["bounds"])
+        service.record_event(event)
+        return event
+
+    def cmd_get_clicks(cmd: dict):
+        return {"event": "pending_clicks", **service.get_pending_clicks(
+            cmd.get("max"), cmd.get("cursor"), cmd.get("reader", "default"), cmd.get("session"))}
+
+    def cmd_get_element(cmd: dict):
         x = cmd.get("x", 0)
         y = cmd.get("y", 0)
-        element = service.inspector.get_element_at_point(x, y)
-        print(json.dumps({"event": "element_info", "element": element}), flush=True)
+        with service.metrics.time("capture.inspect"):
+            element = service.inspector.get_element_at_point(
+                x, y, use_cache=False, level=cmd.get("level", "full"), fields=cmd.get("fields"),
+                deadline=service.command_deadline
+            )
+        return {"event": "element_info", "element": element}
 
-    elif action == "highlight":
+    def cmd_highlight(cmd: dict):
         x = cmd.get("x", 0)
         y = cmd.get("y", 0)
         w = cmd.get("width", 100)
         h = cmd.get("height", 100)
-        service.overlay.set_highlight(x, y, w, h, cmd.get("interactive", True))
+        service.overlay.set_highlight(x, y, w, h, GREEN if cmd.get("interactive", True) else BLUE)
 
-    elif action == "clear_highlight":
-        service.overlay.clear()
+    def cmd_clear_highlight(cmd: dict):
+        if cmd.get("highlightId") is not None:
+            service.overlay.remove_highlight(cmd["highlightId"])
+        else:
+            service.overlay.clear()
+
+    def cmd_snapshot(cmd: dict):
+        try:
+            if cmd.get("refresh"):
+                refresh = cmd["refresh"]
+                summary = service.tree.refresh(refresh if isinstance(refresh, str) else None)
+            else:
+                hwnd = (cmd.get("targetHandle") or service.target_window_handle
+                        or service.backend.window.get_foreground_window())
+                summary = service.tree.take(hwnd, cmd.get("maxDepth"), cmd.get("maxChildren"),
+                                            cmd.get("maxNodes"))
+        except Exception as e:
+            service.metrics.error("tree.snapshot", e)
+            return {"event": "snapshot_failed", "error": str(e)}
+        return {"event": "snapshot", **summary}
+
+    def cmd_find_elements(cmd: dict):
+        if service.tree.root is None and service.target_window_handle:
+            service.tree.take(service.target_window_handle)
+        query = {k: v for k, v in cmd.items() if k not in ("action", "id", "limit", "timeout")}
+        return {"event": "elements", **service.tree.find(query, cmd.get("limit", 50))}
+
+    def cmd_read_session(cmd: dict):
+        try:
+            result = service.read_recording(cmd.get("path"), cmd.get("from"), cmd.get("to"),
+                                            cmd.get("types"), cmd.get("limit", 1000))
+        except (OSError, ValueError) as e:
+            return {"event": "session_failed", "error": str(e)}
+        return {"event": "session_events", **result}
+
+    def cmd_subscribe(cmd: dict):
+        spec = {k: v for k, v in cmd.items() if k not in ("action", "id", "timeout")}
+        try:
+            event_filter = service.subscribe(spec)
+        except ValueError as e:
+            return {"error": str(e)}
+        return {"event": "subscribed", "filters": event_filter.spec()}
 
-    elif action == "status":
-        print(json.dumps({
+    def cmd_status(cmd: dict):
+        status = {
             "event": "status",
             "isTracking": service.is_tracking,
             "position": service.current_position,
-            "pendingClicks": len(service.pending_clicks)
-        }), flush=True)
-
-    elif action == "exit":
+            "pendingClicks": len(service.pending_clicks),
+            "clickBuffer": service.pending_clicks.stats(),
+            "hover": service.hover_dedup.stats(),
+            "tree": service.tree.stats(),
+            "targets": service.geometry.stats(),
+            "recording": service.recorder.stats() if service.recorder else None,
+            "images": service.imager.stats() if service.imager else None,
+            "keyboard": dict(service.keyboard.stats(), skipped=service.keyboard_skipped)
+            if service.keyboard else None,
+            "hitCache": service.inspector.cache.stats(),
+            "inspection": service.inspect_pool.stats(),
+            "prefetch": service.prefetcher.stats() if service.prefetcher else None,
+            "overlay": service.overlay.stats(),
+            "subscription": service.event_filter.stats(),
+            "errors": service.metrics.errors(),
+            "clickLatency": {
+                "queued": service._click_queue.qsize(),
+                "hookUs": service.hook_latency.summary(scale=1e6, digits=1),
+                "clickToEventMs": service.click_latency.summary()
+            },
+            "output": output.stats()
+        }
+        if status_extra:
+            status.update(status_extra())
+        return status
+
+    def cmd_startup_report(cmd: dict):
+        return startup.report(
+            service.backend.heavy_modules,
+            STARTUP_MODULES,
+            include_importtime=cmd.get("importtime", True)
+        )
+
+    def cmd_exit(cmd: dict):
         service.stop()
         sys.exit(0)
 
+    return {
+        "start": cmd_start,
+        "stop": cmd_stop,
+        "capture": cmd_capture,
+        "get_clicks": cmd_get_clicks,
+        "get_element": cmd_get_element,
+        "highlight": cmd_highlight,
+        "clear_highlight": cmd_clear_highlight,
+        "subscribe": cmd_subscribe,
+        **build_highlight_commands(service.overlay),
+        **build_metrics_commands(service.metrics),
+        **build_diagnostics_commands(service.resource_stats),
+        "status": cmd_status,
+        "startup_report": cmd_startup_report,
+        "snapshot": cmd_snapshot,
+        "find_elements": cmd_find_elements,
+        "read_session": cmd_read_session,
+        "exit": cmd_exit,
+    }
+
+
+# Comandos que inspeccionan la UI (pueden colgarse con aplicaciones lentas)
+# o que tardan por sí mismos (startup_report lanza un subproceso, diagnostics
+# toma un snapshot de tracemalloc)
+SLOW_COMMANDS = ("capture", "get_element", "startup_report", "snapshot", "find_elements", "read_session",
+                 "diagnostics")
+
+# Módulos que se importan antes de ready (para el desglose de startup_report)
+STARTUP_MODULES = ("tracking_service",)
+
 
 def main():
     """Modo servicio - lee comandos de stdin"""
-    print(json.dumps({
+    backend = get_backend()
+    output = EventWriter()
+    service = TrackingService(backend, output)
+    dispatcher = CommandDispatcher(
+        build_commands(service, lambda: {"commands": dispatcher.stats()}),
+        lambda event: output.emit(event, flush=True),
+        slow_actions=SLOW_COMMANDS,
+        worker_init=backend.uia.init_thread,
+        worker_exit=backend.uia.uninit_thread
+    )
+
+    capabilities = backend.capabilities()
+    if not capabilities["pynput"]:
+        output.emit({"warning": "pynput no disponible, usar: pip install pynput"})
+    if not capabilities["uiautomation"]:
+        output.emit({"warning": "uiautomation no disponible, usar: pip install uiautomation"})
+
+    startup.mark("ready")
+    output.emit({
         "event": "ready",
-        "pynput": PYNPUT_AVAILABLE,
-        "uiautomation": UIAUTOMATION_AVAILABLE
-    }), flush=True)
+        **capabilities,
+        "protocols": list(PROTOCOLS),
+        "startupMs": startup.elapsed_ms("ready")
+    })
+
+    # Cargar los módulos pesados en segundo plano (ALQVIMIA_PREWARM=0 lo desactiva)
+    if os.environ.get("ALQVIMIA_PREWARM", "1") != "0":
+        startup.prewarm_in_background(backend.prewarm)
+
+    # Volcado periódico de métricas (ALQVIMIA_METRICS_FILE)
+    configure_from_env()
 
     try:
-        for line in sys.stdin:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                cmd = json.loads(line)
-                process_command(cmd)
-            except json.JSONDecodeError:
-                print(json.dumps({"error": "Invalid JSON", "input": line[:100]}), flush=True)
+        dispatcher.serve(sys.stdin)
+        dispatcher.drain()
     except KeyboardInterrupt:
         service.stop()
     except Exception as e:
-        print(json.dumps({"error": str(e)}), flush=True)
+        output.emit({"error": str(e)}, flush=True)
         service.stop()
+    finally:
+        dispatcher.close()
+        # Escribir lo que quede en la cola antes de salir
+        output.close()
+        shutdown_metrics()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,331 @@
+"""
+UI Tree - Snapshot indexado del árbol UIA de la ventana objetivo
+
+El árbol se recorre una vez dentro de un presupuesto de profundidad, anchura
+y nodos, y se guarda en memoria con índices secundarios por automationId,
+name, controlType y className para responder `find_elements` sin volver a
+UI Automation. Los cambios de estructura (eventos UIA o `refresh` explícito)
+re-recorren solo el subárbol afectado.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from backends.base import WalkNode
+from hover_dedup import element_identity
+
+# Campos indexados (coincidencia exacta)
+INDEXED_FIELDS = ("automationId", "name", "controlType", "className")
+
+# Campos de los nodos (nivel standard + padre)
+NODE_FIELDS = frozenset((
+    "name", "type", "controlType", "className", "automationId", "isEnabled",
+    "isVisible", "isInteractive", "bounds", "parentName", "elementId"
+))
+
+
+class TreeNode:
+    __slots__ = ("element_id", "element", "control", "parent", "children", "depth", "truncated", "order")
+
+    def __init__(self, element: Dict, control, parent: Optional["TreeNode"], depth: int, order: int):
+        self.order = order
+        self.element_id = element["elementId"]
+        self.element = element
+        self.control = control
+        self.parent = parent
+        self.children: List["TreeNode"] = []
+        self.depth = depth
+        self.truncated = False
+
+
+class UITreeSnapshot:
+    """Árbol en memoria de una ventana con índices secundarios"""
+
+    def __init__(self, inspector, max_depth: int = 12, max_children: int = 500,
+                 max_nodes: int = 20000):
+        self.inspector = inspector
+        self.uia = inspector.uia
+        self.max_depth = max_depth
+        self.max_children = max_children
+        self.max_nodes = max_nodes
+        self.root: Optional[TreeNode] = None
+        self.window_handle: Optional[int] = None
+        self.taken_at: Optional[float] = None
+        self._nodes: Dict[str, TreeNode] = {}
+        self._indexes: Dict[str, Dict[str, Set[str]]] = {field: {} for field in INDEXED_FIELDS}
+        self._lock = threading.RLock()
+        # RuntimeId -> control del sender de cada evento de estructura pendiente
+        self._dirty: Dict[Optional[tuple], object] = {}
+        self._unsubscribe = None
+        self._next_order = 0
+        self._properties = tuple({
+            prop
+            for field in NODE_FIELDS - {"parentName"}
+            for prop in inspector.FIELD_PROPERTIES[field]
+        })
+
+        self.walks = 0
+        self.subtree_walks = 0
+        self.structure_events = 0
+
+    # -- Construcción --
+
+    def take(self, hwnd: int, max_depth: int = None, max_children: int = None,
+             max_nodes: int = None) -> Dict:
+        """Recorre la ventana `hwnd` completa y reemplaza el snapshot"""
+        if max_depth is not None:
+            self.max_depth = int(max_depth)
+        if max_children is not None:
+            self.max_children = int(max_children)
+        if max_nodes is not None:
+            self.max_nodes = int(max_nodes)
+
+        started = time.perf_counter()
+        root_control = self.uia.control_from_handle(hwnd)
+        walked = self.uia.walk(root_control, self._properties, self.max_depth,
+                               self.max_children, self.max_nodes)
+        self.walks += 1
+
+        with self._lock:
+            if self._unsubscribe:
+                self._unsubscribe()
+                self._unsubscribe = None
+            self._nodes.clear()
+            for index in self._indexes.values():
+                index.clear()
+            self._dirty.clear()
+            self.window_handle = hwnd
+            self.root = self._attach(walked, None, 0) if walked else None
+            self.taken_at = time.time()
+
+        # Refresco incremental por eventos si el backend los soporta
+        self._unsubscribe = self.uia.subscribe_structure_changes(root_control, self._on_structure_changed)
+        return self._summary(time.perf_counter() - started)
+
+    def refresh(self, element_id: str = None) -> Dict:
+        """Re-recorre el subárbol de `element_id` (o aplica los cambios pendientes)"""
+        started = time.perf_counter()
+        if element_id is not None:
+            with self._lock:
+                node = self._nodes.get(element_id)
+            if node is None:
+                raise KeyError(f"Elemento no encontrado en el snapshot: {element_id}")
+            self._rewalk(node)
+        else:
+            self.apply_pending()
+        return self._summary(time.perf_counter() - started)
+
+    def apply_pending(self):
+        """Re-recorre los subárboles marcados por eventos de estructura"""
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            full = None in dirty or self.root is None
+
+        targets = []
+        if not full:
+            for runtime_id, control in dirty.items():
+                node = self._known_ancestor(runtime_id, control)
+                if node is None:
+                    # Fuera del snapshot (o sin padre resoluble): no hay subárbol que re-recorrer
+                    full = True
+                    break
+                targets.append(node)
+
+        if full:
+            if self.window_handle is not None:
+                self.take(self.window_handle)
+            return
+        with self._lock:
+            targets = [n for n in targets if not self._has_ancestor_in(n, targets)]
+        for node in dict.fromkeys(targets):
+            self._rewalk(node)
+
+    def _known_ancestor(self, runtime_id, control) -> Optional[TreeNode]:
+        """Nodo del snapshot del sender o de su ancestro más cercano. El sender
+        de ChildAdded es el hijo nuevo, que aún no está: se sube por el padre."""
+        for _ in range(self.max_depth + 1):
+            with self._lock:
+                node = self._nodes.get(element_identity(runtime_id, {})) if runtime_id else None
+            if node is not None:
+                return node
+            parent = self.uia.parent_of(control) if control is not None else None
+            if parent is None:
+                return None
+            runtime_id, control = parent
+        return None
+
+    def _rewalk(self, node: TreeNode):
+        remaining = max(0, self.max_depth - node.depth)
+        with self._lock:
+            # El subárbol se reemplaza: su presupuesto es lo que no usa el resto del árbol
+            size = self._subtree_size(node)
+            budget = max(1, self.max_nodes - (len(self._nodes) - size))
+        walked = self.uia.walk(node.control, self._properties, remaining,
+                               self.max_children, budget)
+        self.subtree_walks += 1
+        with self._lock:
+            parent = node.parent
+            self._detach(node)
+            if walked is None:
+                if parent is not None:
+                    parent.children.remove(node)
+                return
+            replacement = self._attach(walked, parent, node.depth)
+            if parent is None:
+                self.root = replacement
+            else:
+                parent.children[parent.children.index(node)] = replacement
+
+    def _on_structure_changed(self, runtime_id, control):
+        """Callback del backend (puede llegar desde otro hilo): solo marca"""
+        with self._lock:
+            self.structure_events += 1
+            self._dirty[runtime_id] = control
+
+    def _attach(self, walked: WalkNode, parent: Optional[TreeNode], depth: int) -> TreeNode:
+        """Indexa el subárbol recorrido (con el lock tomado)"""
+        values = dict(walked.values)
+        values["ParentName"] = parent.element.get("name") if parent else None
+        self._next_order += 1
+        node = TreeNode(self.inspector.build_element(values, NODE_FIELDS), walked.control, parent, depth,
+                        self._next_order)
+        node.truncated = walked.truncated
+        self._index(node)
+        node.children = [self._attach(child, node, depth + 1) for child in walked.children]
+        return node
+
+    def _detach(self, node: TreeNode):
+        """Quita un subárbol de los índices (con el lock tomado)"""
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if self._nodes.get(current.element_id) is current:
+                del self._nodes[current.element_id]
+                for field in INDEXED_FIELDS:
+                    bucket = self._indexes[field].get(current.element.get(field))
+                    if bucket is not None:
+                        bucket.discard(current.element_id)
+                        if not bucket:
+                            del self._indexes[field][current.element.get(field)]
+            stack.extend(current.children)
+
+    def _index(self, node: TreeNode):
+        self._nodes[node.element_id] = node
+        for field in INDEXED_FIELDS:
+            value = node.element.get(field)
+            if value:
+                self._indexes[field].setdefault(value, set()).add(node.element_id)
+
+    @staticmethod
+    def _subtree_size(node: TreeNode) -> int:
+        size = 0
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            size += 1
+            stack.extend(current.children)
+        return size
+
+    @staticmethod
+    def _has_ancestor_in(node: TreeNode, nodes: Iterable[TreeNode]) -> bool:
+        candidates = set(id(n) for n in nodes)
+        current = node.parent
+        while current is not None:
+            if id(current) in candidates:
+                return True
+            current = current.parent
+        return False
+
+    # -- Consultas --
+
+    def find(self, query: Dict, limit: int = 50) -> Dict:
+        """Busca nodos. Los campos de INDEXED_FIELDS son coincidencia exacta
+        por índice; además: nameContains, type, isInteractive, isEnabled,
+        isVisible y withinElementId (descendientes de un nodo)."""
+        self.apply_pending()
+        started = time.perf_counter()
+        with self._lock:
+            candidates: Optional[Set[str]] = None
+            for field in sorted(INDEXED_FIELDS, key=lambda f: len(self._indexes[f].get(query.get(f), ()))):
+                if query.get(field) is None:
+                    continue
+                bucket = self._indexes[field].get(query[field], set())
+                candidates = set(bucket) if candidates is None else candidates & bucket
+                if not candidates:
+                    break
+
+            if candidates is not None:
+                # Orden de recorrido (los subárboles re-recorridos quedan al final)
+                nodes = sorted((self._nodes[key] for key in candidates), key=lambda n: n.order)
+            else:
+                nodes = self._nodes.values()
+            within = self._nodes.get(query["withinElementId"]) if query.get("withinElementId") else None
+            contains = (query.get("nameContains") or "").lower()
+
+            matches = []
+            total = 0
+            for node in nodes:
+                element = node.element
+                if contains and contains not in (element.get("name") or "").lower():
+                    continue
+                if any(query.get(key) is not None and element.get(key) != query[key]
+                       for key in ("type", "isInteractive", "isEnabled", "isVisible")):
+                    continue
+                if query.get("withinElementId") and (within is None or not self._is_descendant(node, within)):
+                    continue
+                total += 1
+                if len(matches) < limit:
+                    matches.append(dict(element, depth=node.depth))
+
+        return {
+            "elements": matches,
+            "total": total,
+            "queryMs": round((time.perf_counter() - started) * 1000, 3)
+        }
+
+    @staticmethod
+    def _is_descendant(node: TreeNode, ancestor: TreeNode) -> bool:
+        current = node.parent
+        while current is not None:
+            if current is ancestor:
+                return True
+            current = current.parent
+        return False
+
+    def clear(self):
+        with self._lock:
+            if self._unsubscribe:
+                self._unsubscribe()
+                self._unsubscribe = None
+            self.root = None
+            self.window_handle = None
+            self._nodes.clear()
+            for index in self._indexes.values():
+                index.clear()
+            self._dirty.clear()
+
+    def _summary(self, seconds: float) -> Dict:
+        with self._lock:
+            truncated = any(node.truncated for node in self._nodes.values())
+            depth = max((node.depth for node in self._nodes.values()), default=0)
+            return {
+                "windowHandle": self.window_handle,
+                "nodes": len(self._nodes),
+                "depth": depth,
+                "truncated": truncated,
+                "ms": round(seconds * 1000, 3)
+            }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "windowHandle": self.window_handle,
+                "nodes": len(self._nodes),
+                "walks": self.walks,
+                "subtreeWalks": self.subtree_walks,
+                "structureEvents": self.structure_events,
+                "pendingChanges": len(self._dirty),
+                "liveEvents": self._unsubscribe is not None
+            }
@@ -0,0 +1,268 @@
+"""
+Window Geometry - Geometría cacheada de las ventanas objetivo y de la
+ventana en primer plano
+
+Los rectángulos se guardan en memoria y se actualizan con eventos de ventana
+del backend (mover, redimensionar, minimizar, destruir, primer plano). Así
+las pruebas de contención del hover y de los clics no hacen GetWindowRect
+por cada evento del mouse. Un TTL acota lo viejo que puede quedar un
+rectángulo: corto si el backend no tiene eventos, largo (red de seguridad
+ante eventos perdidos) si los tiene. Los eventos incluyen los movimientos de
+la ventana en primer plano aunque no haya objetivos.
+
+Los objetivos pueden ser un conjunto de handles y/o un proceso: en modo
+proceso las ventanas nuevas del proceso (diálogos, popups) se incorporan
+al recibir sus eventos create/show.
+"""
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from backends.base import WindowBackend
+from metrics import REGISTRY, StageMetrics
+
+Rect = Tuple[int, int, int, int]
+
+
+class WindowGeometry:
+    """Rectángulos de las ventanas objetivo y de la de primer plano"""
+
+    def __init__(self, window: WindowBackend, ttl: float = 0.25, event_ttl: float = 5.0,
+                 metrics: StageMetrics = None):
+        self.window = window
+        self.ttl = ttl
+        self.event_ttl = event_ttl
+        self.metrics = metrics or REGISTRY
+        self._lock = threading.Lock()
+        self._handles: Set[int] = set()     # handles pedidos explícitamente
+        self._pid: Optional[int] = None
+        self._targeted = False
+        self._rects: Dict[int, Rect] = {}
+        self._hidden: Set[int] = set()
+        # (left, top, right, bottom, hwnd) de las ventanas visibles; se
+        # reemplaza entero en cada cambio para leerlo sin lock
+        self._boxes: Tuple[Tuple[int, int, int, int, int], ...] = ()
+        self._refreshed_at = 0.0
+        self._enumerate = False
+        self._foreground: Optional[Tuple[int, Optional[Rect]]] = None
+        self._foreground_at = 0.0
+        self._unsubscribe = None
+
+        self.refreshes = 0
+        self.events = 0
+        self.hits = 0
+        self.misses = 0
+
+    # -- Objetivos --
+
+    def set_targets(self, handles: Iterable[int] = None, pid: int = None):
+        """Reemplaza los objetivos (y las suscripciones a eventos)"""
+        self.clear()
+        handles = {int(h) for h in (handles or ()) if h}
+        pids = {int(pid)} if pid else set()
+        for hwnd in handles:
+            owner = self.window.window_process(hwnd)
+            if owner:
+                pids.add(owner)
+
+        with self._lock:
+            self._handles = handles
+            self._pid = int(pid) if pid else None
+            self._targeted = bool(handles) or self._pid is not None
+            self._enumerate = self._pid is not None
+        self._refresh_all()
+
+        # También sin objetivos: los eventos de primer plano sirven a la caché de hit-test
+        self._unsubscribe = self.window.subscribe_window_events(pids, self._on_event)
+
+    def clear(self):
+        unsubscribe, self._unsubscribe = self._unsubscribe, None
+        if unsubscribe:
+            unsubscribe()
+        with self._lock:
+            self._handles = set()
+            self._pid = None
+            self._targeted = False
+            self._rects = {}
+            self._hidden = set()
+            self._boxes = ()
+            self._foreground = None
+            self._enumerate = False
+
+    @property
+    def has_targets(self) -> bool:
+        """True si se pidieron objetivos (aunque sus ventanas ya no existan)"""
+        return self._targeted
+
+    @property
+    def live(self) -> bool:
+        """True si la geometría se actualiza por eventos"""
+        return self._unsubscribe is not None
+
+    @property
+    def primary(self) -> Optional[int]:
+        """Handle principal (el menor explícito, o la primera ventana del proceso)"""
+        with self._lock:
+            if self._handles:
+                return min(self._handles)
+            return next(iter(self._rects), None)
+
+    @property
+    def handles(self) -> Tuple[int, ...]:
+        with self._lock:
+            return tuple(self._rects)
+
+    # -- Consultas (en memoria) --
+
+    def contains(self, x: int, y: int) -> bool:
+        """¿El punto cae en alguna ventana objetivo? (True si no hay objetivos)"""
+        if not self.has_targets:
+            return True
+        return self.window_at(x, y) is not None
+
+    def window_at(self, x: int, y: int) -> Optional[int]:
+        """Ventana objetivo que contiene el punto (la primera en orden de alta)"""
+        self._maybe_refresh()
+        for left, top, right, bottom, hwnd in self._boxes:
+            if left <= x <= right and top <= y <= bottom:
+                self.hits += 1
+                return hwnd
+        self.misses += 1
+        return None
+
+    def rect(self, hwnd: int) -> Optional[Rect]:
+        self._maybe_refresh()
+        return self._rects.get(hwnd)
+
+    def foreground(self) -> Tuple[int, Optional[Rect]]:
+        """(hwnd, rect) de la ventana en primer plano"""
+        cached = self._foreground
+        if cached is not None and time.monotonic() - self._foreground_at < self._ttl():
+            return cached
+        hwnd = self.window.get_foreground_window()
+        return self._set_foreground(hwnd)
+
+    def context(self) -> Tuple:
+        """Contexto de validez de la caché de hit-test: primer plano y
+        geometría de los objetivos"""
+        foreground, fg_rect = self.foreground()
+        self._maybe_refresh()
+        return (foreground, fg_rect, self._boxes)
+
+    # -- Actualización --
+
+    def _ttl(self) -> float:
+        return self.event_ttl if self._unsubscribe is not None else self.ttl
+
+    def _maybe_refresh(self):
+        if not self.has_targets:
+            return
+        if self._enumerate or time.monotonic() - self._refreshed_at >= self._ttl():
+            self._refresh_all()
+
+    def _refresh_all(self):
+        started = time.perf_counter()
+        with self._lock:
+            handles = set(self._handles)
+            pid = self._pid
+            self._enumerate = False
+        if pid is not None:
+            try:
+                handles.update(self.window.process_windows(pid))
+            except Exception as e:
+                self.metrics.error("geometry.refresh", e)
+
+        rects = {}
+        for hwnd in sorted(handles):
+            rect = self._fetch(hwnd)
+            if rect is not None:
+                rects[hwnd] = rect
+        with self._lock:
+            # Un handle explícito que ya no existe deja de ser objetivo
+            self._handles &= set(rects) | (self._handles - handles)
+            self._rects = rects
+            self._hidden &= set(rects)
+            self._rebuild_locked()
+            self._refreshed_at = time.monotonic()
+        self.refreshes += 1
+        self.metrics.observe("geometry.refresh", time.perf_counter() - started)
+
+    def _fetch(self, hwnd: int) -> Optional[Rect]:
+        try:
+            return tuple(self.window.get_window_rect(hwnd))
+        except Exception as e:
+            self.metrics.error("geometry.refresh", e)
+            return None
+
+    def _rebuild_locked(self):
+        self._boxes = tuple(
+            (rect[0], rect[1], rect[2], rect[3], hwnd)
+            for hwnd, rect in self._rects.items() if hwnd not in self._hidden
+        )
+
+    def _set_foreground(self, hwnd: int) -> Tuple[int, Optional[Rect]]:
+        rect = self._fetch(hwnd) if hwnd else None
+        value = (hwnd, rect)
+        self._foreground = value
+        self._foreground_at = time.monotonic()
+        return value
+
+    def _on_event(self, kind: str, hwnd: int):
+        """Callback de eventos de ventana (hilo del hook del backend)"""
+        self.events += 1
+        if kind == "foreground":
+            self._set_foreground(hwnd)
+            return
+
+        foreground = self._foreground
+        if foreground is not None and foreground[0] == hwnd:
+            if kind == "destroy":
+                self._foreground = None
+            else:
+                self._set_foreground(hwnd)
+
+        with self._lock:
+            known = hwnd in self._rects
+            if kind == "destroy":
+                if known or hwnd in self._handles:
+                    self._rects.pop(hwnd, None)
+                    self._handles.discard(hwnd)
+                    self._hidden.discard(hwnd)
+                    self._rebuild_locked()
+                return
+            if not known:
+                if kind in ("create", "show") and self._pid is not None:
+                    # Ventana nueva del proceso: se enumera en la próxima consulta
+                    self._enumerate = True
+                return
+            if kind == "hide":
+                self._hidden.add(hwnd)
+                self._rebuild_locked()
+                return
+
+        rect = self._fetch(hwnd)
+        with self._lock:
+            if hwnd not in self._rects:
+                return
+            if rect is None:
+                self._rects.pop(hwnd)
+            else:
+                self._rects[hwnd] = rect
+            if kind == "show":
+                self._hidden.discard(hwnd)
+            self._rebuild_locked()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "targets": [
+                    {"handle": hwnd, "rect": list(rect), "visible": hwnd not in self._hidden}
+                    for hwnd, rect in self._rects.items()
+                ],
+                "pid": self._pid,
+                "live": self._unsubscribe is not None,
+                "refreshes": self.refreshes,
+                "events": self.events,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -180,8 +180,8 @@ io.on('connection', (socket) => {
   })
 
   socket.on('tracking:capture', async (data) => {
-    const { x, y } = data
-    const result = await trackingService.captureElement(x, y)
+    const { x, y, image } = data
+    const result = await trackingService.captureElement(x, y, { image })
     socket.emit('tracking:element-captured', result)
   })
 })
@@ -350,9 +350,9 @@ app.post('/api/spy/element', (req, res) => {
 // Iniciar el servicio de tracking
 app.post('/api/tracking/start', async (req, res) => {
   try {
-    const { targetHandle } = req.body
+    const { targetHandle, targetPid, record, images, keyboard, inspection, prefetch } = req.body
 
-    console.log('[Tracking] Iniciando servicio de tracking...', { targetHandle })
+    console.log('[Tracking] Iniciando servicio de tracking...', { targetHandle, targetPid, record: !!record })
 
     // Iniciar el servicio Python si no está corriendo
     if (!trackingService.isRunning) {
@@ -360,7 +360,7 @@ app.post('/api/tracking/start', async (req, res) => {
     }
 
     // Iniciar tracking
-    const result = trackingService.startTracking(targetHandle || null)
+    const result = await trackingService.startTracking(targetHandle || null, { targetPid, record, images, keyboard, inspection, prefetch })
 
     res.json({ success: true, ...result })
   } catch (error) {
@@ -385,6 +385,66 @@ app.get('/api/tracking/status', (req, res) => {
   res.json({ success: true, ...status })
 })
 
+// Leer una sesión grabada por rango de tiempo
+app.get('/api/tracking/session', async (req, res) => {
+  try {
+    const num = (value) => (value == null ? undefined : Number(value))
+    const result = await trackingService.readSession({
+      path: req.query.path,
+      from: num(req.query.from),
+      to: num(req.query.to),
+      types: req.query.types ? String(req.query.types).split(',') : undefined,
+      limit: num(req.query.limit)
+    })
+    res.json(result)
+  } catch (error) {
+    res.status(500).json({ success: false, error: error.message })
+  }
+})
+
+// Latencias y errores por etapa (?format=prometheus devuelve texto plano)
+app.get('/api/tracking/metrics', async (req, res) => {
+  try {
+    const prometheus = req.query.format === 'prometheus'
+    const result = await trackingService.getMetrics({
+      format: prometheus ? 'prometheus' : undefined,
+      reset: req.query.reset === '1'
+    })
+    if (prometheus && result.success) {
+      res.type('text/plain; version=0.0.4').send(result.prometheus)
+      return
+    }
+    res.json(result)
+  } catch (error) {
+    res.status(500).json({ success: false, error: error.message })
+  }
+})
+
+// Diagnóstico de fugas: heap (tracemalloc), hilos y recursos vivos
+app.get('/api/tracking/diagnostics', async (req, res) => {
+  try {
+    const result = await trackingService.getDiagnostics({
+      reset: req.query.reset === '1',
+      stopTrace: req.query.stopTrace === '1',
+      top: req.query.top ? parseInt(req.query.top) : undefined,
+      history: req.query.history === '1'
+    })
+    res.json(result)
+  } catch (error) {
+    res.status(500).json({ success: false, error: error.message })
+  }
+})
+
+// Filtros de eventos evaluados en el servicio (tipos, interactivos, región, tasa)
+app.post('/api/tracking/subscribe', async (req, res) => {
+  try {
+    const result = await trackingService.subscribe(req.body || {})
+    res.status(result.success ? 200 : 400).json(result)
+  } catch (error) {
+    res.status(500).json({ success: false, error: error.message })
+  }
+})
+
 // Obtener elemento en una posición
 app.get('/api/tracking/element', async (req, res) => {
   try {
@@ -401,9 +461,9 @@ app.get('/api/tracking/element', async (req, res) => {
 // Capturar elemento en una posición
 app.post('/api/tracking/capture', async (req, res) => {
   try {
-    const { x, y } = req.body
+    const { x, y, image } = req.body
 
-    const result = await trackingService.captureElement(x, y)
+    const result = await trackingService.captureElement(x, y, { image })
     res.json(result)
   } catch (error) {
     res.status(500).json({ success: false, error: error.message })
@@ -431,9 +491,31 @@ app.post('/api/tracking/highlight', (req, res) => {
   }
 })
 
-// Limpiar highlight
+// Limpiar highlight (todos, o uno por highlightId)
 app.post('/api/tracking/clear-highlight', (req, res) => {
-  trackingService.clearHighlight()
+  trackingService.clearHighlight(req.body?.highlightId)
+  res.json({ success: true })
+})
+
+// Resaltar varios elementos a la vez
+app.post('/api/tracking/highlights', async (req, res) => {
+  try {
+    const { highlights, replace } = req.body
+    const ids = await trackingService.highlightMany(highlights || [], replace !== false)
+    res.json({ success: true, highlightIds: ids })
+  } catch (error) {
+    res.status(500).json({ success: false, error: error.message })
+  }
+})
+
+// Actualizar o quitar un highlight por id
+app.patch('/api/tracking/highlights/:id', (req, res) => {
+  trackingService.updateHighlight(req.params.id, req.body || {})
+  res.json({ success: true })
+})
+
+app.delete('/api/tracking/highlights/:id', (req, res) => {
+  trackingService.removeHighlights([req.params.id])
   res.json({ success: true })
 })
 
@@ -1120,6 +1202,16 @@ trackingService.on('element_captured', (element) => {
   io.emit('tracking:element-captured', { success: true, element })
 })
 
+// Texto tecleado (coalescido por elemento), teclas especiales y atajos
+trackingService.on('keyboard', (data) => {
+  io.emit('tracking:keyboard', data)
+})
+
+// Recorte de un elemento ya codificado (ruta o bloque de memoria compartida)
+trackingService.on('element_image', (data) => {
+  io.emit('tracking:element-image', data)
+})
+
 // Función de inicio del servidor
 async function startServer() {
   // Intentar conectar a la base de datos
@@ -4,6 +4,9 @@
  */
 
 import { spawn } from 'child_process'
+import fs from 'fs'
+import net from 'net'
+import os from 'os'
 import path from 'path'
 import { fileURLToPath } from 'url'
 import { EventEmitter } from 'events'
@@ -11,6 +14,105 @@ import { EventEmitter } from 'events'
 const __filename = fileURLToPath(import.meta.url)
 const __dirname = path.dirname(__filename)
 
+// Registros del protocolo binario (ver server/python/protocol.py)
+const RECORD_JSON = 0x01
+const RECORD_HOVER = 0x02
+const RECORD_HOVER_ID = 0x03
+const NULL_STR = 0xFFFF
+const ABSENT_STR = 0xFFFE
+const HOVER_STRINGS = ['name', 'type', 'controlType', 'className', 'automationId', 'value', 'parentName']
+const HOVER_ID_STRINGS = [...HOVER_STRINGS, 'elementId']
+
+/**
+ * Token del daemon por TCP: TRACKING_DAEMON_TOKEN, o el fichero que deja
+ * daemon_service.py (TRACKING_DAEMON_TOKEN_FILE o su ruta por defecto)
+ */
+function daemonToken() {
+  if (process.env.TRACKING_DAEMON_TOKEN) return process.env.TRACKING_DAEMON_TOKEN
+  let file = process.env.TRACKING_DAEMON_TOKEN_FILE
+  if (!file) {
+    let dir = process.env.ALQVIMIA_RUNTIME_DIR
+    if (!dir) {
+      if (process.platform === 'win32') {
+        dir = path.join(process.env.LOCALAPPDATA || os.tmpdir(), 'Alqvimia')
+      } else if (process.env.XDG_RUNTIME_DIR) {
+        dir = path.join(process.env.XDG_RUNTIME_DIR, 'alqvimia')
+      } else {
+        dir = path.join(os.tmpdir(), `alqvimia-${os.userInfo().username}`)
+      }
+    }
+    file = path.join(dir, 'daemon.token')
+  }
+  try {
+    return fs.readFileSync(file, 'utf-8').trim()
+  } catch {
+    return null
+  }
+}
+
+/**
+ * Decodifica los registros de un frame binario
+ */
+function decodeRecords(payload) {
+  const messages = []
+  let offset = 0
+
+  while (offset < payload.length) {
+    const kind = payload[offset]
+
+    if (kind === RECORD_JSON) {
+      const length = payload.readUInt32LE(offset + 1)
+      offset += 5
+      messages.push(JSON.parse(payload.toString('utf8', offset, offset + length)))
+      offset += length
+    } else if (kind === RECORD_HOVER || kind === RECORD_HOVER_ID) {
+      const x = payload.readInt32LE(offset + 1)
+      const y = payload.readInt32LE(offset + 5)
+      const bounds = {
+        x: payload.readInt32LE(offset + 9),
+        y: payload.readInt32LE(offset + 13),
+        width: payload.readInt32LE(offset + 17),
+        height: payload.readInt32LE(offset + 21)
+      }
+      const flags = payload[offset + 25]
+      offset += 26
+
+      const strings = {}
+      for (const key of (kind === RECORD_HOVER_ID ? HOVER_ID_STRINGS : HOVER_STRINGS)) {
+        const length = payload.readUInt16LE(offset)
+        offset += 2
+        if (length === ABSENT_STR) {
+          continue
+        } else if (length === NULL_STR) {
+          strings[key] = null
+        } else {
+          strings[key] = payload.toString('utf8', offset, offset + length)
+          offset += length
+        }
+      }
+
+      // Los campos ausentes (no resueltos por el nivel de detalle) no se incluyen
+      const element = {}
+      for (const key of ['name', 'type', 'controlType', 'className', 'automationId', 'value']) {
+        if (key in strings) element[key] = strings[key]
+      }
+      element.isEnabled = Boolean(flags & 1)
+      element.isVisible = Boolean(flags & 2)
+      element.isInteractive = Boolean(flags & 4)
+      element.bounds = bounds
+      for (const key of ['parentName', 'elementId']) {
+        if (key in strings) element[key] = strings[key]
+      }
+
+      messages.push({ event: 'hover', x, y, element })
+    } else {
+      throw new Error(`Tipo de registro desconocido: ${kind}`)
+    }
+  }
+
+  return messages
+}
+
 class TrackingService extends EventEmitter {
   constructor() {
     super()
@@ -20,17 +122,40 @@ class TrackingService extends EventEmitter {
     this.pendingClicks = []
     this.lastElement = null
     this.targetWindowHandle = null
+    // Protocolo preferido: 'json' (por defecto) o 'binary'
+    this.preferredProtocol = process.env.TRACKING_PROTOCOL || 'json'
+    this.protocols = ['json']
+    this.protocol = 'json'
+    this._rxBuffer = Buffer.alloc(0)
+    // Peticiones en vuelo correlacionadas por id
+    this._nextRequestId = 1
+    this._pendingRequests = new Map()
+    // Siguiente seq de clic a pedir (get_clicks con cursor) y sesión del buffer
+    // a la que pertenece: un cursor de otra sesión no confirma nada
+    this._clickCursor = 0
+    this._clickSession = null
+    // Conexión al daemon compartido (TRACKING_DAEMON="127.0.0.1:47821" o "unix:/ruta")
+    this.daemonAddress = process.env.TRACKING_DAEMON || null
+    this.connection = null
   }
 
   /**
    * Inicia el proceso de Python
    */
   async start() {
-    if (this.process) {
+    if (this.process || this.connection) {
       console.log('[TrackingService] Proceso ya está corriendo')
       return { success: true, message: 'Ya está corriendo' }
     }
 
+    if (this.daemonAddress) {
+      try {
+        return await this._connectDaemon(this.daemonAddress)
+      } catch (error) {
+        console.warn('[TrackingService] Daemon no disponible, iniciando proceso propio:', error.message)
+      }
+    }
+
     const pythonScript = path.join(__dirname, '..', 'python', 'tracking_service.py')
 
     return new Promise((resolve, reject) => {
@@ -43,17 +168,9 @@ class TrackingService extends EventEmitter {
           stdio: ['pipe', 'pipe', 'pipe']
         })
 
-        this.process.stdout.on('data', (data) => {
-          const lines = data.toString().split('\n').filter(l => l.trim())
-          for (const line of lines) {
-            try {
-              const msg = JSON.parse(line)
-              this._handleMessage(msg)
-            } catch (e) {
-              console.log('[TrackingService] Output:', line)
-            }
-          }
-        })
+        this.protocol = 'json'
+        this._rxBuffer = Buffer.alloc(0)
+        this.process.stdout.on('data', (data) => this._onData(data))
 
         this.process.stderr.on('data', (data) => {
           console.error('[TrackingService] Error:', data.toString())
@@ -73,17 +190,7 @@ class TrackingService extends EventEmitter {
           reject(err)
         })
 
-        // Esperar a que esté listo
-        const readyTimeout = setTimeout(() => {
-          reject(new Error('Timeout esperando que el servicio esté listo'))
-        }, 10000)
-
-        this.once('ready', (info) => {
-          clearTimeout(readyTimeout)
-          this.isRunning = true
-          console.log('[TrackingService] Servicio listo:', info)
-          resolve({ success: true, ...info })
-        })
+        this._waitReady(resolve, reject, 10000)
 
       } catch (error) {
         reject(error)
@@ -91,11 +198,82 @@ class TrackingService extends EventEmitter {
     })
   }
 
+  /**
+   * Se conecta al daemon compartido (daemon_service.py) en lugar de
+   * arrancar un proceso nuevo; reiniciar una sesión cuesta solo la reconexión
+   */
+  _connectDaemon(address) {
+    const unix = address.startsWith('unix:')
+    const options = unix
+      ? { path: address.slice('unix:'.length) }
+      : { host: address.slice(0, address.lastIndexOf(':')) || '127.0.0.1', port: Number(address.slice(address.lastIndexOf(':') + 1)) }
+
+    return new Promise((resolve, reject) => {
+      const connection = net.createConnection(options)
+      let connected = false
+
+      connection.once('connect', () => {
+        connected = true
+        this.connection = connection
+        this.protocol = 'json'
+        this._rxBuffer = Buffer.alloc(0)
+        if (!unix) {
+          // Por TCP el primer comando debe llevar el token del daemon
+          connection.write(JSON.stringify({ action: 'auth', token: daemonToken() }) + '\n')
+          this.once('auth_failed', (msg) => reject(new Error(msg.error)))
+        }
+        this._waitReady(resolve, reject, 5000)
+      })
+
+      connection.on('data', (data) => this._onData(data))
+
+      connection.on('close', () => {
+        if (this.connection === connection) {
+          console.log('[TrackingService] Conexión con el daemon cerrada')
+          this.connection = null
+          this.isRunning = false
+          this.isTracking = false
+          this.emit('closed', 0)
+        }
+      })
+
+      connection.on('error', (err) => {
+        if (!connected) {
+          reject(err)
+        } else {
+          console.error('[TrackingService] Error en conexión con el daemon:', err.message)
+        }
+      })
+    })
+  }
+
+  /**
+   * Espera el evento 'ready' del servicio
+   */
+  _waitReady(resolve, reject, timeoutMs) {
+    const readyTimeout = setTimeout(() => {
+      reject(new Error('Timeout esperando que el servicio esté listo'))
+    }, timeoutMs)
+
+    this.once('ready', (info) => {
+      clearTimeout(readyTimeout)
+      this.isRunning = true
+      this.protocols = info.protocols || ['json']
+      console.log('[TrackingService] Servicio listo:', info)
+      resolve({ success: true, ...info })
+    })
+  }
+
   /**
    * Detiene el proceso de Python
    */
   stop() {
-    if (this.process) {
+    if (this.connection) {
+      // En el daemon 'exit' solo cierra esta conexión
+      this._sendCommand({ action: 'exit' })
+      this.connection.end()
+      this.connection = null
+    } else if (this.process) {
       this._sendCommand({ action: 'exit' })
       setTimeout(() => {
         if (this.process) {
@@ -109,20 +287,46 @@ class TrackingService extends EventEmitter {
   }
 
   /**
-   * Inicia el tracking de mouse y overlay
+   * Inicia el tracking de mouse y overlay.
+   * targetWindowHandle: un handle o un array de handles (multi-ventana)
+   * options.targetPid: sigue todas las ventanas del proceso (también diálogos nuevos)
+   * options.images: true o { output: 'file' | 'shm', format, directory, padding, threshold }
+   * para adjuntar a cada clic el recorte del elemento (por referencia, ver 'element_image')
+   * options.keyboard: true o { idleTimeout, maxChars, level } para emitir 'keyboard'
+   * con el texto tecleado por elemento (type), teclas especiales (key) y atajos (shortcut)
+   * options.record: true, una ruta o { path, chunkEvents, chunkSeconds, events }
+   * para grabar la sesión en disco
+   * options.inspection: { workers, deadline, commandDeadline, hedgeAfter, quarantine }
+   * (segundos) para el pool de inspección que acota la espera a apps colgadas
+   * options.prefetch: true o { budget, horizon, settle, ttl, maxEntries } para
+   * resolver por adelantado el elemento donde se espera que pare el cursor
    */
-  startTracking(targetWindowHandle = null) {
+  startTracking(targetWindowHandle = null, options = {}) {
     if (!this.isRunning) {
       console.log('[TrackingService] Servicio no está corriendo, iniciando...')
-      return this.start().then(() => this.startTracking(targetWindowHandle))
+      return this.start().then(() => this.startTracking(targetWindowHandle, options))
     }
 
     this.targetWindowHandle = targetWindowHandle
-    this._sendCommand({
+    const cmd = {
       action: 'start',
       targetHandle: targetWindowHandle
-    })
+    }
+    if (options.targetPid) cmd.targetPid = options.targetPid
+    if (options.record) cmd.record = options.record
+    if (options.images) cmd.images = options.images
+    if (options.keyboard) cmd.keyboard = options.keyboard
+    if (options.inspection) cmd.inspection = options.inspection
+    if (options.prefetch) cmd.prefetch = options.prefetch
+    // Negociar el protocolo solo si el servicio lo anunció en 'ready'
+    if (this.preferredProtocol !== 'json' && this.protocols.includes(this.preferredProtocol)) {
+      cmd.protocol = this.preferredProtocol
+    }
+    this._sendCommand(cmd)
     this.isTracking = true
+    // El servicio reinicia la numeración de clics en cada start
+    this._clickCursor = 0
+    this._clickSession = null
 
     return { success: true, message: 'Tracking iniciado' }
   }
@@ -137,46 +341,37 @@ class TrackingService extends EventEmitter {
   }
 
   /**
-   * Captura un elemento en una posición
+   * Captura un elemento en una posición.
+   * options.image: true (o las opciones de imagen de startTracking) para
+   * incluir el recorte del elemento; la ruta llega en `image.path` y el
+   * evento 'element_image' avisa cuando está escrita
    */
-  captureElement(x, y) {
-    return new Promise((resolve) => {
-      const handler = (element) => {
-        if (element) {
-          resolve({ success: true, element })
-        }
-      }
-
-      this.once('element_captured', handler)
-
-      this._sendCommand({ action: 'capture', x, y })
-
-      // Timeout
-      setTimeout(() => {
-        this.off('element_captured', handler)
-        resolve({ success: false, error: 'Timeout capturando elemento' })
-      }, 5000)
-    })
+  async captureElement(x, y, options = {}) {
+    const cmd = { action: 'capture', x, y }
+    if (options.image) cmd.image = options.image
+    const msg = await this._request(cmd, 5000)
+
+    if (msg && msg.event === 'element_captured' && msg.element) {
+      return msg.image
+        ? { success: true, element: msg.element, image: msg.image }
+        : { success: true, element: msg.element }
+    }
+    if (msg && msg.event === 'capture_failed') {
+      return { success: false, error: 'No se encontró elemento en la posición' }
+    }
+    return { success: false, error: 'Timeout capturando elemento' }
   }
 
   /**
    * Obtiene información del elemento en una posición
    */
-  getElementAt(x, y) {
-    return new Promise((resolve) => {
-      const handler = (data) => {
-        resolve({ success: true, element: data.element })
-      }
-
-      this.once('element_info', handler)
-
-      this._sendCommand({ action: 'get_element', x, y })
+  async getElementAt(x, y) {
+    const msg = await this._request({ action: 'get_element', x, y }, 3000)
 
-      setTimeout(() => {
-        this.off('element_info', handler)
-        resolve({ success: false, error: 'Timeout' })
-      }, 3000)
-    })
+    if (msg && msg.event === 'element_info') {
+      return { success: true, element: msg.element }
+    }
+    return { success: false, error: msg?.error || 'Timeout' }
   }
 
   /**
@@ -192,28 +387,108 @@ class TrackingService extends EventEmitter {
   /**
    * Limpia el highlight
    */
-  clearHighlight() {
-    this._sendCommand({ action: 'clear_highlight' })
+  clearHighlight(highlightId = null) {
+    this._sendCommand(highlightId == null
+      ? { action: 'clear_highlight' }
+      : { action: 'clear_highlight', highlightId })
+  }
+
+  /**
+   * Resalta varios elementos a la vez.
+   * highlights: [{ id?, x, y, width, height, color?, label?, borderWidth? }]
+   * Devuelve los ids asignados (para actualizarlos o quitarlos después)
+   */
+  async highlightMany(highlights, replace = true) {
+    const msg = await this._request({ action: 'highlight_many', highlights, replace }, 1000)
+    return (msg && msg.highlightIds) || []
+  }
+
+  /**
+   * Modifica un resaltado existente (posición, tamaño, color o etiqueta)
+   */
+  updateHighlight(highlightId, fields) {
+    this._sendCommand({ action: 'update_highlight', highlightId, ...fields })
+  }
+
+  /**
+   * Quita uno o varios resaltados por id
+   */
+  removeHighlights(highlightIds) {
+    this._sendCommand({ action: 'remove_highlight', highlightIds })
+  }
+
+  /**
+   * Declara qué eventos se quieren recibir; el servicio descarta el resto
+   * antes de serializarlos. filters: { events, interactiveOnly, controlTypes,
+   * classNames, region, maxRate }. Sin filtros vuelve a recibir todo
+   */
+  async subscribe(filters = {}) {
+    const msg = await this._request({ action: 'subscribe', ...filters }, 1000)
+    if (msg && msg.event === 'subscribed') {
+      return { success: true, filters: msg.filters }
+    }
+    return { success: false, error: msg?.error || 'Timeout' }
   }
 
   /**
    * Obtiene los clics pendientes
    */
-  getPendingClicks() {
-    return new Promise((resolve) => {
-      const handler = (data) => {
-        resolve(data.clicks || [])
-      }
+  async getPendingClicks(max = 500) {
+    // Con cursor el servicio solo borra los clics ya confirmados: si esta
+    // respuesta se pierde por timeout, la siguiente los vuelve a traer
+    const cmd = { action: 'get_clicks', cursor: this._clickCursor, max }
+    if (this._clickSession) cmd.session = this._clickSession
+    const msg = await this._request(cmd, 1000)
+    if (!msg) return []
+    if (typeof msg.cursor === 'number') {
+      this._clickCursor = msg.cursor
+      this._clickSession = msg.session || null
+    }
+    if (msg.missed) {
+      console.warn(`[TrackingService] ${msg.missed} clics descartados por el buffer del servicio`)
+    }
+    return msg.clicks || []
+  }
 
-      this.once('pending_clicks', handler)
+  /**
+   * Lee eventos de una sesión grabada (por defecto la última) en el rango
+   * de tiempo [from, to] (segundos epoch)
+   */
+  async readSession({ path, from, to, types, limit } = {}) {
+    const msg = await this._request({ action: 'read_session', path, from, to, types, limit }, 10000)
+    if (msg && msg.event === 'session_events') {
+      const { event, id, ...session } = msg
+      return { success: true, ...session }
+    }
+    return { success: false, error: msg?.error || 'Timeout' }
+  }
 
-      this._sendCommand({ action: 'get_clicks' })
+  /**
+   * Latencias (p50/p95/p99 en ms) y errores por etapa del pipeline.
+   * format 'prometheus' agrega el texto de exportación
+   */
+  async getMetrics({ format, reset } = {}) {
+    const msg = await this._request({ action: 'metrics', format, reset: !!reset }, 2000)
+    if (msg && msg.event === 'metrics') {
+      const { event, id, ...metrics } = msg
+      return { success: true, ...metrics }
+    }
+    return { success: false, error: msg?.error || 'Timeout' }
+  }
 
-      setTimeout(() => {
-        this.off('pending_clicks', handler)
-        resolve([])
-      }, 1000)
-    })
+  /**
+   * Crecimiento del heap, hilos vivos y recursos (DCs/objetos GDI, workers,
+   * colas) con su historial. trends marca las series que crecen sin parar
+   */
+  async getDiagnostics({ reset, stopTrace, top, history } = {}) {
+    const msg = await this._request({
+      action: 'diagnostics', reset: !!reset, stopTrace: !!stopTrace, top, history: !!history
+    }, 10000)
+    if (msg && msg.event === 'diagnostics') {
+      const { event, id, ...diagnostics } = msg
+      return { success: true, ...diagnostics }
+    }
+    return { success: false, error: msg?.error || 'Timeout' }
   }
 
   /**
@@ -228,12 +503,81 @@ class TrackingService extends EventEmitter {
     }
   }
 
+  /**
+   * Envía un comando con id y espera su respuesta.
+   * Resuelve con el mensaje de respuesta, o null si vence el timeout.
+   * El timeout también se envía al servicio para que libere el comando.
+   */
+  _request(cmd, timeoutMs) {
+    return new Promise((resolve) => {
+      const id = this._nextRequestId++
+      const timer = setTimeout(() => {
+        this._pendingRequests.delete(id)
+        resolve(null)
+      }, timeoutMs)
+
+      this._pendingRequests.set(id, (msg) => {
+        clearTimeout(timer)
+        resolve(msg)
+      })
+
+      this._sendCommand({ ...cmd, id, timeout: timeoutMs / 1000 })
+    })
+  }
+
   /**
    * Envía un comando al proceso Python
    */
   _sendCommand(cmd) {
-    if (this.process && this.process.stdin.writable) {
-      this.process.stdin.write(JSON.stringify(cmd) + '\n')
+    const input = this.connection || (this.process && this.process.stdin)
+    if (input && input.writable) {
+      input.write(JSON.stringify(cmd) + '\n')
+    }
+  }
+
+  /**
+   * Procesa stdout del proceso Python en el protocolo vigente.
+   * Los datos se acumulan porque un chunk puede cortar una línea o un frame.
+   */
+  _onData(data) {
+    this._rxBuffer = this._rxBuffer.length ? Buffer.concat([this._rxBuffer, data]) : data
+
+    while (this._rxBuffer.length) {
+      let messages
+
+      if (this.protocol === 'binary') {
+        if (this._rxBuffer.length < 4) break
+        const length = this._rxBuffer.readUInt32BE(0)
+        if (this._rxBuffer.length < 4 + length) break
+        const payload = this._rxBuffer.subarray(4, 4 + length)
+        this._rxBuffer = this._rxBuffer.subarray(4 + length)
+        try {
+          messages = decodeRecords(payload)
+        } catch (e) {
+          console.error('[TrackingService] Frame inválido:', e.message)
+          continue
+        }
+      } else {
+        const newline = this._rxBuffer.indexOf(0x0a)
+        if (newline === -1) break
+        const line = this._rxBuffer.toString('utf8', 0, newline).trim()
+        this._rxBuffer = this._rxBuffer.subarray(newline + 1)
+        if (!line) continue
+        try {
+          messages = [JSON.parse(line)]
+        } catch (e) {
+          console.log('[TrackingService] Output:', line)
+          continue
+        }
+      }
+
+      for (const msg of messages) {
+        // tracking_started marca el cambio de protocolo para los bytes siguientes
+        if (msg.event === 'tracking_started' && msg.protocol) {
+          this.protocol = msg.protocol
+        }
+        this._handleMessage(msg)
+      }
     }
   }
 
@@ -243,6 +587,12 @@ class TrackingService extends EventEmitter {
   _handleMessage(msg) {
     const event = msg.event
 
+    if (msg.id !== undefined && this._pendingRequests.has(msg.id)) {
+      const resolve = this._pendingRequests.get(msg.id)
+      this._pendingRequests.delete(msg.id)
+      resolve(msg)
+    }
+
     switch (event) {
       case 'ready':
         this.emit('ready', msg)
@@ -263,6 +613,15 @@ class TrackingService extends EventEmitter {
         this.emit('hover', msg)
         break
 
+      case 'hover_update':
+        // Delta sobre el último hover completo: se reconstruye el elemento
+        // para que los consumidores sigan recibiendo 'hover' completos
+        if (this.lastElement && this.lastElement.elementId === msg.elementId) {
+          this.lastElement = { ...this.lastElement, ...msg.changes }
+          this.emit('hover', { event: 'hover', x: msg.x, y: msg.y, element: this.lastElement })
+        }
+        break
+
       case 'click':
         this.pendingClicks.push(msg)
         this.emit('click', msg)
@@ -276,6 +635,16 @@ class TrackingService extends EventEmitter {
         this.emit('element_info', msg)
         break
 
+      case 'element_image':
+        this.emit('element_image', msg)
+        break
+
+      case 'type':
+      case 'key':
+      case 'shortcut':
+        this.emit('keyboard', msg)
+        break
+
       case 'pending_clicks':
         this.emit('pending_clicks', msg)
         break
@@ -284,6 +653,18 @@ class TrackingService extends EventEmitter {
         this.emit('status', msg)
         break
 
+      case 'ack':
+        break
+
+      case 'auth_failed':
+        this.emit('auth_failed', msg)
+        break
+
+      case 'command_timeout':
+      case 'command_error':
+        console.warn(`[TrackingService] ${msg.action}: ${msg.error}`)
+        break
+
       default:
         if (msg.error) {
           console.error('[TrackingService] Error:', msg.error)